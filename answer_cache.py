@@ -0,0 +1,305 @@
+# answer_cache.py
+import logging
+import re
+import threading
+import time
+
+import db
+from cache import normalize_query
+
+# --- CONFIGURATION ---
+ANSWER_CACHE_DB = "answer_cache.db"  # Separate from the task data so it can be deleted at any time.
+SIMILARITY_THRESHOLD = 0.92  # Cosine similarity a cached question needs to be reused.
+MAX_ENTRIES = 2000
+MAX_BYTES = 32 * 1024 * 1024  # Questions, answers and vectors combined.
+WRITE_TOOLS = frozenset({"AddTask"})  # Turns that use these tools are never cached.
+NAMES_REFRESH_SECONDS = 60  # How long the project/user name list from `names_fn` is reused.
+
+# Requests that change data. They are never answered from a cache or merged with another request.
+WRITE_INTENT = re.compile(
+    r"\b(add|create|new|assign|reassign|update|change|set|mark|move|delete|remove|close|rename)\b",
+    re.IGNORECASE,
+)
+# Follow-ups that only make sense with the conversation history ("what about that one?").
+CONTEXT_DEPENDENT = re.compile(
+    r"\b(it|its|that|those|them|this|these|he|she|they|his|her|their|above|previous|again|else|"
+    r"(first|second|third|last|other) one)\b",
+    re.IGNORECASE,
+)
+# Questions about the asker ("what are my tasks?"). The cache is shared by every user, so their
+# answers would be served to someone else.
+FIRST_PERSON = re.compile(r"\b(i|me|my|mine|myself|we|us|our|ours)\b", re.IGNORECASE)
+# Words an embedding barely tells apart but that change the answer ("task 12" / "task 13", "high" /
+# "low priority"). Together with the project and user names mentioned, they must match exactly.
+KEY_TERMS = re.compile(
+    r"\d+|\b(to ?do|in progress|done|completed|finished|open|closed|overdue|high|medium|low|urgent|"
+    r"today|tomorrow|yesterday|week|month|year|monday|tuesday|wednesday|thursday|friday|saturday|sunday|"
+    r"january|february|march|april|may|june|july|august|september|october|november|december)\b",
+    re.IGNORECASE,
+)
+
+SQL_CREATE_ANSWERS = """
+CREATE TABLE IF NOT EXISTS answers (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    query TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    embedding BLOB NOT NULL,
+    embedding_model TEXT NOT NULL,
+    key_terms TEXT NOT NULL,
+    data_version INTEGER NOT NULL,
+    size_bytes INTEGER NOT NULL,
+    last_used_at REAL NOT NULL
+);
+"""
+SQL_ANSWER_COLUMNS = "PRAGMA table_info(answers)"
+SQL_DROP_ANSWERS = "DROP TABLE IF EXISTS answers"
+SQL_LOAD_ANSWERS = (
+    "SELECT id, embedding, embedding_model, key_terms, data_version, size_bytes, last_used_at FROM answers"
+)
+SQL_GET_ANSWER = "SELECT answer FROM answers WHERE id = ?"
+SQL_INSERT_ANSWER = (
+    "INSERT INTO answers (query, answer, embedding, embedding_model, key_terms, data_version, size_bytes, "
+    "last_used_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+)
+SQL_TOUCH_ANSWER = "UPDATE answers SET last_used_at = ? WHERE id = ?"
+
+logger = logging.getLogger(__name__)
+
+
+def is_write_request(query: str) -> bool:
+    """ True if the query looks like it asks the agent to change data. """
+    return bool(WRITE_INTENT.search(query))
+
+
+def is_cacheable_query(query: str) -> bool:
+    """ Only self-contained, read-only questions that do not depend on who asks may share answers. """
+    return not is_write_request(query) and not CONTEXT_DEPENDENT.search(query) and not FIRST_PERSON.search(query)
+
+
+class SemanticAnswerCache:
+    """
+    Reuses agent answers for questions that mean the same thing.
+
+    Normalized questions are embedded with the knowledge base's MiniLM model
+    and compared by cosine similarity against every cached question. The index
+    is a brute-force scan over one in-memory matrix, which for a few thousand
+    384-dimensional vectors takes well under a millisecond, so no separate ANN
+    library is needed. A cached answer is only returned when the similarity is
+    at least `threshold`, the key terms of both questions (numbers, statuses,
+    priorities, dates and the project/user names from `names_fn`) are the
+    same, and the data version it was produced under is still current;
+    entries from older versions are dropped when met, as are entries embedded
+    with another model than `model_fn` names (a re-index switched it). Entries are
+    persisted in SQLite and evicted least-recently-used first once the cache
+    exceeds `max_entries` or `max_bytes`.
+    """
+
+    def __init__(self, embed_fn, version_fn, db_file: str = ANSWER_CACHE_DB,
+                 threshold: float = SIMILARITY_THRESHOLD, max_entries: int = MAX_ENTRIES,
+                 max_bytes: int = MAX_BYTES, names_fn=None, model_fn=None):
+        self.embed_fn = embed_fn  # Maps a query string to its embedding (a list of floats).
+        self.version_fn = version_fn
+        self.names_fn = names_fn  # Returns the known project and user names, or None to ignore names.
+        self.model_fn = model_fn  # Returns the name of the model `embed_fn` currently uses.
+        self.db_file = db_file
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._ids = []
+        self._vectors = None  # numpy matrix of unit-length rows, aligned with _ids.
+        self._entries = {}  # id -> {"embedding_model", "key_terms", "data_version", "size_bytes", "last_used_at"}
+        self._bytes = 0
+        self._loaded = False
+        self._entries_model = None  # Once set, every entry was embedded with this model.
+        self._name_words = frozenset()
+        self._names_loaded_at = None
+        self._stats = {"hits": 0, "misses": 0, "stale": 0, "mismatched": 0, "stores": 0, "evictions": 0,
+                       "skipped": 0}
+
+    # --- STORAGE ---
+    def _connection(self):
+        return db.get_pool(self.db_file).connection()
+
+    def _load(self):
+        import numpy as np
+
+        with self._connection() as conn:
+            columns = {row["name"] for row in conn.execute(SQL_ANSWER_COLUMNS)}
+            if columns and not {"embedding_model", "key_terms"} <= columns:
+                # Written by an older version; a cache can simply start over.
+                logger.info("Answer cache has an old layout; starting it afresh.")
+                conn.execute(SQL_DROP_ANSWERS)
+            conn.execute(SQL_CREATE_ANSWERS)
+            rows = conn.execute(SQL_LOAD_ANSWERS).fetchall()
+        self._ids = [row["id"] for row in rows]
+        self._vectors = (np.vstack([np.frombuffer(row["embedding"], dtype=np.float32) for row in rows])
+                         if rows else None)
+        self._entries = {
+            row["id"]: {"embedding_model": row["embedding_model"], "key_terms": row["key_terms"],
+                        "data_version": row["data_version"], "size_bytes": row["size_bytes"],
+                        "last_used_at": row["last_used_at"]}
+            for row in rows
+        }
+        self._bytes = sum(entry["size_bytes"] for entry in self._entries.values())
+        self._entries_model = None
+        self._loaded = True
+        logger.info("Loaded %d cached answers.", len(rows))
+
+    def _embed(self, query: str):
+        import numpy as np
+
+        vector = np.asarray(self.embed_fn(normalize_query(query)), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _key_terms(self, query: str) -> str:
+        """ The question's numbers, status/priority/date words and known names, as a canonical string. """
+        text = normalize_query(query)
+        terms = {match.group(0).replace(" ", "") for match in KEY_TERMS.finditer(text)}
+        if self.names_fn is not None:
+            now = time.monotonic()
+            if self._names_loaded_at is None or now - self._names_loaded_at >= NAMES_REFRESH_SECONDS:
+                self._name_words = frozenset(word for name in self.names_fn()
+                                             for word in re.findall(r"\w+", name.lower()) if len(word) > 2)
+                self._names_loaded_at = now
+            terms.update(word for word in re.findall(r"\w+", text) if word in self._name_words)
+        return " ".join(sorted(terms))
+
+    def _model(self) -> str:
+        return self.model_fn() if self.model_fn is not None else ""
+
+    def _drop_other_model(self, conn, vector, model: str):
+        """ Drops the entries embedded with another model than `model`; their vectors cannot be compared. """
+        if model == self._entries_model and (self._vectors is None or self._vectors.shape[1] == vector.shape[0]):
+            return
+        self._entries_model = model
+        if self._vectors is None:
+            return
+        if self._vectors.shape[1] != vector.shape[0]:
+            other = list(self._ids)
+        else:
+            other = [entry_id for entry_id in self._ids if self._entries[entry_id]["embedding_model"] != model]
+        if other:
+            logger.info("Embedding model changed to '%s'; dropping %d cached answers.", model, len(other))
+            self._remove(conn, other)
+
+    def _remove(self, conn, entry_ids: list[int]):
+        import numpy as np
+
+        if not entry_ids:
+            return
+        conn.executemany("DELETE FROM answers WHERE id = ?", [(entry_id,) for entry_id in entry_ids])
+        removed = set(entry_ids)
+        keep = [i for i, entry_id in enumerate(self._ids) if entry_id not in removed]
+        self._ids = [self._ids[i] for i in keep]
+        self._vectors = self._vectors[np.array(keep, dtype=np.intp)] if keep else None
+        for entry_id in entry_ids:
+            self._bytes -= self._entries.pop(entry_id)["size_bytes"]
+
+    # --- LOOKUP ---
+    def lookup(self, query: str) -> str | None:
+        """ Returns a cached answer for a question with the same meaning, or None. """
+        import numpy as np
+
+        if not is_cacheable_query(query):
+            with self._lock:
+                self._stats["skipped"] += 1
+            return None
+        vector = self._embed(query)
+        model = self._model()
+        version = self.version_fn()
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            key_terms = self._key_terms(query)
+            with self._connection() as conn:
+                self._drop_other_model(conn, vector, model)
+            if self._vectors is None:
+                self._stats["misses"] += 1
+                return None
+            scores = self._vectors @ vector
+            close = [int(i) for i in np.flatnonzero(scores >= self.threshold)]
+            if not close:
+                self._stats["misses"] += 1
+                return None
+            # The closest question that also names the same IDs, statuses, dates and people.
+            matching = [i for i in close if self._entries[self._ids[i]]["key_terms"] == key_terms]
+            if not matching:
+                self._stats["mismatched"] += 1
+                return None
+            best = max(matching, key=lambda i: scores[i])
+            entry_id = self._ids[best]
+            with self._connection() as conn:
+                if self._entries[entry_id]["data_version"] != version:
+                    # The task data changed since this answer was produced.
+                    self._remove(conn, [entry_id])
+                    self._stats["stale"] += 1
+                    return None
+                now = time.time()
+                self._entries[entry_id]["last_used_at"] = now
+                conn.execute(SQL_TOUCH_ANSWER, (now, entry_id))
+                row = conn.execute(SQL_GET_ANSWER, (entry_id,)).fetchone()
+            self._stats["hits"] += 1
+        logger.info("Hit for '%s' (similarity %.3f).", query, scores[best])
+        return row["answer"] if row else None
+
+    def store(self, query: str, answer: str, data_version: int, tools_used=()):
+        """
+        Caches an answer produced under `data_version`. Turns that used a write
+        tool, or whose question depends on the conversation, are not cached.
+        """
+        import numpy as np
+
+        if WRITE_TOOLS.intersection(tools_used) or not is_cacheable_query(query):
+            with self._lock:
+                self._stats["skipped"] += 1
+            return
+        vector = self._embed(query)
+        model = self._model()
+        embedding = vector.tobytes()
+        size_bytes = len(query.encode()) + len(answer.encode()) + len(embedding)
+        now = time.time()
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            key_terms = self._key_terms(query)
+            with self._connection() as conn:
+                with db.transaction(conn):
+                    self._drop_other_model(conn, vector, model)
+                    cursor = conn.execute(SQL_INSERT_ANSWER, (query, answer, embedding, model, key_terms,
+                                                              data_version, size_bytes, now))
+                    entry_id = cursor.lastrowid
+                    self._ids.append(entry_id)
+                    self._vectors = vector[None, :] if self._vectors is None else np.vstack([self._vectors, vector])
+                    self._entries[entry_id] = {"embedding_model": model, "key_terms": key_terms,
+                                               "data_version": data_version, "size_bytes": size_bytes,
+                                               "last_used_at": now}
+                    self._bytes += size_bytes
+                    self._stats["stores"] += 1
+                    self._evict(conn)
+
+    def _evict(self, conn):
+        """ Drops least-recently-used entries until both limits are met. """
+        if len(self._entries) <= self.max_entries and self._bytes <= self.max_bytes:
+            return
+        victims = []
+        count, size = len(self._entries), self._bytes
+        for entry_id, entry in sorted(self._entries.items(), key=lambda item: item[1]["last_used_at"]):
+            if count <= self.max_entries and size <= self.max_bytes:
+                break
+            victims.append(entry_id)
+            count -= 1
+            size -= entry["size_bytes"]
+        self._remove(conn, victims)
+        self._stats["evictions"] += len(victims)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"] + self._stats["stale"] + self._stats["mismatched"]
+            return {
+                "size": len(self._entries),
+                "bytes": self._bytes,
+                **self._stats,
+                "hit_rate": self._stats["hits"] / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,255 @@
+# benchmark.py
+# Micro-benchmarks for the retrieval, sync and tool code paths.
+#
+# Builds seeded databases of several sizes in a temporary directory, indexes
+# them into a throwaway vector store and times each step. Runs fully offline by
+# default: embeddings come from LangChain's DeterministicFakeEmbedding, so the
+# numbers measure this repository's code rather than the model. Pass
+# --embedding minilm to include the real model, and --backend numpy to measure
+# the NumPy index instead of Chroma.
+#
+#   python benchmark.py --sizes 1000,10000 --output bench_results.json --baseline bench_baseline.json
+#   python benchmark.py --output bench_chroma.json && \
+#     python benchmark.py --backend numpy --output bench_numpy.json --baseline bench_chroma.json
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import db
+import setup_db
+from memory_manager import (apply_update_batch, format_task_as_document, get_all_task_documents,
+                            sync_vector_store)
+from vector_index import open_vector_store
+
+# --- CONFIGURATION ---
+DEFAULT_SIZES = "1000,10000"
+SEED = 1234
+EMBEDDING_DIMENSIONS = 384  # Same as all-MiniLM-L6-v2.
+EMBED_BATCH_SIZE = 256
+EMBED_BATCHES = 8
+RETRIEVER_QUERIES = 200
+VECTOR_SEARCH_K = 12  # What the hybrid retriever asks the vector store for (k * CANDIDATES_PER_RETRIEVER).
+UPDATE_SAMPLES = 50
+TOOL_SAMPLES = 200
+DEFAULT_TOLERANCE = 0.25  # Relative slowdown tolerated before a metric counts as a regression.
+
+
+def percentiles(samples: list[float]) -> dict:
+    """ p50/p95/p99 of latency samples, in milliseconds. """
+    ordered = sorted(samples)
+
+    def pick(p):
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000
+
+    return {"p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99)}
+
+
+def timed(fn, *args, **kwargs) -> float:
+    start = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def make_embeddings(kind: str):
+    if kind == "minilm":
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+    return DeterministicFakeEmbedding(size=EMBEDDING_DIMENSIONS)
+
+
+def build_database(path: str, num_tasks: int, seed: int):
+    conn = setup_db.create_connection(path)
+    with contextlib.redirect_stdout(io.StringIO()):
+        setup_db.setup_database_schema(conn)
+        setup_db.generate_fake_data(conn, max(3, num_tasks // 500), max(5, num_tasks // 100), num_tasks, seed,
+                                    bulk=True)
+    conn.close()
+
+
+def quiet(fn, *args, **kwargs):
+    """ Calls fn with its console output discarded (the tools print progress lines). """
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn(*args, **kwargs)
+
+
+def run_size(num_tasks: int, workdir: str, embeddings, seed: int, backend: str = "chroma") -> dict:
+    """ Runs every benchmark against a fresh database of `num_tasks` tasks. """
+    import merged_agent
+    from knowledge_base import KnowledgeBase
+
+    db_file = os.path.join(workdir, f"tasks_{num_tasks}.db")
+    chroma_dir = os.path.join(workdir, f"{backend}_{num_tasks}")
+    os.makedirs(chroma_dir, exist_ok=True)
+    results = {}
+    rng = random.Random(seed)
+
+    started = time.perf_counter()
+    build_database(db_file, num_tasks, seed)
+    results["build_db_seconds"] = time.perf_counter() - started
+    pool = db.get_pool(db_file)
+
+    # 1. Formatting rows into Documents.
+    with pool.connection() as conn:
+        rows = conn.execute(db.SQL_ALL_TASKS).fetchall()
+    seconds = timed(lambda: [format_task_as_document(row) for row in rows])
+    results["format_docs_per_sec"] = len(rows) / seconds
+
+    # 2. Full scan into Documents.
+    with pool.connection() as conn:
+        results["scan_all_seconds"] = timed(get_all_task_documents, conn)
+
+    # 3. Embedding throughput.
+    with pool.connection() as conn:
+        texts = [doc.page_content for doc in get_all_task_documents(conn)[:EMBED_BATCH_SIZE * EMBED_BATCHES]]
+    batches = [texts[i:i + EMBED_BATCH_SIZE] for i in range(0, len(texts), EMBED_BATCH_SIZE)]
+    seconds = timed(lambda: [embeddings.embed_documents(batch) for batch in batches])
+    results["embed_batches_per_sec"] = len(batches) / seconds
+    results["embed_docs_per_sec"] = len(texts) / seconds
+
+    # 4. Initial sync: a full build, then a re-sync where nothing changed.
+    vector_store = open_vector_store(chroma_dir, embeddings, backend=backend)
+    with pool.connection() as conn:
+        results["initial_sync_seconds"] = timed(quiet, sync_vector_store, conn, vector_store)
+        results["noop_sync_seconds"] = timed(quiet, sync_vector_store, conn, vector_store)
+
+    # 4b. Cold open of the populated store, and raw nearest-neighbour search with and without a filter.
+    results["open_store_seconds"] = timed(open_vector_store, chroma_dir, embeddings, backend=backend)
+    query_vectors = embeddings.embed_documents([row["title"] for row in rng.sample(rows, min(RETRIEVER_QUERIES, len(rows)))])
+    samples = [timed(vector_store.similarity_search_by_vector, vector, k=VECTOR_SEARCH_K) for vector in query_vectors]
+    results["vector_search"] = percentiles(samples)
+    samples = [timed(vector_store.similarity_search_by_vector, vector, k=VECTOR_SEARCH_K, filter={"status": "Done"})
+               for vector in query_vectors]
+    results["vector_search_filtered"] = percentiles(samples)
+
+    # 5. Applying a single-task update.
+    samples = []
+    for task_id in rng.sample(range(1, num_tasks + 1), min(UPDATE_SAMPLES, num_tasks)):
+        with pool.connection() as conn:
+            conn.execute("UPDATE tasks SET status = ? WHERE id = ?", (rng.choice(db.TASK_STATUSES), task_id))
+            samples.append(timed(quiet, apply_update_batch, conn, vector_store, {task_id: "update"}))
+    results["single_update"] = percentiles(samples)
+
+    # 6. Retriever latency, with distinct queries so caches do not hide the work.
+    knowledge_base = KnowledgeBase(persist_directory=chroma_dir, db_file=db_file, embeddings=embeddings, backend=backend)
+    knowledge_base.warm_up()
+    merged_agent.knowledge_base = knowledge_base
+    queries = [f"{row['title']} {row['assignee_name'] or ''}".strip() for row in rng.sample(rows, min(RETRIEVER_QUERIES, len(rows)))]
+    samples = [timed(quiet, merged_agent.knowledge_base_retriever, query) for query in queries]
+    results["retriever"] = percentiles(samples)
+
+    # 7. Tool latency.
+    merged_agent.DB_FILE = db_file
+    merged_agent.memory_queue = None
+    samples = [timed(quiet, merged_agent.list_users, "") for _ in range(TOOL_SAMPLES)]
+    results["list_users"] = percentiles(samples)
+    with pool.connection() as conn:
+        project = conn.execute("SELECT name FROM projects LIMIT 1").fetchone()[0]
+        user = conn.execute("SELECT name FROM users LIMIT 1").fetchone()[0]
+    samples = [timed(quiet, merged_agent.add_task, f"Benchmark task {i}", project, user) for i in range(TOOL_SAMPLES)]
+    results["add_task"] = percentiles(samples)
+
+    knowledge_base._lexical_executor.shutdown()
+    db.close_pools()
+    return results
+
+
+def flatten(results: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "."))
+        else:
+            flat[name] = value
+    return flat
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Returns a line per metric that is worse than the baseline by more than
+    `tolerance`. Throughputs (*_per_sec) must not drop; everything else is a
+    duration and must not grow.
+    """
+    regressions = []
+    current, baseline = flatten(current["results"]), flatten(baseline["results"])
+    for name, old in sorted(baseline.items()):
+        new = current.get(name)
+        if new is None or not old or name.endswith("build_db_seconds"):
+            continue
+        higher_is_better = name.endswith("_per_sec")
+        change = (old - new) / old if higher_is_better else (new - old) / old
+        if change > tolerance:
+            regressions.append(f"{name}: {old:.4g} -> {new:.4g} ({change:+.0%} worse)")
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the offline micro-benchmarks.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Comma-separated task counts.")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--embedding", choices=("fake", "minilm"), default="fake",
+                        help="'fake' runs offline with DeterministicFakeEmbedding.")
+    parser.add_argument("--backend", choices=("chroma", "numpy"), default="chroma", help="Vector store to measure.")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="Compare against this results file; exits 1 on regressions.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--save-baseline", action="store_true", help="Also write the results to --baseline.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    embeddings = make_embeddings(args.embedding)
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "embedding": args.embedding,
+            "backend": args.backend,
+            "seed": args.seed,
+        },
+        "results": {},
+    }
+    workdir = tempfile.mkdtemp(prefix="crucible_bench_")
+    try:
+        for size in (int(size) for size in args.sizes.split(",")):
+            print(f"[Benchmark] {size} tasks...", flush=True)
+            report["results"][str(size)] = run_size(size, workdir, embeddings, args.seed, args.backend)
+            print(json.dumps(report["results"][str(size)], indent=2), flush=True)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"[Benchmark] Results written to {args.output}.")
+
+    if args.baseline:
+        if args.save_baseline:
+            with open(args.baseline, "w") as f:
+                json.dump(report, f, indent=2)
+            print(f"[Benchmark] Baseline saved to {args.baseline}.")
+            return
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"[Benchmark] {len(regressions)} regression(s) beyond {args.tolerance:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("[Benchmark] No regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
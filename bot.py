@@ -1,15 +1,33 @@
 import discord
 import os
 import asyncio
+import logging
 import multiprocessing
+import time
 from dotenv import load_dotenv
 
-# Import the functions and classes from your agent and memory scripts
-from merged_agent import initialize_agent, invoke_agent, set_memory_queue
+# Import the functions and classes from your agent and memory scripts.
+# These modules defer their heavy imports (LangChain, torch, chromadb) until
+# the components are initialized, so importing them here is cheap.
+from merged_agent import (initialize_agent, initialize_knowledge_base, ainvoke_agent, cached_answer,
+                          set_memory_queue, set_data_version, set_embeddings, set_llm_gate, wait_for_llm_server,
+                          knowledge_base_stats, answer_cache_stats)
 from memory_manager import memory_worker
-
-# --- NEW IMPORTS for Conversational Memory ---
-from langchain.memory import ConversationBufferWindowMemory
+from embedding_server import EMBEDDING_ADDRESS, EMBEDDING_MODEL, remote_embeddings, serve_embeddings
+from vector_index import active_collection
+from router import FastPathRouter
+from conversation import ConversationStore
+from answer_cache import is_cacheable_query
+from startup import Readiness, start_component
+from concurrency import AgentLanes
+from streaming import DiscordStreamer, split_message, stream_stats
+from prompt_budget import prompt_stats
+from scheduler import (AgentScheduler, QueueFullError, RequestExpiredError,
+                       PRIORITY_DM, PRIORITY_ROLE, PRIORITY_DEFAULT)
+from telemetry import (configure_logging, metrics, span, start_metrics_collector,
+                       start_metrics_server)
+from freshness import lag_stats, start_lag_monitor
+import db
 
 # --- REMOVED ---
 # from prompt_context import PromptContext
@@ -17,9 +35,11 @@ from langchain.memory import ConversationBufferWindowMemory
 # --- DISCORD BOT SETUP ---
 load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
+logger = logging.getLogger("bot")
 
 if not TOKEN:
-    print("FATAL ERROR: DISCORD_TOKEN not found in .env file.")
+    configure_logging()
+    logger.critical("DISCORD_TOKEN not found in .env file.")
     exit()
 
 intents = discord.Intents.default()
@@ -28,8 +48,75 @@ intents.message_content = True
 
 client = discord.Client(intents=intents)
 
-# This dictionary will store a separate memory object for each user.
-memory_per_user = {}
+# Each user's conversation; only recently active ones stay in memory, the rest
+# are kept in SQLite and loaded again when the user comes back.
+conversations = ConversationStore(db.DB_FILE)
+
+# Answers common read-only requests straight from SQL, before the agent is involved.
+router = FastPathRouter(db.DB_FILE)
+
+# Tracks the concurrently started components; the bot answers once all have settled.
+readiness = Readiness()
+MEMORY_WORKER_READY_TIMEOUT = 600  # Seconds to wait for the worker's initial sync.
+EMBEDDING_SERVER_READY_TIMEOUT = 300  # Seconds to wait for the embedding model to load.
+
+# One process holds the embedding model for the agent and the memory worker and
+# batches their requests together; set to 0 to load the model in each process instead.
+SHARED_EMBEDDINGS = os.getenv('SHARED_EMBEDDINGS', '1') != '0'
+
+# One FIFO lane per user keeps each conversation's turns in order, and a global
+# cap keeps the local LLM server from being flooded.
+lanes = AgentLanes()
+
+# Bounded, prioritised queue in front of the agent; see scheduler.py.
+# Members with one of these (comma-separated) Discord roles are served before others.
+PRIORITY_ROLES = {role.strip() for role in os.getenv('PRIORITY_ROLES', '').split(',') if role.strip()}
+data_version_value = None  # Set in main(); identical questions only merge within one data version.
+
+# Show agent answers while they are generated (placeholder message + throttled edits).
+STREAM_RESPONSES = os.getenv('STREAM_RESPONSES', '1') != '0'
+
+
+def current_data_version() -> int:
+    return data_version_value.value if data_version_value is not None else 0
+
+
+async def run_agent_turn(job) -> str:
+    """
+    Runs one scheduled agent job inside the asking user's lane and the global
+    LLM limit, then records the exchange in the user's memory. Only the same
+    user's repeated question is merged into a job, so it is recorded once.
+    """
+    async with lanes.user_lane(job.user_id):
+        async with lanes.llm_slot():
+            started = time.perf_counter()
+            with span("agent.turn", waiters=len(job.waiters)):
+                agent_response = await ainvoke_agent(job.query, job.memory, on_token=job.publish_token,
+                                                     conversation_id=job.user_id)
+            router.record_agent_run(time.perf_counter() - started)
+
+        # Manually save the context to the memory object for the next turn,
+        # and write the conversation through to SQLite.
+        job.memory.save_context(
+            {"input": job.query},
+            {"output": agent_response}
+        )
+        await asyncio.to_thread(conversations.save, job.user_id, job.memory)
+    return agent_response
+
+
+scheduler = AgentScheduler(run_agent_turn, version_fn=current_data_version)
+
+# Component statistics are served as gauges next to the traced spans.
+metrics.add_collector("scheduler", scheduler.stats)
+metrics.add_collector("conversations", conversations.stats)
+metrics.add_collector("streaming", stream_stats)
+metrics.add_collector("prompt", prompt_stats)
+metrics.add_collector("index_lag", lag_stats)
+metrics.add_collector("router", router.stats)
+metrics.add_collector("knowledge_base", knowledge_base_stats)
+metrics.add_collector("answer_cache", answer_cache_stats)
+metrics.add_collector("lanes", lanes.stats)
 
 
 @client.event
@@ -37,9 +124,11 @@ async def on_ready():
     """
     This function runs when the bot has successfully connected to Discord.
     """
-    print(f'Bot logged in as {client.user}')
-    print('Crucible AI Agent is ready and listening.')
-    print('---')
+    logger.info("Bot logged in as %s", client.user)
+    if readiness.is_ready():
+        logger.info("Crucible AI Agent is ready and listening.")
+    else:
+        logger.info("Connected; still starting: %s.", ', '.join(readiness.pending()))
 
 
 @client.event
@@ -53,89 +142,244 @@ async def on_message(message):
 
     # 2. Check if the bot was mentioned in the message
     if client.user.mentioned_in(message):
-        
-        user_id = message.author.id
-        
-        # 3. Get or create a ConversationBufferWindowMemory object for the user.
-        if user_id not in memory_per_user:
-            print(f"Creating new conversation memory for user: {message.author.name} ({user_id})")
-            memory_per_user[user_id] = ConversationBufferWindowMemory(
-                k=5, # Keep the last 5 exchanges
-                memory_key="chat_history", # This must match the key in the prompt
-                return_messages=True # Ensure it returns message objects
+
+        # Only answer once every component has finished starting up.
+        if not readiness.is_ready():
+            await message.channel.send(
+                f"I'm still starting up (waiting for: {', '.join(readiness.pending())}). Please try again in a moment."
             )
+            return
 
-        user_memory = memory_per_user[user_id]
-        
-        async with message.channel.typing():
-            print(f"Received query from {message.author}: {message.content}")
+        received_at = time.perf_counter()
+        metrics.inc("crucible_messages_total", help="Discord mentions handled.")
+        with span("discord.message", chars=len(message.content)):
+            await handle_query(message, received_at)
 
-            # 4. Clean the message content to get the pure query.
-            bot_display_name = f'@{client.user.name}'
-            clean_query = message.clean_content.replace(bot_display_name, '').strip()
 
-            if message.guild and message.guild.me.nick:
-                 bot_nickname = f'@{message.guild.me.nick}'
-                 clean_query = clean_query.replace(bot_nickname, '').strip()
+async def handle_query(message, received_at: float):
+    """ Answers one mention, from the fast path or the agent; runs inside the message's trace span. """
+    user_id = message.author.id
 
-            print(f"Cleaned query: '{clean_query}'")
-            
-            # 5. Invoke the agent, passing the user's query and their unique memory object.
-            try:
-                # Run the synchronous agent invocation in a separate thread.
-                agent_response = await asyncio.to_thread(invoke_agent, clean_query, user_memory)
+    # 3. Get or load the user's ConversationMemory (recent turns verbatim,
+    #    older ones summarised, all within the history token budget).
+    with span("memory.load"):
+        user_memory = await asyncio.to_thread(conversations.get, user_id)
 
-                # 6. Manually save the context to the memory object for the next turn
-                user_memory.save_context(
-                    {"input": clean_query},
-                    {"output": agent_response}
-                )
+    logger.info("Received query from %s: %s", message.author, message.content)
 
-            except Exception as e:
-                print(f"Error invoking agent via asyncio.to_thread: {e}")
-                agent_response = "I'm sorry, a critical error occurred while I was thinking."
+    # 4. Clean the message content to get the pure query.
+    bot_display_name = f'@{client.user.name}'
+    clean_query = message.clean_content.replace(bot_display_name, '').strip()
 
-            # 7. Send the agent's response back to the Discord channel
-            await message.channel.send(agent_response)
-            print(f"Sent response to {message.author}")
-            print("---")
+    if message.guild and message.guild.me.nick:
+         bot_nickname = f'@{message.guild.me.nick}'
+         clean_query = clean_query.replace(bot_nickname, '').strip()
+
+    logger.debug("Cleaned query: '%s'", clean_query)
+
+    # 5. Try the fast path first: it answers from SQL without queueing for the LLM.
+    try:
+        with span("router.fast_path"):
+            routed = await asyncio.to_thread(router.route, clean_query)
+    except Exception as e:
+        logger.warning("Error in fast-path router: %s", e)
+        routed = None
+    if routed:
+        async with lanes.user_lane(user_id):
+            user_memory.save_context({"input": clean_query}, {"output": routed.answer})
+            await asyncio.to_thread(conversations.save, user_id, user_memory)
+        with span("discord.send", chars=len(routed.answer)):
+            for chunk in split_message(routed.answer):
+                await message.channel.send(chunk)
+        metrics.inc("crucible_responses_total", help="Answers sent, by path.", path="fast_path")
+        logger.info("Sent fast-path response to %s", message.author)
+        return
+
+    # 6. An answer to an equivalent earlier question skips the queue and the LLM too.
+    cached = await asyncio.to_thread(cached_answer, clean_query, user_id)
+    if cached is not None:
+        async with lanes.user_lane(user_id):
+            user_memory.save_context({"input": clean_query}, {"output": cached})
+            await asyncio.to_thread(conversations.save, user_id, user_memory)
+        with span("discord.send", chars=len(cached)):
+            for chunk in split_message(cached):
+                await message.channel.send(chunk)
+        metrics.inc("crucible_responses_total", path="answer_cache")
+        logger.info("Sent cached response to %s", message.author)
+        return
+
+    # 7. Otherwise queue an agent run. A user's identical in-flight questions
+    #    share one run; requests that change data or lean on the conversation
+    #    are never merged.
+    streamer = DiscordStreamer(message.channel, received_at) if STREAM_RESPONSES else None
+    try:
+        future, position = scheduler.submit(
+            clean_query, user_id, user_memory,
+            priority=request_priority(message),
+            coalesce=is_cacheable_query(clean_query),
+            on_token=streamer.feed if streamer else None,
+        )
+    except QueueFullError:
+        await message.channel.send("I'm overloaded right now and can't take more questions. Please try again in a minute.")
+        metrics.inc("crucible_responses_total", path="rejected")
+        logger.warning("Rejected query from %s: queue full.", message.author)
+        return
+    if position:
+        await message.channel.send(f"I'm busy right now; you're queued at position {position}.")
+
+    async with message.channel.typing():
+        if streamer:
+            await streamer.start()
+        try:
+            # The run itself is traced by the scheduler's worker as `agent.turn`.
+            with span("agent.wait"):
+                agent_response = await future
+        except RequestExpiredError:
+            agent_response = "Sorry, I was too busy to get to your question in time. Please ask again."
+        except Exception as e:
+            logger.exception("Error invoking agent: %s", e)
+            agent_response = "I'm sorry, a critical error occurred while I was thinking."
+
+    # 8. Send the agent's response back to the Discord channel, replacing
+    #    whatever was streamed with the final text.
+    with span("discord.send", chars=len(agent_response)):
+        if streamer:
+            await streamer.finish(agent_response)
+        else:
+            for chunk in split_message(agent_response):
+                await message.channel.send(chunk)
+    metrics.inc("crucible_responses_total", path="agent")
+    logger.info("Sent response to %s", message.author)
+    logger.debug("[Scheduler] %s [Streaming] %s [PromptBudget] %s [Conversations] %s [Router] %s",
+                 scheduler.stats(), stream_stats(), prompt_stats(), conversations.stats(), router.stats())
+
+
+def request_priority(message) -> int:
+    """ DMs first, then members holding one of PRIORITY_ROLES, then everyone else. """
+    if message.guild is None:
+        return PRIORITY_DM
+    if any(role.name in PRIORITY_ROLES for role in getattr(message.author, "roles", [])):
+        return PRIORITY_ROLE
+    return PRIORITY_DEFAULT
+
+
+def wait_for_process(process, ready_event, name: str, timeout: float):
+    """ Blocks until a child process signals that it is ready, or fails if it exits first. """
+    deadline = time.monotonic() + timeout
+    while not ready_event.wait(timeout=1):
+        if not process.is_alive():
+            raise RuntimeError(f"{name} exited with code {process.exitcode}.")
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"{name} did not become ready in time.")
+
+
+def wait_for_memory_worker(process, ready_event):
+    """ Blocks until the memory worker finishes its initial sync; real-time updates are off if it fails. """
+    wait_for_process(process, ready_event, "Memory worker", MEMORY_WORKER_READY_TIMEOUT)
+
+
+def wait_for_embedding_server(process, ready_event):
+    wait_for_process(process, ready_event, "Embedding server", EMBEDDING_SERVER_READY_TIMEOUT)
 
 
 def main():
     """
     Main function to set up the multiprocessing environment and start the bot.
     """
-    print("--- Starting Crucible AI System ---")
+    configure_logging()
+    logger.info("Starting Crucible AI System")
 
     try:
         multiprocessing.set_start_method('spawn', force=True)
-        print("[Main] Set multiprocessing start method to 'spawn'.")
+        logger.info("Set multiprocessing start method to 'spawn'.")
     except RuntimeError:
-        print("[Main] Multiprocessing context already set.")
+        logger.info("Multiprocessing context already set.")
 
-    # 1. Create the communication queue for the memory manager
+    # 0. Put the database into WAL mode before the agent threads and the memory
+    #    worker start sharing it, so readers never block on the worker's writes,
+    #    and make sure the change-log triggers exist before anything writes.
+    #    The data version continues from the last change the memory worker applied.
+    #    The embedding model is the one the active vector collection was built with.
+    initial_version = 0
+    embedding_model = EMBEDDING_MODEL
+    try:
+        conn = db.create_connection(db.DB_FILE)
+        db.ensure_change_log(conn)
+        initial_version = int(db.get_meta(conn, db.META_APPLIED_CHANGE_SEQ, db.get_meta(conn, db.META_DATA_VERSION, 0)))
+        embedding_model = active_collection(conn, EMBEDDING_MODEL)[1]
+        conn.close()
+        logger.info("Database configured for WAL mode.")
+    except db.Error as e:
+        logger.warning("Could not configure the database: %s", e)
+
+    # 1. Create the wake-up queue for the memory manager (it tails the change
+    #    log either way), plus the shared data version it publishes so the
+    #    agent's retrieval cache stays fresh.
+    #    The worker sends its metrics back on a second queue; /metrics serves both.
     memory_update_queue = multiprocessing.Queue()
+    metrics_queue = multiprocessing.Queue()
+    data_version = multiprocessing.Value('q', initial_version)
+    memory_ready = multiprocessing.Event()
+    global data_version_value
+    data_version_value = data_version
+    start_metrics_collector(metrics_queue)
+    start_metrics_server()
+    # Warns when changes wait longer than the SLO to reach the vector index.
+    start_lag_monitor(current_data_version, db.DB_FILE)
+
+    # 2. Provide the agent module with the queue and counter before anything starts
+    set_memory_queue(memory_update_queue)
+    set_data_version(data_version)
+    # History summaries share the agent turns' LLM slots.
+    set_llm_gate(lanes.llm_slot_from_thread)
+    logger.info("Memory update queue has been passed to the agent.")
+
+    # 3. Start the embedding server, then the memory manager, as separate,
+    #    long-running processes. Clients retry until the server has loaded the
+    #    model, so neither has to wait here. The random authkey keeps other
+    #    local users off the socket.
+    embedding_address, embedding_authkey = None, b""
+    if SHARED_EMBEDDINGS:
+        embedding_address, embedding_authkey = EMBEDDING_ADDRESS, os.urandom(32)
+        embedding_ready = multiprocessing.Event()
+        embedding_process = multiprocessing.Process(
+            target=serve_embeddings,
+            args=(embedding_address, embedding_authkey, embedding_model, embedding_ready, metrics_queue),
+            daemon=True
+        )
+        embedding_process.start()
+        set_embeddings(remote_embeddings(embedding_address, embedding_authkey), embedding_model)
+        logger.info("Embedding server process started.")
 
-    # 2. Start the memory manager as a separate, long-running process
     manager_process = multiprocessing.Process(
         target=memory_worker,
-        args=(memory_update_queue,),
+        args=(memory_update_queue, data_version, memory_ready, metrics_queue,
+              embedding_address, embedding_authkey, embedding_model),
         daemon=True
     )
     manager_process.start()
-    print("[Main] Memory Manager process started.")
+    logger.info("Memory Manager process started.")
 
-    # 3. Provide the agent module with the queue for its tools to use
-    set_memory_queue(memory_update_queue)
-    print("[Main] Memory update queue has been passed to the agent.")
-
-    # 4. Initialize the agent's components (LLM, tools, etc.)
-    print("[Main] Initializing the Crucible AI Agent for Discord...")
-    initialize_agent()
+    # 4. Initialize the knowledge base, the agent (LLM, tools, etc.) and the memory
+    #    worker's initial sync concurrently; each logs its own time-to-ready.
+    logger.info("Initializing the Crucible AI Agent for Discord...")
+    for component in ("memory_worker", "knowledge_base", "agent", "llm_server"):
+        readiness.register(component)
+    if SHARED_EMBEDDINGS:
+        readiness.register("embedding_server")
+        start_component(readiness, "embedding_server", wait_for_embedding_server, embedding_process, embedding_ready)
+    start_component(readiness, "memory_worker", wait_for_memory_worker, manager_process, memory_ready)
+    start_component(readiness, "knowledge_base", initialize_knowledge_base)
+    start_component(readiness, "agent", initialize_agent, False)
+    start_component(readiness, "llm_server", wait_for_llm_server)
 
     # 5. Start the Discord bot
-    print("[Main] Starting Discord bot...")
-    client.run(TOKEN)
+    logger.info("Starting Discord bot...")
+    try:
+        client.run(TOKEN, log_handler=None)
+    finally:
+        conversations.flush()
+        db.close_pools()
 
 if __name__ == "__main__":
     main()
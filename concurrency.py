@@ -0,0 +1,94 @@
+# concurrency.py
+import asyncio
+from contextlib import asynccontextmanager, contextmanager
+
+# --- CONFIGURATION ---
+# How many agent runs the local LM Studio server is given at once. A single
+# local model serves requests largely one after another, so going higher only
+# adds contention; raise it for servers with parallel slots.
+MAX_CONCURRENT_AGENT_RUNS = 2
+
+
+class AgentLanes:
+    """
+    Orders and bounds agent work on the event loop.
+
+    Each user gets one FIFO lane (an asyncio.Lock, whose waiters are woken in
+    arrival order), so a user's turns run one at a time and their conversation
+    memory is loaded and saved in order. Independently, a global semaphore caps
+    how many turns may be talking to the LLM at once. Work running in other
+    threads (e.g. conversation summaries) takes the same slots through
+    llm_slot_from_thread().
+    """
+
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT_AGENT_RUNS):
+        self.max_concurrent = max_concurrent
+        self._llm_slots = asyncio.Semaphore(max_concurrent)
+        self._lanes = {}
+        self._waiting = {}
+        self.active_llm_runs = 0
+        self.peak_llm_runs = 0
+        self._loop = None  # The event loop the lanes are used on; recorded on first use.
+
+    @asynccontextmanager
+    async def user_lane(self, user_id):
+        """ Holds the user's lane for one whole turn (memory load, agent run, memory save). """
+        self._loop = asyncio.get_running_loop()
+        lock = self._lanes.get(user_id)
+        if lock is None:
+            lock = self._lanes[user_id] = asyncio.Lock()
+        self._waiting[user_id] = self._waiting.get(user_id, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._waiting[user_id] -= 1
+            if not self._waiting[user_id]:
+                # Nobody else is queued for this user; drop the lane so idle users cost nothing.
+                del self._waiting[user_id]
+                del self._lanes[user_id]
+
+    async def _acquire_llm_slot(self):
+        self._loop = asyncio.get_running_loop()
+        await self._llm_slots.acquire()
+        self.active_llm_runs += 1
+        self.peak_llm_runs = max(self.peak_llm_runs, self.active_llm_runs)
+
+    def _release_llm_slot(self):
+        self.active_llm_runs -= 1
+        self._llm_slots.release()
+
+    @asynccontextmanager
+    async def llm_slot(self):
+        """ Holds one of the global LLM slots for the duration of an agent run. """
+        await self._acquire_llm_slot()
+        try:
+            yield
+        finally:
+            self._release_llm_slot()
+
+    @contextmanager
+    def llm_slot_from_thread(self):
+        """
+        llm_slot() for blocking code in a worker thread: waits for a slot on the
+        lanes' event loop. Before the lanes have been used on a loop there is
+        nothing to share, and the call runs unthrottled.
+        """
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            yield
+            return
+        asyncio.run_coroutine_threadsafe(self._acquire_llm_slot(), loop).result()
+        try:
+            yield
+        finally:
+            loop.call_soon_threadsafe(self._release_llm_slot)
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "active_llm_runs": self.active_llm_runs,
+            "peak_llm_runs": self.peak_llm_runs,
+            "active_lanes": len(self._lanes),
+            "queued_turns": sum(max(0, n - 1) for n in self._waiting.values()),
+        }
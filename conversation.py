@@ -0,0 +1,282 @@
+# conversation.py
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import db
+from prompt_budget import HISTORY_TOKEN_BUDGET, SUMMARY_TOKEN_BUDGET, count_tokens, truncate_to_tokens
+
+# --- CONFIGURATION ---
+RECENT_TURNS = 3  # Exchanges kept verbatim; older ones are folded into the running summary.
+EXTRACT_CHARS = 160  # Per message, when summarising without the LLM.
+MAX_RESIDENT_SESSIONS = 500  # Conversations kept in memory; the rest live only in SQLite.
+SESSION_IDLE_TTL = 30 * 60  # Seconds after which an idle conversation is moved out of memory.
+
+SQL_CREATE_CONVERSATIONS = """
+CREATE TABLE IF NOT EXISTS conversations (
+    user_id INTEGER PRIMARY KEY,
+    state TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+SQL_GET_CONVERSATION = "SELECT state FROM conversations WHERE user_id = ?"
+SQL_SAVE_CONVERSATION = (
+    "INSERT INTO conversations (user_id, state, updated_at) VALUES (?, ?, ?) "
+    "ON CONFLICT(user_id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at"
+)
+
+logger = logging.getLogger(__name__)
+
+_summarizer = None  # Callable (previous_summary, turns) -> new summary; set by the agent once the LLM is up.
+_summary_executor = None
+_executor_lock = threading.Lock()
+
+
+def set_summarizer(summarizer):
+    global _summarizer
+    _summarizer = summarizer
+
+
+def extractive_summary(previous_summary: str, turns: list[tuple[str, str]]) -> str:
+    """ A summary without the LLM: the previous summary plus one shortened line per exchange. """
+    lines = [previous_summary] if previous_summary else []
+    for user_text, ai_text in turns:
+        lines.append(f"User asked: {user_text[:EXTRACT_CHARS]} / Answer: {ai_text[:EXTRACT_CHARS]}")
+    return "\n".join(lines)
+
+
+def _executor() -> ThreadPoolExecutor:
+    # One background thread: summaries are cheap to delay and must not compete with live turns.
+    global _summary_executor
+    with _executor_lock:
+        if _summary_executor is None:
+            _summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-summary")
+        return _summary_executor
+
+
+class ConversationMemory:
+    """
+    One user's conversation history, sized for the prompt.
+
+    The last `recent_turns` exchanges are kept verbatim; older exchanges are
+    folded into a running summary on a background thread, so a turn never waits
+    for summarisation and the history does not grow with the conversation.
+    The rendered history (summary first, then as many recent exchanges as fit)
+    is held to `token_budget` tokens. It offers the save_context() and
+    load_memory_variables() methods the agent used from LangChain's memories.
+    """
+
+    def __init__(self, recent_turns: int = RECENT_TURNS, token_budget: int = HISTORY_TOKEN_BUDGET,
+                 memory_key: str = "chat_history"):
+        self.recent_turns = recent_turns
+        self.token_budget = token_budget
+        self.memory_key = memory_key
+        self.summary = ""
+        self.turns = []  # (user_text, ai_text), oldest first.
+        self._lock = threading.Lock()
+        self._summarizing = False
+        self.revision = 0  # Bumped on every change, so unchanged conversations are not rewritten.
+        self.saved_revision = 0
+
+    def save_context(self, inputs: dict, outputs: dict):
+        with self._lock:
+            self.turns.append((inputs["input"], outputs["output"]))
+            self.revision += 1
+        self._schedule_summary()
+
+    def load_memory_variables(self, inputs: dict | None = None) -> dict:
+        return {self.memory_key: self.render()}
+
+    def clear(self):
+        with self._lock:
+            self.summary = ""
+            self.turns = []
+            self.revision += 1
+
+    def render(self) -> str:
+        """ Returns the history as prompt text within the token budget. """
+        with self._lock:
+            summary, turns = self.summary, list(self.turns)
+        parts = []
+        budget = self.token_budget
+        if summary:
+            # The summary may use at most half the budget; recent turns matter more.
+            summary_text = "Summary of the earlier conversation: " + truncate_to_tokens(summary, budget // 2, keep="tail")
+            budget -= count_tokens(summary_text)
+        recent = []
+        for user_text, ai_text in reversed(turns):
+            exchange = f"Human: {user_text}\nAI: {ai_text}"
+            cost = count_tokens(exchange)
+            if cost > budget:
+                if not recent:
+                    # Always keep the latest exchange, shortened if need be.
+                    recent.append(truncate_to_tokens(exchange, max(budget, 0) or 1, keep="tail"))
+                break
+            recent.append(exchange)
+            budget -= cost
+        if summary:
+            parts.append(summary_text)
+        parts.extend(reversed(recent))
+        return "\n".join(parts)
+
+    # --- SERIALISATION ---
+    def dumps(self) -> str:
+        """ Compact JSON form of the summary and recent turns, as stored in SQLite. """
+        with self._lock:
+            state = {"s": self.summary, "t": self.turns}
+        return json.dumps(state, separators=(",", ":"), ensure_ascii=False)
+
+    @classmethod
+    def loads(cls, data: str, **kwargs) -> "ConversationMemory":
+        memory = cls(**kwargs)
+        state = json.loads(data)
+        memory.summary = state.get("s", "")
+        memory.turns = [tuple(turn) for turn in state.get("t", [])]
+        return memory
+
+    # --- BACKGROUND SUMMARISATION ---
+    def _schedule_summary(self):
+        with self._lock:
+            if self._summarizing or len(self.turns) <= self.recent_turns:
+                return
+            self._summarizing = True
+        _executor().submit(self._summarize)
+
+    def _summarize(self):
+        with self._lock:
+            previous = self.summary
+            overflow = self.turns[:len(self.turns) - self.recent_turns]
+        summary = None
+        if _summarizer is not None:
+            try:
+                summary = _summarizer(previous, overflow)
+            except Exception as e:
+                logger.warning("Summarising with the LLM failed, using an extract: %s", e)
+        if not summary:
+            summary = extractive_summary(previous, overflow)
+        summary = truncate_to_tokens(summary, SUMMARY_TOKEN_BUDGET, keep="tail")
+        with self._lock:
+            # Turns are only ever appended, so the folded ones are still at the front.
+            self.summary = summary
+            del self.turns[:len(overflow)]
+            self._summarizing = False
+            self.revision += 1
+        self._schedule_summary()
+
+
+class ConversationStore:
+    """
+    Per-user conversations with a bounded in-memory footprint.
+
+    At most `max_resident` conversations are held in memory, in LRU order;
+    conversations idle for longer than `idle_ttl` seconds, or pushed out by
+    newer ones, are written to the `conversations` table and dropped. A
+    returning user's conversation is loaded back on demand, so nothing is read
+    at start-up. Call save() after each turn and flush() on shutdown.
+    """
+
+    def __init__(self, db_file: str = db.DB_FILE, max_resident: int = MAX_RESIDENT_SESSIONS,
+                 idle_ttl: float = SESSION_IDLE_TTL):
+        self.db_file = db_file
+        self.max_resident = max_resident
+        self.idle_ttl = idle_ttl
+        self._sessions = OrderedDict()  # user_id -> (memory, last_used_at), least recently used first.
+        self._lock = threading.Lock()
+        self._table_ready = False
+        self._stats = {"created": 0, "loaded": 0, "evicted": 0, "saved": 0}
+
+    @contextmanager
+    def _connection(self):
+        with db.get_pool(self.db_file).connection() as conn:
+            if not self._table_ready:
+                conn.execute(SQL_CREATE_CONVERSATIONS)
+                self._table_ready = True
+            yield conn
+
+    def get(self, user_id: int) -> ConversationMemory:
+        """ Returns the user's conversation, loading it from SQLite or starting a new one. """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(user_id)
+            if entry is not None:
+                self._sessions[user_id] = (entry[0], now)
+                self._sessions.move_to_end(user_id)
+                return entry[0]
+
+        memory = None
+        with self._connection() as conn:
+            row = conn.execute(SQL_GET_CONVERSATION, (user_id,)).fetchone()
+        if row:
+            try:
+                memory = ConversationMemory.loads(row["state"])
+            except (ValueError, TypeError) as e:
+                logger.warning("Discarding unreadable history for user %s: %s", user_id, e)
+
+        with self._lock:
+            entry = self._sessions.get(user_id)
+            if entry is not None:  # Another caller loaded it meanwhile.
+                return entry[0]
+            if memory is None:
+                memory = ConversationMemory()
+                self._stats["created"] += 1
+            else:
+                self._stats["loaded"] += 1
+            self._sessions[user_id] = (memory, now)
+            victims = self._pick_victims(now)
+        self._write(victims)
+        return memory
+
+    def save(self, user_id: int, memory: ConversationMemory | None = None):
+        """ Writes the user's conversation through to SQLite. """
+        if memory is None:
+            with self._lock:
+                entry = self._sessions.get(user_id)
+            if entry is None:
+                return
+            memory = entry[0]
+        self._write([(user_id, memory)])
+
+    def flush(self):
+        """ Saves every resident conversation, e.g. before shutting down. """
+        with self._lock:
+            sessions = [(user_id, memory) for user_id, (memory, _) in self._sessions.items()]
+        self._write(sessions)
+
+    def _pick_victims(self, now: float) -> list:
+        """ Removes LRU and idle conversations from memory and returns them for saving. Holds the lock. """
+        victims = []
+        while self._sessions:
+            user_id, (memory, last_used_at) = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_resident and now - last_used_at <= self.idle_ttl:
+                break
+            del self._sessions[user_id]
+            victims.append((user_id, memory))
+        self._stats["evicted"] += len(victims)
+        return victims
+
+    def _write(self, sessions: list):
+        """ Saves the conversations that changed since they were last written. """
+        now = time.time()
+        changed = [(user_id, memory, memory.revision) for user_id, memory in sessions
+                   if memory.revision != memory.saved_revision]
+        if not changed:
+            return
+        rows = [(user_id, memory.dumps(), now) for user_id, memory, _ in changed]
+        with self._connection() as conn:
+            with db.transaction(conn):
+                conn.executemany(SQL_SAVE_CONVERSATION, rows)
+        for _, memory, revision in changed:
+            memory.saved_revision = revision
+        with self._lock:
+            self._stats["saved"] += len(rows)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"resident": len(self._sessions), "max_resident": self.max_resident, **self._stats}
@@ -0,0 +1,341 @@
+# db.py
+import queue
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from sqlite3 import Error
+
+# --- CONFIGURATION (Should match other scripts) ---
+DB_FILE = "project_tasks.db"
+POOL_SIZE = 8  # Max open connections per process.
+POOL_TIMEOUT = 10  # Seconds to wait for a free connection before giving up.
+STATEMENT_CACHE_SIZE = 128  # Prepared statements kept per connection.
+
+# WAL lets readers proceed while the memory worker writes. `synchronous=NORMAL`
+# is durable across application crashes in WAL mode and avoids an fsync per commit.
+PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("foreign_keys", "ON"),
+    ("busy_timeout", "5000"),  # ms to wait on a lock instead of failing with "database is locked".
+    ("cache_size", "-65536"),  # Negative means KiB, so 64 MiB of page cache.
+    ("mmap_size", "268435456"),  # Read pages through a 256 MiB memory map.
+    ("temp_store", "MEMORY"),
+)
+
+# --- HOT QUERIES ---
+# Kept as module constants so the exact same SQL text is reused on every call;
+# sqlite3 caches the prepared statement per connection keyed on that text.
+TASK_DOCUMENT_SELECT = """
+SELECT
+    t.id, t.title, t.description, t.status, t.priority, t.due_date,
+    p.name as project_name, u.name as assignee_name
+FROM tasks t
+LEFT JOIN projects p ON t.project_id = p.id
+LEFT JOIN users u ON t.assignee_id = u.id
+"""
+SQL_TASK_BY_ID = TASK_DOCUMENT_SELECT + "WHERE t.id = ?;"
+SQL_ALL_TASKS = TASK_DOCUMENT_SELECT + ";"
+SQL_TASKS_AFTER_ID = TASK_DOCUMENT_SELECT + "WHERE t.id > ? ORDER BY t.id;"
+SQL_PROJECT_ID_BY_NAME = "SELECT id FROM projects WHERE name = ?"
+SQL_USER_ID_BY_NAME = "SELECT id FROM users WHERE name LIKE ?"
+SQL_LIST_USERS = "SELECT id, name, email FROM users"
+SQL_KNOWN_NAMES = "SELECT name FROM projects UNION ALL SELECT name FROM users"
+# BM25 column weights: title, description, project_name, assignee_name.
+SQL_SEARCH_TASKS_FTS = """
+SELECT rowid AS id FROM tasks_fts
+WHERE tasks_fts MATCH ?
+ORDER BY bm25(tasks_fts, 10.0, 1.0, 4.0, 4.0)
+LIMIT ?;
+"""
+SQL_INSERT_TASK = (
+    "INSERT INTO tasks (title, description, status, priority, project_id, assignee_id) "
+    "VALUES (?, ?, ?, ?, ?, ?)"
+)
+
+
+# Small key/value table for state that must survive restarts, such as the data version.
+SQL_CREATE_META = "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);"
+SQL_GET_META = "SELECT value FROM meta WHERE key = ?"
+SQL_SET_META = "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value"
+META_DATA_VERSION = "data_version"  # Before the change log: a counter bumped per applied batch.
+META_APPLIED_CHANGE_SEQ = "applied_change_seq"  # Last task_changes.seq the vector store reflects.
+# Which vector collection readers use, as JSON {"name", "embedding_model"}; switched by reindex.py.
+META_VECTOR_COLLECTION = "vector_collection"
+META_PREVIOUS_VECTOR_COLLECTION = "previous_vector_collection"  # Kept for rollback, with its "applied_seq".
+META_REINDEX_FROM_SEQ = "reindex_from_seq"  # While set, the memory worker keeps the change log after this seq.
+
+# --- CHANGE LOG ---
+# Every write that changes what a task's document looks like appends to
+# task_changes, whoever makes it (the agent, setup_db, a manual SQL edit). The
+# memory worker tails it by sequence number, so a crash or downtime loses
+# nothing and catching up costs time proportional to the changes. Renaming a
+# project or a user fans out to one row per affected task.
+SQL_CREATE_TASK_CHANGES = """
+CREATE TABLE IF NOT EXISTS task_changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    task_id INTEGER NOT NULL,
+    action TEXT NOT NULL CHECK(action IN ('upsert', 'delete', 'resync')),
+    changed_at REAL NOT NULL DEFAULT ((julianday('now') - 2440587.5) * 86400.0)  -- Unix time, for the indexing-lag metric.
+);
+"""
+# Name -> body. Only document columns count, so the updated_at trigger does not log twice.
+CHANGE_TRIGGERS = {
+    "task_changes_after_insert": """
+        AFTER INSERT ON tasks FOR EACH ROW BEGIN
+            INSERT INTO task_changes (task_id, action) VALUES (NEW.id, 'upsert');
+        END""",
+    "task_changes_after_update": """
+        AFTER UPDATE OF title, description, status, priority, due_date, project_id, assignee_id ON tasks
+        FOR EACH ROW BEGIN
+            INSERT INTO task_changes (task_id, action) VALUES (NEW.id, 'upsert');
+        END""",
+    "task_changes_after_delete": """
+        AFTER DELETE ON tasks FOR EACH ROW BEGIN
+            INSERT INTO task_changes (task_id, action) VALUES (OLD.id, 'delete');
+        END""",
+    "task_changes_after_project_rename": """
+        AFTER UPDATE OF name ON projects FOR EACH ROW WHEN NEW.name IS NOT OLD.name BEGIN
+            INSERT INTO task_changes (task_id, action) SELECT id, 'upsert' FROM tasks WHERE project_id = NEW.id;
+        END""",
+    "task_changes_after_user_rename": """
+        AFTER UPDATE OF name ON users FOR EACH ROW WHEN NEW.name IS NOT OLD.name BEGIN
+            INSERT INTO task_changes (task_id, action) SELECT id, 'upsert' FROM tasks WHERE assignee_id = NEW.id;
+        END""",
+}
+SQL_CHANGES_AFTER = "SELECT seq, task_id, action, changed_at FROM task_changes WHERE seq > ? ORDER BY seq LIMIT ?"
+SQL_MAX_CHANGE_SEQ = "SELECT COALESCE(MAX(seq), 0) FROM task_changes"
+SQL_LOG_RESYNC = "INSERT INTO task_changes (task_id, action) VALUES (0, 'resync')"
+SQL_PRUNE_CHANGES = "DELETE FROM task_changes WHERE seq <= ?"
+
+
+def sql_tasks_by_ids(count: int) -> str:
+    """ Returns the task-document query for an `IN` list of `count` IDs. """
+    placeholders = ", ".join("?" for _ in range(count))
+    return TASK_DOCUMENT_SELECT + f"WHERE t.id IN ({placeholders});"
+
+
+TASK_STATUSES = ("To Do", "In Progress", "Done")
+TASK_PRIORITIES = ("Low", "Medium", "High")
+
+
+def build_task_filter_query(status: str | None = None, priority: str | None = None,
+                            project_name: str | None = None, assignee_name: str | None = None,
+                            due_after: str | None = None, due_before: str | None = None,
+                            open_only: bool = False, limit: int | None = None) -> tuple[str, list]:
+    """
+    Builds an indexed `SELECT t.id ...` for the given structured filters and
+    returns it with its parameters. Project and assignee names match partially,
+    like `get_user_id_by_name`; due dates are ISO `YYYY-MM-DD` bounds (inclusive);
+    `open_only` excludes tasks that are Done.
+    Rows come back soonest-due first, then by priority.
+    """
+    clauses, params = [], []
+    if status:
+        clauses.append("t.status = ?")
+        params.append(status)
+    if priority:
+        clauses.append("t.priority = ?")
+        params.append(priority)
+    if project_name:
+        clauses.append("t.project_id IN (SELECT id FROM projects WHERE name LIKE ?)")
+        params.append(f"%{project_name}%")
+    if assignee_name:
+        clauses.append("t.assignee_id IN (SELECT id FROM users WHERE name LIKE ?)")
+        params.append(f"%{assignee_name}%")
+    if open_only:
+        clauses.append("t.status != 'Done'")
+    if due_after:
+        clauses.append("t.due_date >= ?")
+        params.append(due_after)
+    if due_before:
+        clauses.append("t.due_date <= ?")
+        params.append(due_before)
+
+    sql = "SELECT t.id FROM tasks t"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += (
+        " ORDER BY t.due_date IS NULL, t.due_date,"
+        " CASE t.priority WHEN 'High' THEN 0 WHEN 'Medium' THEN 1 ELSE 2 END, t.id"
+    )
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return sql, params
+
+
+FTS_STOPWORDS = frozenset(
+    "a an and are about any all by do does for from has have how i in is it me my "
+    "of on or show task tasks tell that the their there this to was what when where which who "
+    "whose why with".split()
+)
+
+
+def to_fts_query(text: str) -> str | None:
+    """
+    Turns free text into a safe FTS5 MATCH expression: each remaining word is
+    quoted (so user punctuation cannot break the syntax) and the words are
+    OR-ed, letting BM25 rank rows that match more of them higher.
+    Returns None when nothing searchable is left.
+    """
+    words = [w for w in re.findall(r"\w+", text.lower()) if w not in FTS_STOPWORDS]
+    if not words:
+        return None
+    return " OR ".join(f'"{word}"' for word in dict.fromkeys(words))
+
+
+def get_meta(conn: sqlite3.Connection, key: str, default: str | None = None) -> str | None:
+    """ Reads a value from the meta table; databases created before it existed return `default`. """
+    try:
+        row = conn.execute(SQL_GET_META, (key,)).fetchone()
+    except sqlite3.OperationalError:
+        return default
+    return row[0] if row else default
+
+
+def set_meta(conn: sqlite3.Connection, key: str, value):
+    conn.execute(SQL_CREATE_META)
+    conn.execute(SQL_SET_META, (key, str(value)))
+
+
+def ensure_change_log(conn: sqlite3.Connection):
+    """
+    Creates the task_changes table and its triggers if they are missing. On a
+    database that used the older data-version counter, the sequence starts
+    above that counter, so versions keep increasing across the upgrade.
+    """
+    conn.execute(SQL_CREATE_TASK_CHANGES)
+    for name, body in CHANGE_TRIGGERS.items():
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body};")
+    legacy_version = int(get_meta(conn, META_DATA_VERSION, 0))
+    if legacy_version and not conn.execute("SELECT 1 FROM sqlite_sequence WHERE name = 'task_changes'").fetchone():
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('task_changes', ?)", (legacy_version,))
+
+
+def configure_connection(conn: sqlite3.Connection):
+    """ Applies the shared pragmas and row factory to a connection. """
+    conn.row_factory = sqlite3.Row  # Access columns by name
+    for name, value in PRAGMAS:
+        conn.execute(f"PRAGMA {name} = {value}")
+
+
+def create_connection(db_file: str = DB_FILE) -> sqlite3.Connection:
+    """
+    Opens a standalone, tuned connection in autocommit mode. Use `transaction()`
+    (or explicit BEGIN/COMMIT) for writes. Raises sqlite3.Error on failure.
+    """
+    conn = sqlite3.connect(
+        db_file,
+        check_same_thread=False,
+        isolation_level=None,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+    configure_connection(conn)
+    return conn
+
+
+@contextmanager
+def transaction(conn: sqlite3.Connection, immediate: bool = True):
+    """
+    Wraps a block in BEGIN/COMMIT, rolling back on any exception. IMMEDIATE
+    takes the write lock up front so two writers never deadlock on upgrade.
+    """
+    conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.execute("COMMIT")
+
+
+class ConnectionPool:
+    """
+    A thread-safe pool of tuned SQLite connections for one database file.
+
+    Connections are created lazily up to `size` and handed out one thread at a
+    time, so the agent's worker threads can share them without reconnecting on
+    every tool call.
+    """
+
+    def __init__(self, db_file: str = DB_FILE, size: int = POOL_SIZE, timeout: float = POOL_TIMEOUT):
+        self.db_file = db_file
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()  # LIFO keeps the warmest connection (and its caches) busy.
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def acquire(self) -> sqlite3.Connection:
+        if self._closed:
+            raise Error("Connection pool is closed.")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                conn = create_connection(self.db_file)
+                self._created += 1
+                return conn
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise Error(f"Timed out waiting for a database connection to '{self.db_file}'.")
+
+    def release(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.rollback()  # Never hand a half-finished transaction to the next caller.
+        if self._closed:
+            conn.close()
+            return
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """ Borrows a connection for the duration of a `with` block. """
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    @contextmanager
+    def transaction(self, immediate: bool = True):
+        """ Borrows a connection and runs the block inside one transaction. """
+        with self.connection() as conn:
+            with transaction(conn, immediate):
+                yield conn
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_file: str = DB_FILE) -> ConnectionPool:
+    """ Returns this process's shared pool for `db_file`, creating it on first use. """
+    with _pools_lock:
+        pool = _pools.get(db_file)
+        if pool is None:
+            pool = _pools[db_file] = ConnectionPool(db_file)
+        return pool
+
+
+def close_pools():
+    """ Closes every pool opened by this process. """
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
@@ -1,122 +1,211 @@
-import sqlite3
 from sqlite3 import Error
 from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import Chroma
-from langchain_core.documents import Document
 import os
+import json
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource  # Unix only; used for peak RSS reporting.
+except ImportError:
+    resource = None
+
+import db
+from memory_manager import format_task_as_document
+from vector_index import VECTOR_BACKEND, active_collection, open_vector_store
 
 # --- CONFIGURATION ---
 DB_FILE = "project_tasks.db"
 CHROMA_PERSIST_DIR = "./chroma_db"
 EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+CHECKPOINT_FILE = os.path.join(CHROMA_PERSIST_DIR, "embed_checkpoint.json")
+FETCH_SIZE = 1000  # Rows pulled from SQLite per fetchmany() call.
+BATCH_SIZE = 256  # Documents per embedding batch (and per vector-store upsert).
+NUM_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+MAX_IN_FLIGHT_PER_WORKER = 2  # Bounds memory: batches queued ahead of each worker.
 
-def load_tasks_from_db(db_file):
-    """
-    Connects to the SQLite database, queries all tasks with their related project
-    and user info, and formats them into LangChain Document objects.
-    """
+def connect_to_db(db_file):
+    """ Opens the SQLite database, or returns None if it is missing or unreadable. """
     if not os.path.exists(db_file):
         print(f"Error: Database file not found at '{db_file}'")
         print("Please run the `setup_db.py` script first to create and populate the database.")
-        return []
+        return None
 
-    conn = None
     try:
-        conn = sqlite3.connect(db_file)
-        conn.row_factory = sqlite3.Row  # Access columns by name
+        conn = db.create_connection(db_file)
         print(f"Successfully connected to SQLite database: {db_file}")
+        return conn
     except Error as e:
         print(e)
-        return []
-
-    cursor = conn.cursor()
-    # Query to get a comprehensive view of each task
-    query = """
-    SELECT
-        t.id,
-        t.title,
-        t.description,
-        t.status,
-        t.priority,
-        t.due_date,
-        p.name as project_name,
-        u.name as assignee_name
-    FROM
-        tasks t
-    LEFT JOIN
-        projects p ON t.project_id = p.id
-    LEFT JOIN
-        users u ON t.assignee_id = u.id;
+        return None
+
+def iter_document_batches(conn, after_task_id=0, batch_size=BATCH_SIZE, fetch_size=FETCH_SIZE):
+    """
+    Streams tasks with their related project and user info in ascending ID
+    order and yields them as lists of LangChain Documents, so memory use stays
+    flat regardless of table size.
+    """
+    cursor = conn.execute(db.SQL_TASKS_AFTER_ID, (after_task_id,))
+    batch = []
+    while True:
+        rows = cursor.fetchmany(fetch_size)
+        if not rows:
+            break
+        for row in rows:
+            # Use the memory manager's formatter so every document carries the
+            # content hash its incremental startup sync compares against.
+            batch.append(format_task_as_document(row))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+# --- EMBEDDING WORKERS ---
+_worker_embeddings = None
+
+def _init_worker(model_name, torch_threads):
+    """ Loads the embedding model once per worker process. """
+    global _worker_embeddings
+    try:
+        import torch
+        # Without this, every worker spawns one thread per core and they fight over the CPU.
+        torch.set_num_threads(torch_threads)
+    except ImportError:
+        pass
+    _worker_embeddings = HuggingFaceEmbeddings(model_name=model_name)
+
+def _embed_texts(texts):
+    return _worker_embeddings.embed_documents(texts)
+
+# --- CHECKPOINTING ---
+def load_checkpoint(path=CHECKPOINT_FILE, embedding_model=EMBEDDING_MODEL, collection=None):
+    """ Returns the saved checkpoint, or None if there is no resumable run into `collection`. """
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("complete") or checkpoint.get("embedding_model") != embedding_model:
+        return None
+    if checkpoint.get("vector_backend", "chroma") != VECTOR_BACKEND:
+        return None  # The rows embedded so far went into the other backend.
+    if checkpoint.get("collection") != collection:
+        return None  # A re-index switched the active collection since.
+    return checkpoint
+
+def save_checkpoint(checkpoint, path=CHECKPOINT_FILE):
+    """ Writes the checkpoint atomically so a crash never leaves a half-written file. """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+def peak_rss_mb():
+    """ Peak resident set size of this process plus its (finished) children, in MB. """
+    if resource is None:
+        return None
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return (own + children) / 1024  # ru_maxrss is reported in KB on Linux.
+
+def write_batch(vector_store, documents, vectors):
+    """ Upserts one batch of pre-computed embeddings into the vector store. """
+    vector_store._collection.upsert(
+        ids=[str(doc.metadata['task_id']) for doc in documents],
+        embeddings=vectors,
+        documents=[doc.page_content for doc in documents],
+        metadatas=[doc.metadata for doc in documents],
+    )
+
+def run_pipeline(conn, vector_store, checkpoint, batch_size=BATCH_SIZE, num_workers=NUM_WORKERS,
+                 embedding_model=EMBEDDING_MODEL):
+    """
+    Embeds every task after the checkpoint on a pool of worker processes and
+    writes each batch to the vector store as soon as it is ready. Batches are written in
+    submission order, so the checkpoint always marks a contiguous prefix.
     """
-    cursor.execute(query)
-    rows = cursor.fetchall()
-    conn.close()
-
-    documents = []
-    for row in rows:
-        # Create a rich text content for embedding. This combines the most
-        # important fields into a single string.
-        page_content = (
-            f"Task: {row['title']}\n"
-            f"Project: {row['project_name']}\n"
-            f"Status: {row['status']}\n"
-            f"Priority: {row['priority']}\n"
-            f"Assignee: {row['assignee_name']}\n"
-            f"Description: {row['description']}"
-        )
-        # Store all individual fields in metadata for potential filtering later
-        metadata = {
-            "task_id": row['id'],
-            "title": row['title'],
-            "project": row['project_name'],
-            "status": row['status'],
-            "priority": row['priority'],
-            "due_date": row['due_date'],
-            "assignee": row['assignee_name']
-        }
-        documents.append(Document(page_content=page_content, metadata=metadata))
-
-    print(f"Loaded {len(documents)} documents from the database.")
-    return documents
+    torch_threads = max(1, (os.cpu_count() or 1) // num_workers)
+    in_flight = deque()
+    started = time.perf_counter()
+    rows_this_run = 0
+
+    def drain_one():
+        nonlocal rows_this_run
+        documents, future = in_flight.popleft()
+        write_batch(vector_store, documents, future.result())
+        rows_this_run += len(documents)
+        checkpoint["last_task_id"] = documents[-1].metadata['task_id']
+        checkpoint["rows"] += len(documents)
+        save_checkpoint(checkpoint)
+        elapsed = time.perf_counter() - started
+        print(f"Embedded {checkpoint['rows']} rows (last task ID {checkpoint['last_task_id']}, "
+              f"{rows_this_run / elapsed:.1f} rows/s).")
+
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_worker,
+                             initargs=(embedding_model, torch_threads)) as pool:
+        for documents in iter_document_batches(conn, checkpoint["last_task_id"], batch_size):
+            texts = [doc.page_content for doc in documents]
+            in_flight.append((documents, pool.submit(_embed_texts, texts)))
+            if len(in_flight) >= num_workers * MAX_IN_FLIGHT_PER_WORKER:
+                drain_one()
+        while in_flight:
+            drain_one()
+
+    return rows_this_run, time.perf_counter() - started
 
 def main():
     """
     Main function to orchestrate the embedding pipeline:
-    1. Load data from SQLite.
-    2. Initialize a local embedding model.
-    3. Create and persist a ChromaDB vector store.
+    1. Stream task rows from SQLite in batches.
+    2. Embed each batch on a pool of local embedding-model workers.
+    3. Upsert each finished batch into the persistent vector store (VECTOR_BACKEND) and checkpoint it.
     """
-    print("--- Starting Embedding Pipeline ---")
+    parser = argparse.ArgumentParser(description="Embed the task table into the vector store.")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Documents per embedding batch.")
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS, help="Embedding worker processes.")
+    parser.add_argument("--restart", action="store_true", help="Ignore any checkpoint and embed every task again.")
+    args = parser.parse_args()
 
-    # 1. Load documents from the database
-    documents = load_tasks_from_db(DB_FILE)
+    print("--- Starting Embedding Pipeline ---")
 
-    if not documents:
-        print("Halting pipeline due to no documents loaded.")
+    conn = connect_to_db(DB_FILE)
+    if conn is None:
+        print("Halting pipeline due to no database connection.")
         return
 
-    # 2. Initialize the local, open-source embedding model
-    # The model will be downloaded automatically by the library on its first run.
-    print(f"Initializing embedding model: '{EMBEDDING_MODEL}'...")
-    embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
-    print("Embedding model loaded successfully.")
-
-    # 3. Create the vector store and persist it to disk
-    # This single step generates embeddings for all documents and saves them.
-    print(f"Generating embeddings and creating Chroma vector store...")
-    print(f"Persistence directory: '{CHROMA_PERSIST_DIR}'")
-    
-    vector_store = Chroma.from_documents(
-        documents=documents,
-        embedding=embeddings,
-        persist_directory=CHROMA_PERSIST_DIR
-    )
+    os.makedirs(CHROMA_PERSIST_DIR, exist_ok=True)
+    # Fill the collection readers use, with the model it was built with (see reindex.py).
+    collection, embedding_model = active_collection(conn, EMBEDDING_MODEL)
+    checkpoint = None if args.restart else load_checkpoint(embedding_model=embedding_model, collection=collection)
+    if checkpoint:
+        print(f"Resuming after task ID {checkpoint['last_task_id']} ({checkpoint['rows']} rows already embedded).")
+    else:
+        checkpoint = {"embedding_model": embedding_model, "vector_backend": VECTOR_BACKEND, "collection": collection,
+                      "last_task_id": 0, "rows": 0, "complete": False}
+
+    # Vectors are computed by the workers, so the writer does not need its own copy of the model.
+    print(f"Persistence directory: '{CHROMA_PERSIST_DIR}' ({VECTOR_BACKEND} backend)")
+    vector_store = open_vector_store(CHROMA_PERSIST_DIR, collection_name=collection)
+
+    print(f"Embedding with '{embedding_model}' on {args.workers} worker(s), {args.batch_size} documents per batch...")
+    try:
+        rows, elapsed = run_pipeline(conn, vector_store, checkpoint, args.batch_size, args.workers, embedding_model)
+    finally:
+        conn.close()
+
+    checkpoint["complete"] = True
+    save_checkpoint(checkpoint)
 
+    peak = peak_rss_mb()
     print("\n--- Embedding Pipeline Complete ---")
-    print(f"Successfully embedded {len(documents)} documents.")
+    print(f"Successfully embedded {rows} documents this run ({checkpoint['rows']} in total).")
+    print(f"Throughput: {rows / elapsed if elapsed else 0.0:.1f} rows/s over {elapsed:.1f}s.")
+    print(f"Peak RSS: {f'{peak:.0f} MB' if peak is not None else 'n/a on this platform'}.")
     print(f"Vector store has been saved to '{vector_store._persist_directory}'")
 
 if __name__ == '__main__':
     # To run this script, you need to install the required packages:
     # pip install langchain-community sentence-transformers chromadb
-    main()
\ No newline at end of file
+    main()
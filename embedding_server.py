@@ -0,0 +1,320 @@
+# embedding_server.py
+# One process that holds the embedding model for the whole system.
+#
+# The bot's agent threads and the memory worker connect over a Unix socket (a
+# named pipe on Windows) instead of each loading all-MiniLM-L6-v2. Requests
+# that arrive close together are embedded as one batch: the batcher waits at
+# most MAX_BATCH_LATENCY after the first request for others to join, up to
+# MAX_BATCH_TEXTS texts. Vectors travel back as raw float32 bytes and are
+# wrapped with np.frombuffer on the client, without a copy or pickling.
+import itertools
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+from telemetry import SIZE_BUCKETS, MetricsPusher, configure_logging, metrics
+
+# --- CONFIGURATION ---
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+if sys.platform == "win32":
+    EMBEDDING_ADDRESS = r"\\.\pipe\crucible_embeddings"
+else:
+    EMBEDDING_ADDRESS = os.path.abspath("embedding.sock")
+MAX_BATCH_TEXTS = 64
+MAX_BATCH_LATENCY = 0.01  # Seconds the first request of a batch may wait for others to join.
+CONNECT_TIMEOUT = 300  # Seconds a client keeps retrying while the server loads the model.
+CONNECT_RETRY_SECONDS = 0.5
+REQUEST_TIMEOUT = 120  # Seconds a client waits for one reply before giving up on it.
+
+logger = logging.getLogger(__name__)
+
+
+def _family(address: str) -> str:
+    return "AF_PIPE" if address.startswith("\\\\") else "AF_UNIX"
+
+
+# --- SERVER ---
+class _Batcher:
+    """
+    Collects embedding requests from every connection and runs them through
+    the model in dynamic batches, replying to each request with its rows.
+    """
+
+    def __init__(self, embeddings, max_texts: int = MAX_BATCH_TEXTS, max_latency: float = MAX_BATCH_LATENCY):
+        self.embeddings = embeddings
+        self.max_texts = max_texts
+        self.max_latency = max_latency
+        self._requests = queue.Queue()
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "texts": 0, "batches": 0, "max_batch_texts": 0, "embed_seconds": 0.0}
+        self._started_at = time.monotonic()
+
+    def submit(self, texts: list[str], reply):
+        self._requests.put((texts, reply))
+
+    def run(self):
+        while True:
+            batch = [self._requests.get()]
+            count = len(batch[0][0])
+            deadline = time.monotonic() + self.max_latency
+            while count < self.max_texts:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._requests.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(request)
+                count += len(request[0])
+            self._embed(batch, count)
+
+    def _embed(self, batch: list, count: int):
+        texts = [text for request_texts, _ in batch for text in request_texts]
+        started = time.perf_counter()
+        try:
+            vectors = np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32) if texts else None
+        except Exception as e:
+            logger.exception("Embedding a batch of %d texts failed.", count)
+            for _, reply in batch:
+                reply(error=str(e))
+            return
+        seconds = time.perf_counter() - started
+        metrics.observe("crucible_embedding_batch_texts", count, buckets=SIZE_BUCKETS,
+                        help="Texts per batch run by the embedding server.")
+        metrics.observe("crucible_embedding_batch_seconds", seconds, help="Model time per embedding batch.")
+        metrics.inc("crucible_embedding_texts_total", count, help="Texts embedded by the embedding server.")
+        with self._lock:
+            self._stats["requests"] += len(batch)
+            self._stats["texts"] += count
+            self._stats["batches"] += 1
+            self._stats["max_batch_texts"] = max(self._stats["max_batch_texts"], count)
+            self._stats["embed_seconds"] += seconds
+        offset = 0
+        for request_texts, reply in batch:
+            rows = vectors[offset:offset + len(request_texts)] if vectors is not None else np.empty((0, 0), np.float32)
+            offset += len(request_texts)
+            reply(vectors=rows)
+
+    def stats(self) -> dict:
+        with self._lock:
+            snapshot = dict(self._stats)
+        elapsed = time.monotonic() - self._started_at
+        snapshot["mean_batch_texts"] = snapshot["texts"] / snapshot["batches"] if snapshot["batches"] else 0.0
+        snapshot["texts_per_second"] = snapshot["texts"] / snapshot["embed_seconds"] if snapshot["embed_seconds"] else 0.0
+        snapshot["uptime_seconds"] = elapsed
+        return snapshot
+
+
+def _serve_connection(conn, batcher: _Batcher):
+    """ Reads requests from one client until it disconnects. Replies may arrive in any order. """
+    send_lock = threading.Lock()
+
+    def reply_to(request_id):
+        def reply(vectors=None, error=None):
+            with send_lock:
+                try:
+                    if error is not None:
+                        conn.send(("error", request_id, error))
+                        return
+                    vectors = np.ascontiguousarray(vectors)
+                    conn.send(("vectors", request_id, vectors.shape))
+                    conn.send_bytes(vectors.data)
+                except OSError:
+                    pass  # The client went away; nothing to deliver.
+        return reply
+
+    try:
+        while True:
+            kind, request_id, payload = conn.recv()
+            if kind == "embed":
+                batcher.submit(list(payload), reply_to(request_id))
+            elif kind == "stats":
+                with send_lock:
+                    conn.send(("stats", request_id, batcher.stats()))
+    except (EOFError, OSError):
+        pass
+    finally:
+        conn.close()
+
+
+def serve_embeddings(address: str = EMBEDDING_ADDRESS, authkey: bytes = b"", model_name: str = EMBEDDING_MODEL,
+                     ready_event=None, metrics_queue=None, embeddings=None):
+    """
+    Loads the embedding model and serves it on `address` until the process is
+    stopped. Meant to run as its own process; `ready_event` is set once the
+    model is loaded and the socket accepts connections. Metrics go to the main
+    process over `metrics_queue`, like the memory worker's.
+    """
+    configure_logging()
+    if embeddings is None:
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+        started = time.perf_counter()
+        embeddings = HuggingFaceEmbeddings(model_name=model_name)
+        logger.info("Loaded '%s' in %.2fs.", model_name, time.perf_counter() - started)
+
+    if _family(address) == "AF_UNIX" and os.path.exists(address):
+        os.remove(address)  # Left behind by a previous run.
+    listener = Listener(address, family=_family(address), authkey=authkey or None)
+    batcher = _Batcher(embeddings)
+    threading.Thread(target=batcher.run, name="embedding-batcher", daemon=True).start()
+    pusher = MetricsPusher(metrics_queue, "embedding_server")
+    threading.Thread(target=_push_metrics, args=(pusher,), name="embedding-metrics", daemon=True).start()
+    logger.info("Serving embeddings on %s.", address)
+    if ready_event is not None:
+        ready_event.set()
+    try:
+        while True:
+            try:
+                conn = listener.accept()
+            except (AuthenticationError, OSError, EOFError) as e:  # e.g. a client with the wrong authkey
+                logger.warning("Rejected an embedding client: %s", e)
+                continue
+            threading.Thread(target=_serve_connection, args=(conn, batcher), name="embedding-client", daemon=True).start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+
+
+def _push_metrics(pusher: MetricsPusher):
+    while True:
+        time.sleep(pusher.interval)
+        pusher.maybe_push()
+
+
+# --- CLIENT ---
+class EmbeddingClient:
+    """
+    A thread-safe connection to the embedding server. Calls from many threads
+    share one connection and are matched to their replies by request ID, so
+    concurrent callers end up in the same server-side batch.
+    """
+
+    def __init__(self, address: str = EMBEDDING_ADDRESS, authkey: bytes = b"", connect_timeout: float = CONNECT_TIMEOUT,
+                 request_timeout: float = REQUEST_TIMEOUT):
+        self.address = address
+        self.authkey = authkey
+        self.connect_timeout = connect_timeout
+        self.request_timeout = request_timeout
+        self._conn = None
+        self._connect_lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._pending = {}  # request_id -> Future
+        self._pending_lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def _connection(self):
+        if self._conn is not None:
+            return self._conn
+        with self._connect_lock:
+            if self._conn is None:
+                deadline = time.monotonic() + self.connect_timeout
+                while True:
+                    try:
+                        conn = Client(self.address, family=_family(self.address), authkey=self.authkey or None)
+                        break
+                    except (FileNotFoundError, ConnectionRefusedError, OSError):
+                        if time.monotonic() >= deadline:
+                            raise ConnectionError(f"Embedding server at {self.address} is not reachable.")
+                        time.sleep(CONNECT_RETRY_SECONDS)  # Still loading the model.
+                threading.Thread(target=self._read_replies, args=(conn,), name="embedding-replies", daemon=True).start()
+                self._conn = conn
+        return self._conn
+
+    def _read_replies(self, conn):
+        try:
+            while True:
+                kind, request_id, payload = conn.recv()
+                if kind == "vectors":
+                    # A view over the received buffer; no copy.
+                    result = np.frombuffer(conn.recv_bytes(), dtype=np.float32).reshape(payload)
+                else:
+                    result = payload
+                with self._pending_lock:
+                    future = self._pending.pop(request_id, None)
+                if future is None:
+                    continue
+                if kind == "error":
+                    future.set_exception(RuntimeError(f"Embedding server error: {payload}"))
+                else:
+                    future.set_result(result)
+        except Exception as e:  # EOFError/OSError when the server goes away.
+            error = ConnectionError(f"Lost the embedding server connection: {e}")
+        with self._connect_lock:
+            self._conn = None
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(error)
+
+    def _request(self, kind: str, payload=None):
+        conn = self._connection()
+        request_id = next(self._ids)
+        future = Future()
+        with self._pending_lock:
+            self._pending[request_id] = future
+        try:
+            with self._send_lock:
+                conn.send((kind, request_id, payload))
+            return future.result(timeout=self.request_timeout)
+        except FutureTimeoutError:
+            raise TimeoutError(f"Embedding server did not answer within {self.request_timeout}s.") from None
+        finally:
+            # A reply that arrives after this finds no future and is dropped.
+            with self._pending_lock:
+                self._pending.pop(request_id, None)
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        """ Returns a read-only (len(texts), dimensions) float32 array. """
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        return self._request("embed", list(texts))
+
+    def stats(self) -> dict:
+        """ The server's request, batch-size and throughput statistics. """
+        return self._request("stats")
+
+    def close(self):
+        with self._connect_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def remote_embeddings(address: str = EMBEDDING_ADDRESS, authkey: bytes = b""):
+    """
+    Returns a LangChain Embeddings object backed by the embedding server, usable
+    wherever HuggingFaceEmbeddings was (Chroma, KnowledgeBase, the memory worker).
+    Queries and documents are embedded alike, as HuggingFaceEmbeddings does.
+    Use `.client.embed()` directly to get a NumPy array without list conversion.
+    """
+    from langchain_core.embeddings import Embeddings
+
+    class RemoteEmbeddings(Embeddings):
+        def __init__(self, client: EmbeddingClient):
+            self.client = client
+
+        def embed_documents(self, texts: list[str]) -> list[list[float]]:
+            return self.client.embed(texts).tolist()
+
+        def embed_query(self, text: str) -> list[float]:
+            return self.client.embed([text])[0].tolist()
+
+    return RemoteEmbeddings(EmbeddingClient(address, authkey))
+
+
+def main():
+    serve_embeddings()
+
+
+if __name__ == "__main__":
+    main()
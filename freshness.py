@@ -0,0 +1,152 @@
+# freshness.py
+import contextvars
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import db
+from telemetry import metrics
+
+# --- CONFIGURATION ---
+WAIT_FOR_OWN_WRITES_SECONDS = 1.5  # How long a retrieval waits for the memory worker to index the caller's writes.
+WAIT_POLL_SECONDS = 0.05
+MAX_TRACKED_CONVERSATIONS = 1000
+MAX_WRITES_PER_CONVERSATION = 50
+INDEX_LAG_SLO_SECONDS = 10.0  # Oldest unindexed change older than this is an SLO breach.
+LAG_CHECK_SECONDS = 5.0
+LAG_ALERT_REPEAT_SECONDS = 300  # While the SLO stays breached, repeat the warning this often.
+
+SQL_OLDEST_UNAPPLIED_CHANGE = "SELECT changed_at FROM task_changes WHERE seq > ? ORDER BY seq LIMIT 1"
+
+logger = logging.getLogger(__name__)
+
+# Read-your-writes: a write returns the change-log sequence it produced (its
+# version token). The token is remembered for the conversation the write was
+# made in, and a later retrieval in that conversation compares it with the
+# version the memory worker has published. If the worker is behind, the
+# retrieval waits briefly and then reads the missing tasks from SQLite.
+_conversation = contextvars.ContextVar("conversation", default=None)
+_writes = OrderedDict()  # conversation id -> OrderedDict(task_id -> version), least recently used first.
+_writes_lock = threading.Lock()
+_lag = {"seconds": 0.0, "slo_seconds": INDEX_LAG_SLO_SECONDS, "breaches": 0}
+
+
+def bind_conversation(conversation_id):
+    """ Marks the current context (an agent turn and the tools it runs) as part of a conversation. Returns a reset token. """
+    return _conversation.set(conversation_id)
+
+
+def unbind_conversation(token):
+    _conversation.reset(token)
+
+
+def record_write(task_id: int, version: int):
+    """ Remembers that the current conversation wrote `task_id` at change-log sequence `version`. """
+    conversation_id = _conversation.get()
+    if conversation_id is None or not version:
+        return
+    with _writes_lock:
+        writes = _writes.pop(conversation_id, None) or OrderedDict()
+        writes.pop(task_id, None)
+        writes[task_id] = version
+        while len(writes) > MAX_WRITES_PER_CONVERSATION:
+            writes.popitem(last=False)
+        _writes[conversation_id] = writes
+        while len(_writes) > MAX_TRACKED_CONVERSATIONS:
+            _writes.popitem(last=False)
+
+
+def pending_writes(applied_version: int) -> dict[int, int]:
+    """
+    Returns {task_id: version} for the current conversation's writes that the
+    vector index does not reflect yet, forgetting the ones it does.
+    """
+    conversation_id = _conversation.get()
+    if conversation_id is None:
+        return {}
+    with _writes_lock:
+        writes = _writes.get(conversation_id)
+        if not writes:
+            return {}
+        for task_id in [task_id for task_id, version in writes.items() if version <= applied_version]:
+            del writes[task_id]
+        if not writes:
+            del _writes[conversation_id]
+        return dict(writes)
+
+
+def wait_for_version(version_fn, target: int, timeout: float = WAIT_FOR_OWN_WRITES_SECONDS) -> bool:
+    """ Polls `version_fn` until it reaches `target`; returns False if `timeout` runs out first. """
+    deadline = time.monotonic() + timeout
+    while version_fn() < target:
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(WAIT_POLL_SECONDS)
+    return True
+
+
+def unindexed_own_writes(version_fn) -> list[int]:
+    """
+    Returns the IDs of tasks this conversation wrote that are still missing
+    from the vector index after waiting up to WAIT_FOR_OWN_WRITES_SECONDS.
+    The caller reads them from SQLite instead.
+    """
+    pending = pending_writes(version_fn())
+    if not pending:
+        return []
+    started = time.perf_counter()
+    caught_up = wait_for_version(version_fn, max(pending.values()))
+    metrics.observe("crucible_own_write_wait_seconds", time.perf_counter() - started,
+                    help="Time retrievals waited for the index to include the conversation's own writes.")
+    if caught_up:
+        return []
+    metrics.inc("crucible_own_write_fallbacks_total", help="Retrievals that read the conversation's own writes from SQLite.")
+    return list(pending_writes(version_fn()))
+
+
+# --- INDEXING LAG ---
+def index_lag_seconds(conn, applied_version: int) -> float:
+    """ Age of the oldest change the memory worker has not applied yet; 0 when it is caught up. """
+    row = conn.execute(SQL_OLDEST_UNAPPLIED_CHANGE, (applied_version,)).fetchone()
+    return max(0.0, time.time() - row[0]) if row else 0.0
+
+
+def lag_stats() -> dict:
+    return dict(_lag)
+
+
+def start_lag_monitor(version_fn, db_file: str = db.DB_FILE, interval: float = LAG_CHECK_SECONDS,
+                      slo_seconds: float = INDEX_LAG_SLO_SECONDS) -> threading.Thread:
+    """
+    Measures the indexing lag every `interval` seconds on a daemon thread and
+    logs a warning while it exceeds `slo_seconds`. The latest value is served
+    through lag_stats().
+    """
+    _lag["slo_seconds"] = slo_seconds
+
+    def run():
+        last_alert = 0.0
+        while True:
+            time.sleep(interval)
+            try:
+                with db.get_pool(db_file).connection() as conn:
+                    lag = index_lag_seconds(conn, version_fn())
+            except db.Error as e:
+                logger.debug("Could not measure the indexing lag: %s", e)
+                continue
+            _lag["seconds"] = lag
+            if lag <= slo_seconds:
+                if last_alert:
+                    logger.info("Indexing lag back within the SLO (%.1fs).", lag)
+                last_alert = 0.0
+                continue
+            if time.monotonic() - last_alert >= LAG_ALERT_REPEAT_SECONDS:
+                _lag["breaches"] += 1
+                metrics.inc("crucible_index_lag_slo_breaches_total", help="Times the indexing lag exceeded its SLO.")
+                logger.warning("Indexing lag is %.1fs, above the %.0fs SLO; is the memory worker running?", lag, slo_seconds)
+                last_alert = time.monotonic()
+
+    thread = threading.Thread(target=run, name="index-lag-monitor", daemon=True)
+    thread.start()
+    return thread
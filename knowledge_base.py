@@ -0,0 +1,368 @@
+# knowledge_base.py
+import contextvars
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.documents import Document
+
+import db
+import freshness
+from cache import LRUCache, normalize_query
+from memory_manager import format_task_as_document, get_task_documents_by_ids
+from telemetry import span
+from vector_index import active_collection, open_vector_store
+
+# --- CONFIGURATION (Should match other scripts) ---
+DB_FILE = "project_tasks.db"
+CHROMA_PERSIST_DIR = "./chroma_db"
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+DEFAULT_K = 4
+WARM_UP_QUERY = "warm up"
+EMBEDDING_CACHE_SIZE = 1024
+EMBEDDING_CACHE_TTL = None  # Query embeddings only depend on the text and the model.
+RESULT_CACHE_SIZE = 256
+RESULT_CACHE_TTL = 600  # Seconds; a backstop in case a data-version bump is missed.
+HYBRID_SEARCH = True  # Fuse BM25 (SQLite FTS5) with vector similarity.
+CANDIDATES_PER_RETRIEVER = 3  # Each retriever contributes k * this many candidates to the fusion.
+RRF_K = 60  # Reciprocal-rank-fusion damping constant.
+LEXICAL_WORKERS = 4
+FILTER_IN_LIMIT = 2000  # Above this many SQL candidates, filter Chroma by metadata instead of ID list.
+COLLECTION_CHECK_SECONDS = 2.0  # How often searches check whether a re-index switched the active collection.
+
+logger = logging.getLogger(__name__)
+
+
+def reciprocal_rank_fusion(ranked_lists: list[list[Document]], k: int, rrf_k: int = RRF_K) -> list[Document]:
+    """
+    Merges ranked document lists by summing 1 / (rrf_k + rank) per task, so a
+    task ranked well by either retriever (or moderately by both) rises to the top.
+    """
+    scores = {}
+    documents = {}
+    for ranked in ranked_lists:
+        for rank, doc in enumerate(ranked, start=1):
+            task_id = doc.metadata.get("task_id")
+            scores[task_id] = scores.get(task_id, 0.0) + 1.0 / (rrf_k + rank)
+            documents.setdefault(task_id, doc)
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [documents[task_id] for task_id in best]
+
+
+class KnowledgeBase:
+    """
+    A long-lived handle on the embedding model and the vector store (Chroma or
+    the NumPy index, see vector_index.py).
+
+    The model weights and the vector store are loaded once and then shared by
+    every tool call, so a retrieval only pays for the query embedding and the
+    nearest-neighbour lookup. Instances are safe to use from the worker threads
+    that `asyncio.to_thread` hands agent invocations to.
+
+    Repeated questions skip both steps: query embeddings are cached by
+    normalized text, and top-k results are cached by normalized text plus the
+    shared `data_version` counter that the memory manager bumps whenever it
+    changes the vector store, so stale results are never served.
+
+    With `hybrid` enabled, a BM25 search over the SQLite FTS5 index runs in
+    parallel with the vector search and the two rankings are merged with
+    reciprocal-rank fusion, so exact task titles, people and project names
+    are found even when their embeddings are not the nearest neighbours.
+
+    Tasks the current conversation wrote itself are always visible: if the
+    memory manager has not indexed them yet, a search waits briefly for it and
+    otherwise reads them from SQLite and ranks them first (see freshness.py).
+
+    The store opened is the collection the task database's meta table names
+    as active. When reindex.py switches it, searches move to the new
+    collection (and its embedding model) within COLLECTION_CHECK_SECONDS.
+    """
+
+    def __init__(self, persist_directory: str = CHROMA_PERSIST_DIR,
+                 embedding_model: str = EMBEDDING_MODEL, k: int = DEFAULT_K,
+                 data_version=None, db_file: str = DB_FILE, hybrid: bool = HYBRID_SEARCH,
+                 embeddings=None, backend: str | None = None):
+        self.db_file = db_file
+        self.backend = backend  # None uses vector_index.VECTOR_BACKEND.
+        self.hybrid = hybrid
+        self._lexical_executor = ThreadPoolExecutor(max_workers=LEXICAL_WORKERS, thread_name_prefix="kb-lexical")
+        self._lexical_available = True
+        self.persist_directory = persist_directory
+        self.embedding_model = embedding_model
+        self.k = k
+        self.data_version = data_version  # A multiprocessing.Value shared with the memory manager.
+        self.embedding_cache = LRUCache(maxsize=EMBEDDING_CACHE_SIZE, ttl=EMBEDDING_CACHE_TTL)
+        self.result_cache = LRUCache(maxsize=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL)
+        self.embeddings = embeddings  # A ready LangChain Embeddings object skips loading `embedding_model`.
+        self._given_embeddings = embeddings
+        self.vector_store = None
+        self.collection = None
+        self.active_model = None  # The model of the open collection; differs from `embedding_model` after a re-index.
+        self._collection_checked_at = 0.0
+        self._load_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "queries": 0,
+            "embed_seconds": 0.0,
+            "search_seconds": 0.0,
+            "lexical_seconds": 0.0,
+            "lexical_searches": 0,
+            "load_seconds": 0.0,
+            "warm_up_seconds": 0.0,
+        }
+
+    @property
+    def is_loaded(self) -> bool:
+        return self.vector_store is not None
+
+    def load(self):
+        """ Loads the embedding model and opens the vector store (only once). """
+        if self.is_loaded:
+            return
+        with self._load_lock:
+            if self.is_loaded:
+                return
+            if not os.path.exists(self.persist_directory):
+                raise FileNotFoundError(
+                    f"Knowledge base not found at '{self.persist_directory}'. Please run embed_db.py."
+                )
+            start = time.perf_counter()
+            self._open(*self._active_collection())
+            self._collection_checked_at = time.monotonic()
+            self._record("load_seconds", time.perf_counter() - start)
+
+    def _active_collection(self) -> tuple[str, str]:
+        with db.get_pool(self.db_file).connection() as conn:
+            return active_collection(conn, self.embedding_model)
+
+    def _open(self, collection: str, model: str):
+        if model == self.embedding_model and self._given_embeddings is not None:
+            embeddings = self._given_embeddings
+        else:
+            # Imported here: this pulls in torch and sentence-transformers.
+            from langchain_community.embeddings import HuggingFaceEmbeddings
+            embeddings = HuggingFaceEmbeddings(model_name=model)
+        vector_store = open_vector_store(self.persist_directory, embeddings, collection_name=collection,
+                                         backend=self.backend)
+        self.embeddings = embeddings
+        self.collection = collection
+        self.active_model = model
+        self.vector_store = vector_store  # Set last: it is what `is_loaded` checks.
+
+    def follow_reindex(self):
+        """
+        Switches to the collection a re-index made active, checking at most
+        every COLLECTION_CHECK_SECONDS. Both caches are cleared: their vectors
+        and results came from the old collection and model.
+        """
+        now = time.monotonic()
+        if now - self._collection_checked_at < COLLECTION_CHECK_SECONDS:
+            return
+        self._collection_checked_at = now
+        collection, model = self._active_collection()
+        if collection == self.collection:
+            return
+        with self._load_lock:
+            if collection == self.collection:
+                return
+            start = time.perf_counter()
+            self._open(collection, model)
+            self.embedding_cache.clear()
+            self.result_cache.clear()
+        logger.info("Switched to vector collection '%s' (%s) in %.2fs.", collection, model, time.perf_counter() - start)
+
+    def warm_up(self):
+        """
+        Runs one throwaway retrieval so the first real query does not pay for
+        tokenizer start-up, lazy model initialisation or loading the ANN index.
+        """
+        self.load()
+        start = time.perf_counter()
+        vector = self.embeddings.embed_query(WARM_UP_QUERY)
+        self.vector_store.similarity_search_by_vector(vector, k=1)
+        self._record("warm_up_seconds", time.perf_counter() - start)
+
+    def current_version(self) -> int:
+        """ Returns the data version last published by the memory manager. """
+        return self.data_version.value if self.data_version is not None else 0
+
+    def embed_query(self, query: str) -> list[float]:
+        """ Returns the embedding for a query, reusing a cached vector when possible. """
+        self.load()
+        key = normalize_query(query)
+        vector = self.embedding_cache.get(key)
+        if vector is None:
+            start = time.perf_counter()
+            with span("retrieval.embed", tokens=len(key.split())):
+                vector = self.embeddings.embed_query(key)
+            self._record("embed_seconds", time.perf_counter() - start)
+            self.embedding_cache.put(key, vector)
+        return vector
+
+    def search(self, query: str, k: int | None = None) -> list[Document]:
+        """ Returns the k most relevant task documents for a query. """
+        self.load()
+        self.follow_reindex()
+        k = k or self.k
+        with self._stats_lock:
+            self._stats["queries"] += 1
+
+        own_writes = self.unindexed_own_writes()
+        result_key = (normalize_query(query), k, self.current_version())
+        docs = self.result_cache.get(result_key) if not own_writes else None
+        if docs is not None:
+            return docs
+
+        with span("retrieval.search") as s:
+            if self.hybrid and self._lexical_available:
+                candidates = k * CANDIDATES_PER_RETRIEVER
+                # Run in a copy of this context so the lexical span joins the turn's trace.
+                lexical = self._lexical_executor.submit(contextvars.copy_context().run, self.lexical_search,
+                                                        query, candidates)
+                vector_docs = self.vector_search(query, candidates)
+                docs = reciprocal_rank_fusion([lexical.result(), vector_docs], k)
+            else:
+                docs = self.vector_search(query, k)
+            s.set(documents=len(docs))
+        if own_writes:
+            # Not cached: the result changes as soon as the index catches up.
+            return reciprocal_rank_fusion([own_writes, docs], k)
+        self.result_cache.put(result_key, docs)
+        return docs
+
+    def filtered_search(self, query: str, limit: int, **filters) -> list[Document]:
+        """
+        Returns up to `limit` tasks matching the structured filters (see
+        `db.build_task_filter_query`), ranked by relevance to `query` if one is
+        given, otherwise soonest-due first.
+
+        The filters run as indexed SQL first, so similarity is only computed
+        within the matching candidate set: small sets are passed to Chroma as a
+        `task_id $in` clause, larger ones are narrowed with the equality
+        metadata Chroma already stores and then checked against the SQL set.
+        If the ranked hits come up short of `limit` (a large set with no
+        equality filter, or tasks not indexed yet), the rest are filled in
+        SQL order.
+        """
+        filters = {name: value for name, value in filters.items() if value}
+        if query:
+            self.load()
+            self.follow_reindex()
+        # The SQL filters always see the latest rows; only the ranking needs the conversation's unindexed writes.
+        own_writes = self.unindexed_own_writes() if query else []
+        result_key = ("filtered", normalize_query(query or ""), limit,
+                      tuple(sorted(filters.items())), self.current_version())
+        docs = self.result_cache.get(result_key) if not own_writes else None
+        if docs is not None:
+            return docs
+
+        sql, params = db.build_task_filter_query(**filters, limit=None if query else limit)
+        with db.get_pool(self.db_file).connection() as conn:
+            with span("sql.task_filter") as s:
+                task_ids = [row["id"] for row in conn.execute(sql, params)]
+                s.set(rows=len(task_ids))
+            if not query:
+                # Nothing to rank by: the SQL order (soonest due, highest priority) is the answer.
+                docs = self.documents_in_order(conn, task_ids)
+                self.result_cache.put(result_key, docs)
+                return docs
+
+        if not task_ids:
+            return []
+        candidates = set(task_ids)
+        if len(task_ids) <= FILTER_IN_LIMIT:
+            where = {"task_id": {"$in": task_ids}}
+            fetch = limit * CANDIDATES_PER_RETRIEVER
+        else:
+            equality = [{field: filters[field]} for field in ("status", "priority") if field in filters]
+            where = equality[0] if len(equality) == 1 else ({"$and": equality} if equality else None)
+            fetch = limit * CANDIDATES_PER_RETRIEVER * 4  # Over-fetch; some hits fail the SQL check.
+
+        ranked = [[doc for doc in self.vector_search(query, fetch, where) if doc.metadata.get("task_id") in candidates]]
+        if self.hybrid and self._lexical_available:
+            lexical = self.lexical_search(query, fetch * 4)
+            ranked.append([doc for doc in lexical if doc.metadata.get("task_id") in candidates])
+        if own_writes:
+            ranked.insert(0, [doc for doc in own_writes if doc.metadata.get("task_id") in candidates])
+        docs = reciprocal_rank_fusion(ranked, limit)
+        if len(docs) < limit:
+            found = {doc.metadata.get("task_id") for doc in docs}
+            rest = [task_id for task_id in task_ids if task_id not in found][:limit - len(docs)]
+            with db.get_pool(self.db_file).connection() as conn:
+                docs += self.documents_in_order(conn, rest)
+        if not own_writes:
+            self.result_cache.put(result_key, docs)
+        return docs
+
+    @staticmethod
+    def documents_in_order(conn, task_ids: list[int]) -> list[Document]:
+        """ Task documents for `task_ids`, in that order (IDs deleted meanwhile are skipped). """
+        rows = conn.execute(db.sql_tasks_by_ids(len(task_ids)), task_ids).fetchall() if task_ids else []
+        by_id = {row["id"]: format_task_as_document(row) for row in rows}
+        return [by_id[task_id] for task_id in task_ids if task_id in by_id]
+
+    def unindexed_own_writes(self) -> list[Document]:
+        """ Documents for tasks this conversation wrote that the vector index does not have yet, read from SQLite. """
+        task_ids = freshness.unindexed_own_writes(self.current_version)
+        if not task_ids:
+            return []
+        with db.get_pool(self.db_file).connection() as conn:
+            documents = get_task_documents_by_ids(conn, task_ids)
+        return [documents[task_id] for task_id in reversed(task_ids) if task_id in documents]
+
+    def vector_search(self, query: str, limit: int, where: dict | None = None) -> list[Document]:
+        """ Nearest-neighbour search over the task embeddings, optionally restricted by a Chroma-style `where` clause. """
+        vector = self.embed_query(query)
+        start = time.perf_counter()
+        with span("retrieval.vector") as s:
+            docs = self.vector_store.similarity_search_by_vector(vector, k=limit, filter=where)
+            s.set(documents=len(docs))
+        self._record("search_seconds", time.perf_counter() - start)
+        return docs
+
+    def lexical_search(self, query: str, limit: int) -> list[Document]:
+        """ BM25-ranked full-text search over the tasks_fts index in SQLite. """
+        match = db.to_fts_query(query)
+        if not match:
+            return []
+        start = time.perf_counter()
+        try:
+            with span("retrieval.lexical") as s, db.get_pool(self.db_file).connection() as conn:
+                task_ids = [row["id"] for row in conn.execute(db.SQL_SEARCH_TASKS_FTS, (match, limit))]
+                rows = conn.execute(db.sql_tasks_by_ids(len(task_ids)), task_ids).fetchall() if task_ids else []
+                s.set(rows=len(rows))
+        except sqlite3.OperationalError as e:
+            # Most likely a database created before the FTS index existed; run setup_db.py to add it.
+            logger.warning("Full-text search unavailable (%s); using vector search only.", e)
+            self._lexical_available = False
+            return []
+        by_id = {row["id"]: format_task_as_document(row) for row in rows}
+        with self._stats_lock:
+            self._stats["lexical_searches"] += 1
+            self._stats["lexical_seconds"] += time.perf_counter() - start
+        return [by_id[task_id] for task_id in task_ids if task_id in by_id]
+
+    def stats(self) -> dict:
+        """ Returns a snapshot of the timing counters and cache hit/miss statistics. """
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+        embedded = self.embedding_cache.misses
+        searched = self.result_cache.misses
+        snapshot["avg_embed_ms"] = 1000 * snapshot["embed_seconds"] / embedded if embedded else 0.0
+        snapshot["avg_search_ms"] = 1000 * snapshot["search_seconds"] / searched if searched else 0.0
+        lexical = snapshot["lexical_searches"]
+        snapshot["avg_lexical_ms"] = 1000 * snapshot["lexical_seconds"] / lexical if lexical else 0.0
+        snapshot["data_version"] = self.current_version()
+        snapshot["collection"] = self.collection
+        snapshot["embedding_cache"] = self.embedding_cache.stats()
+        snapshot["result_cache"] = self.result_cache.stats()
+        if hasattr(self.vector_store, "stats"):  # The NumPy index reports its size, tombstones and compactions.
+            snapshot["vector_store"] = self.vector_store.stats()
+        return snapshot
+
+    def _record(self, key: str, seconds: float):
+        with self._stats_lock:
+            self._stats[key] += seconds
@@ -0,0 +1,209 @@
+# llm_stub.py
+# A local stand-in for the LM Studio server: an OpenAI-compatible
+# /v1/chat/completions endpoint that replies with scripted ReAct output after a
+# configurable prefill delay, at a configurable token rate, with a limited
+# number of parallel slots like a single local GPU. Used by loadtest.py; it can
+# also be run on its own so the bot can be exercised without a model:
+#
+#   python llm_stub.py --port 1234 --latency 0.5 --tokens-per-sec 30
+import argparse
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- CONFIGURATION ---
+DEFAULT_PORT = 1234
+DEFAULT_LATENCY = 0.5  # Seconds before the first token (prompt prefill).
+DEFAULT_TOKENS_PER_SEC = 30.0
+DEFAULT_SLOTS = 1  # Requests generated at once; the rest wait, as on a single-GPU server.
+DEFAULT_TOOL_STEPS = 1  # Tool calls scripted before the final answer.
+MODEL_ID = "local-model"
+
+# Tool calls the scripted agent cycles through; each must exist in merged_agent.initialize_agent().
+SCRIPTED_ACTIONS = (
+    ("SearchTasks", '{"status": "In Progress", "limit": 5}'),
+    ("ListUsers", "none"),
+    ("KnowledgeBaseRetriever", "tasks about the website"),
+)
+
+
+def scripted_reply(prompt: str, tool_steps: int) -> str:
+    """
+    Returns the next ReAct step for a prompt: tool calls until `tool_steps`
+    observations are present, then a final answer. Anything that is not an
+    agent prompt (e.g. a history summary request) gets a short summary.
+    """
+    if "Final Answer:" not in prompt or "Begin!" not in prompt:
+        return "The user asked about project tasks and got a list of matching tasks."
+    # Only the scratchpad after the new input counts; the history may contain old observations.
+    scratchpad = prompt.rsplit("New input:", 1)[-1]
+    steps_taken = scratchpad.count("Observation:")
+    if steps_taken < tool_steps:
+        tool, tool_input = SCRIPTED_ACTIONS[steps_taken % len(SCRIPTED_ACTIONS)]
+        return f"Thought: Do I need to use a tool? Yes\nAction: {tool}\nAction Input: {tool_input}"
+    return ("Thought: Do I need to use a tool? No\nFinal Answer: Here is what I found. There are several tasks "
+            "in progress across the active projects; the most urgent ones are assigned to the platform team "
+            "and are due within the next two weeks. Let me know if you want the full list.")
+
+
+def tokenize(text: str) -> list[str]:
+    """ Splits text into word-sized pieces that keep their whitespace, as streamed tokens. """
+    pieces, start = [], 0
+    for i, char in enumerate(text):
+        if char in " \n" and i > start:
+            pieces.append(text[start:i])
+            start = i
+    pieces.append(text[start:])
+    return [piece for piece in pieces if piece]
+
+
+class StubLLMServer:
+    """ Runs the stub on a background thread; use as a context manager or call start()/stop(). """
+
+    def __init__(self, port: int = DEFAULT_PORT, latency: float = DEFAULT_LATENCY,
+                 tokens_per_sec: float = DEFAULT_TOKENS_PER_SEC, slots: int = DEFAULT_SLOTS,
+                 tool_steps: int = DEFAULT_TOOL_STEPS, host: str = "127.0.0.1"):
+        self.latency = latency
+        self.tokens_per_sec = tokens_per_sec
+        self.tool_steps = tool_steps
+        self._slots = threading.Semaphore(slots)
+        self._stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "completion_tokens": 0, "active": 0, "peak_active": 0}
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="llm-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _count(self, key: str, delta: int):
+        with self._stats_lock:
+            self.stats[key] += delta
+            if key == "active":
+                self.stats["peak_active"] = max(self.stats["peak_active"], self.stats["active"])
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass  # Keep load-test output readable.
+
+            def _send_json(self, payload: dict, status: int = 200):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/models"):
+                    self._send_json({"object": "list", "data": [{"id": MODEL_ID, "object": "model"}]})
+                else:
+                    self._send_json({"error": "not found"}, 404)
+
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send_json({"error": "not found"}, 404)
+                    return
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                prompt = "\n".join(str(message.get("content", "")) for message in request.get("messages", []))
+                tokens = tokenize(scripted_reply(prompt, stub.tool_steps))
+                completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+                stub._count("requests", 1)
+                with stub._slots:
+                    stub._count("active", 1)
+                    try:
+                        time.sleep(stub.latency)
+                        if request.get("stream"):
+                            self._stream(completion_id, tokens)
+                        else:
+                            time.sleep(len(tokens) / stub.tokens_per_sec)
+                            self._send_json(self._completion(completion_id, "".join(tokens), len(prompt) // 4, len(tokens)))
+                    finally:
+                        stub._count("active", -1)
+                        stub._count("completion_tokens", len(tokens))
+
+            def _completion(self, completion_id, text, prompt_tokens, completion_tokens):
+                return {
+                    "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": MODEL_ID,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                              "total_tokens": prompt_tokens + completion_tokens},
+                }
+
+            def _stream(self, completion_id, tokens):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+
+                def chunk(delta, finish_reason=None):
+                    payload = {
+                        "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                        "model": MODEL_ID,
+                        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                    }
+                    self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode())
+                    self.wfile.flush()
+
+                chunk({"role": "assistant", "content": ""})
+                for token in tokens:
+                    time.sleep(1 / stub.tokens_per_sec)
+                    chunk({"content": token})
+                chunk({}, "stop")
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+        return Handler
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve a scripted OpenAI-compatible LLM stand-in.")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency", type=float, default=DEFAULT_LATENCY, help="Seconds before the first token.")
+    parser.add_argument("--tokens-per-sec", type=float, default=DEFAULT_TOKENS_PER_SEC)
+    parser.add_argument("--slots", type=int, default=DEFAULT_SLOTS, help="Requests generated in parallel.")
+    parser.add_argument("--tool-steps", type=int, default=DEFAULT_TOOL_STEPS, help="Tool calls before the final answer.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    server = StubLLMServer(args.port, args.latency, args.tokens_per_sec, args.slots, args.tool_steps)
+    print(f"[LLMStub] Serving {server.base_url} (latency {args.latency}s, {args.tokens_per_sec} tokens/s, "
+          f"{args.slots} slot(s), {args.tool_steps} tool step(s)).")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._server.server_close()
+
+
+if __name__ == "__main__":
+    main()
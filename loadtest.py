@@ -0,0 +1,285 @@
+# loadtest.py
+# End-to-end load test of bot.on_message without Discord or a real model.
+#
+# Simulated users mention the bot concurrently through fake Discord message
+# and channel objects; the agent talks to llm_stub.StubLLMServer, which replies
+# with scripted ReAct steps at a configurable latency and token rate. The
+# knowledge base uses a seeded database and a deterministic fake embedding.
+# For each concurrency level it reports end-to-end p50/p99 latency,
+# throughput, scheduler queue depth and process memory.
+#
+#   python loadtest.py --concurrency 1,4,16 --messages 5 --latency 0.5 --tokens-per-sec 30 --slots 1
+import argparse
+import asyncio
+import contextlib
+import io
+import itertools
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+try:
+    import resource  # Unix only; used for peak RSS reporting.
+except ImportError:
+    resource = None
+
+from llm_stub import StubLLMServer
+
+# --- CONFIGURATION ---
+DEFAULT_CONCURRENCY = "1,4,16"
+DEFAULT_MESSAGES = 5  # Messages each simulated user sends, one after another.
+DEFAULT_TASKS = 2000
+QUEUE_SAMPLE_SECONDS = 0.1
+BOT_NAME = "CrucibleBot"
+SEED = 7
+
+# A mix of fast-path and agent questions, like real traffic.
+QUERIES = (
+    "list all users",
+    "show me task 12",
+    "which high priority tasks are in progress?",
+    "what is the status of the website redesign work?",
+    "who is working on the data warehouse migration?",
+    "summarize the open tasks for the mobile app launch",
+    "what should the team focus on this week?",
+)
+
+
+# --- FAKE DISCORD OBJECTS ---
+class FakeUser:
+    def __init__(self, user_id: int, name: str):
+        self.id = user_id
+        self.name = name
+        self.roles = []
+
+    def mentioned_in(self, message) -> bool:
+        return self in message.mentions
+
+    def __str__(self):
+        return self.name
+
+
+class FakeSentMessage:
+    def __init__(self, channel, content: str):
+        self.channel = channel
+        self.content = content
+
+    async def edit(self, content: str):
+        self.content = content
+        self.channel.edits += 1
+
+    async def delete(self):
+        self.content = None
+
+
+class FakeChannel:
+    """ Records what the bot sends; `typing()` is a no-op. """
+
+    def __init__(self):
+        self.sent = []
+        self.edits = 0
+
+    async def send(self, content: str):
+        message = FakeSentMessage(self, content)
+        self.sent.append(message)
+        return message
+
+    @contextlib.asynccontextmanager
+    async def typing(self):
+        yield
+
+
+class FakeGuild:
+    def __init__(self):
+        self.me = type("Member", (), {"nick": None})()
+
+
+class FakeMessage:
+    def __init__(self, author: FakeUser, bot_user: FakeUser, text: str, guild: FakeGuild | None):
+        self.author = author
+        self.mentions = [bot_user]
+        self.content = f"<@{bot_user.id}> {text}"
+        self.clean_content = f"@{bot_user.name} {text}"
+        self.guild = guild
+        self.channel = FakeChannel()
+
+
+class FakeClient:
+    def __init__(self, user: FakeUser):
+        self.user = user
+
+
+def current_rss_mb() -> float | None:
+    """ Resident memory of this process, from /proc on Linux or the peak RSS elsewhere. """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        if resource is None:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def percentile(samples: list[float], p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))] if ordered else 0.0
+
+
+# --- SET-UP ---
+def prepare_bot(workdir: str, llm: StubLLMServer, num_tasks: int, answer_cache: bool):
+    """
+    Imports bot.py against a seeded database, a fake-embedding knowledge base
+    and the stub LLM, and marks it ready. Returns the bot module.
+    """
+    os.environ.setdefault("DISCORD_TOKEN", "load-test")
+    import benchmark
+    import db
+    import merged_agent
+    from answer_cache import SemanticAnswerCache
+    from conversation import ConversationStore
+    from knowledge_base import KnowledgeBase
+    from memory_manager import sync_vector_store
+    from vector_index import open_vector_store
+    from router import FastPathRouter
+
+    db_file = os.path.join(workdir, "tasks.db")
+    chroma_dir = os.path.join(workdir, "chroma")
+    os.makedirs(chroma_dir)
+    benchmark.build_database(db_file, num_tasks, SEED)
+    embeddings = benchmark.make_embeddings("fake")
+    with db.get_pool(db_file).connection() as conn:
+        benchmark.quiet(sync_vector_store, conn, open_vector_store(chroma_dir, embeddings))
+
+    merged_agent.DB_FILE = db_file
+    merged_agent.LOCAL_LLM_URL = llm.base_url
+    knowledge_base = KnowledgeBase(persist_directory=chroma_dir, db_file=db_file, embeddings=embeddings)
+    knowledge_base.warm_up()
+    merged_agent.knowledge_base = knowledge_base
+    if answer_cache:
+        merged_agent.answer_cache = SemanticAnswerCache(knowledge_base.embed_query, knowledge_base.current_version,
+                                                        db_file=os.path.join(workdir, "answer_cache.db"),
+                                                        names_fn=merged_agent.known_names,
+                                                        model_fn=lambda: knowledge_base.active_model)
+    merged_agent.initialize_agent(load_knowledge_base=False)
+
+    import bot
+    bot.client = FakeClient(FakeUser(0, BOT_NAME))
+    bot.router = FastPathRouter(db_file)
+    bot.conversations = ConversationStore(db_file)
+    bot.readiness.register("load_test")
+    bot.readiness.mark_ready("load_test")
+    return bot
+
+
+# --- LOAD ---
+async def run_level(bot, concurrency: int, messages: int, dm_ratio: float, user_ids) -> dict:
+    """ Runs `concurrency` simulated users, each sending `messages` mentions back to back. """
+    rng = random.Random(SEED + concurrency)
+    guild = FakeGuild()
+    bot_user = bot.client.user
+    latencies, errors = [], 0
+    queue_samples = []
+    stop = asyncio.Event()
+
+    async def sample_queue():
+        while not stop.is_set():
+            queue_samples.append(bot.scheduler.stats()["queue_depth"])
+            await asyncio.sleep(QUEUE_SAMPLE_SECONDS)
+
+    async def simulated_user():
+        nonlocal errors
+        author = FakeUser(next(user_ids), f"user{rng.randrange(10**6)}")
+        for _ in range(messages):
+            message = FakeMessage(author, bot_user, rng.choice(QUERIES), None if rng.random() < dm_ratio else guild)
+            start = time.perf_counter()
+            try:
+                await bot.on_message(message)
+            except Exception as e:
+                errors += 1
+                print(f"[LoadTest] on_message failed: {e}", file=sys.__stdout__)
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    sampler = asyncio.create_task(sample_queue())
+    started = time.perf_counter()
+    await asyncio.gather(*(simulated_user() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await sampler
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_seconds": percentile(latencies, 0.50),
+        "p99_seconds": percentile(latencies, 0.99),
+        "throughput_per_sec": len(latencies) / elapsed if elapsed else 0.0,
+        "queue_depth_max": max(queue_samples, default=0),
+        "queue_depth_mean": sum(queue_samples) / len(queue_samples) if queue_samples else 0.0,
+        "rss_mb": current_rss_mb(),
+        "scheduler": bot.scheduler.stats(),
+    }
+
+
+async def run_levels(bot, levels: list[int], messages: int, dm_ratio: float, verbose: bool) -> list[dict]:
+    user_ids = itertools.count(1)
+    results = []
+    for concurrency in levels:
+        print(f"[LoadTest] {concurrency} concurrent user(s) x {messages} message(s)...", file=sys.__stdout__, flush=True)
+        output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+        with output:
+            result = await run_level(bot, concurrency, messages, dm_ratio, user_ids)
+        results.append(result)
+        print(f"[LoadTest]   p50 {result['p50_seconds']:.2f}s  p99 {result['p99_seconds']:.2f}s  "
+              f"{result['throughput_per_sec']:.2f} req/s  queue max {result['queue_depth_max']}  "
+              f"RSS {result['rss_mb'] or 0:.0f} MB  errors {result['errors']}", file=sys.__stdout__, flush=True)
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load-test the bot's message handler against a stub LLM.")
+    parser.add_argument("--concurrency", default=DEFAULT_CONCURRENCY, help="Comma-separated numbers of concurrent users.")
+    parser.add_argument("--messages", type=int, default=DEFAULT_MESSAGES, help="Messages per simulated user.")
+    parser.add_argument("--tasks", type=int, default=DEFAULT_TASKS, help="Tasks in the generated database.")
+    parser.add_argument("--latency", type=float, default=0.5, help="Stub LLM seconds before the first token.")
+    parser.add_argument("--tokens-per-sec", type=float, default=30.0, help="Stub LLM generation speed.")
+    parser.add_argument("--slots", type=int, default=1, help="Requests the stub LLM generates in parallel.")
+    parser.add_argument("--tool-steps", type=int, default=1, help="Scripted tool calls before each final answer.")
+    parser.add_argument("--dm-ratio", type=float, default=0.1, help="Fraction of messages sent as DMs.")
+    parser.add_argument("--answer-cache", action="store_true", help="Leave the semantic answer cache on.")
+    parser.add_argument("--output", default="loadtest_results.json")
+    parser.add_argument("--verbose", action="store_true", help="Show the bot's own console output.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    levels = [int(level) for level in args.concurrency.split(",")]
+    workdir = tempfile.mkdtemp(prefix="crucible_load_")
+    llm = StubLLMServer(port=0, latency=args.latency, tokens_per_sec=args.tokens_per_sec,
+                        slots=args.slots, tool_steps=args.tool_steps).start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()) if not args.verbose else contextlib.nullcontext():
+            bot = prepare_bot(workdir, llm, args.tasks, args.answer_cache)
+        results = asyncio.run(run_levels(bot, levels, args.messages, args.dm_ratio, args.verbose))
+    finally:
+        llm.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "config": vars(args),
+        "llm_stub": dict(llm.stats),
+        "levels": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"[LoadTest] Results written to {args.output}.")
+
+
+if __name__ == "__main__":
+    main()
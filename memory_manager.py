@@ -3,29 +3,42 @@
 import sqlite3
 import time
 import os
+import json
+import hashlib
+import logging
 from multiprocessing import Queue
-from sqlite3 import Error
+from queue import Empty
+
+from typing import TYPE_CHECKING
 
-from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_core.documents import Document
 
+import db
+from telemetry import MetricsPusher, configure_logging, metrics, span
+from vector_index import VECTOR_BACKEND, active_collection, count_documents, open_vector_store
+
+# The vector store and embedding model are only needed inside the worker
+# process, so they are imported there rather than by everything importing this module.
+if TYPE_CHECKING:
+    from langchain_community.vectorstores import Chroma
+
 # --- CONFIGURATION (Should match other scripts) ---
 DB_FILE = "project_tasks.db"
 CHROMA_PERSIST_DIR = "./chroma_db"
 EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+SYNC_BATCH_SIZE = 512  # Documents per Chroma upsert during the initial sync.
+CHANGE_BATCH_SIZE = 512  # Change-log rows read and applied per batch.
+CHANGE_POLL_SECONDS = 1.0  # How often the change log is checked when no wake-up message arrives.
+CHANGE_LOG_RETENTION = 10_000  # Applied changes kept in the log (e.g. for a re-index to replay).
+SQLITE_MAX_PARAMS = 900  # Stay below SQLite's default bound-parameter limit.
 
-# --- HELPER FUNCTIONS ---
+logger = logging.getLogger(__name__)
 
-def create_connection(db_file):
-    """ Create a database connection to a SQLite database. """
-    conn = None
-    try:
-        conn = sqlite3.connect(db_file)
-        conn.row_factory = sqlite3.Row  # Access columns by name
-    except Error as e:
-        print(f"[MemoryManager] Error connecting to database: {e}")
-    return conn
+
+class CollectionSwitched(Exception):
+    """ The active vector collection changed (see reindex.py); the worker must reopen it. """
+
+# --- HELPER FUNCTIONS ---
 
 def format_task_as_document(task_row: sqlite3.Row) -> Document:
     """ Formats a single task row from SQLite into a LangChain Document. """
@@ -48,170 +61,370 @@ def format_task_as_document(task_row: sqlite3.Row) -> Document:
         "due_date": task_row['due_date'],
         "assignee": task_row['assignee_name']
     }
+    # Fingerprint what gets embedded and stored, so the startup sync can skip unchanged rows.
+    metadata["content_hash"] = compute_content_hash(page_content, metadata)
     # The document ID must be a string for ChromaDB.
     return Document(page_content=page_content, metadata=metadata)
 
 
+def compute_content_hash(page_content: str, metadata: dict) -> str:
+    """ Returns a stable hash of a document's text and metadata (excluding the hash itself). """
+    fields = {key: value for key, value in metadata.items() if key != "content_hash"}
+    payload = page_content + "\x00" + json.dumps(fields, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
 def get_task_document_by_id(conn: sqlite3.Connection, task_id: int) -> Document | None:
     """
     Queries the database for a single task by its ID and returns it as a
     LangChain Document.
     """
-    query = """
-    SELECT
-        t.id, t.title, t.description, t.status, t.priority, t.due_date,
-        p.name as project_name, u.name as assignee_name
-    FROM tasks t
-    LEFT JOIN projects p ON t.project_id = p.id
-    LEFT JOIN users u ON t.assignee_id = u.id
-    WHERE t.id = ?;
-    """
-    cursor = conn.cursor()
-    cursor.execute(query, (task_id,))
+    cursor = conn.execute(db.SQL_TASK_BY_ID, (task_id,))
     row = cursor.fetchone()
 
     if row:
         return format_task_as_document(row)
     return None
 
+def get_task_documents_by_ids(conn: sqlite3.Connection, task_ids: list[int]) -> dict[int, Document]:
+    """
+    Queries the database for many tasks at once and returns a mapping of
+    task ID to LangChain Document. IDs with no matching row are omitted.
+    """
+    documents = {}
+    with span("sql.tasks_by_ids") as s:
+        for start in range(0, len(task_ids), SQLITE_MAX_PARAMS):
+            chunk = task_ids[start:start + SQLITE_MAX_PARAMS]
+            cursor = conn.execute(db.sql_tasks_by_ids(len(chunk)), chunk)
+            for row in cursor.fetchall():
+                documents[row['id']] = format_task_as_document(row)
+        s.set(rows=len(documents))
+    return documents
+
 def get_all_task_documents(conn: sqlite3.Connection) -> list[Document]:
     """
     Queries the database for all tasks and returns them as a list of
     LangChain Documents.
     """
-    query = """
-    SELECT
-        t.id, t.title, t.description, t.status, t.priority, t.due_date,
-        p.name as project_name, u.name as assignee_name
-    FROM tasks t
-    LEFT JOIN projects p ON t.project_id = p.id
-    LEFT JOIN users u ON t.assignee_id = u.id;
-    """
-    cursor = conn.cursor()
-    cursor.execute(query)
-    rows = cursor.fetchall()
+    with span("sql.all_tasks") as s:
+        cursor = conn.execute(db.SQL_ALL_TASKS)
+        rows = cursor.fetchall()
+        s.set(rows=len(rows))
 
     documents = [format_task_as_document(row) for row in rows]
     return documents
 
 
+def sync_vector_store(conn: sqlite3.Connection, vector_store: "Chroma") -> dict:
+    """
+    Brings the vector store in line with SQLite without re-embedding unchanged tasks.
+
+    Each stored document carries a `content_hash` in its metadata. Only rows
+    whose hash is missing or different are re-embedded, and documents whose
+    task no longer exists are deleted. Returns the skipped/upserted/deleted counts.
+    """
+    # Get all documents currently in the SQLite DB. Formatting is cheap; embedding is not.
+    all_db_docs = get_all_task_documents(conn)
+    logger.info("Found %d tasks in SQLite.", len(all_db_docs))
+
+    # Get the IDs and stored hashes currently in the vector store (no embeddings or documents).
+    with span("chroma.get_all") as s:
+        existing = vector_store.get(include=["metadatas"])
+        s.set(documents=len(existing["ids"]))
+    existing_hashes = {
+        doc_id: (metadata or {}).get("content_hash")
+        for doc_id, metadata in zip(existing["ids"], existing["metadatas"])
+    }
+    logger.info("Found %d documents in ChromaDB.", len(existing_hashes))
+
+    changed_docs = [
+        doc for doc in all_db_docs
+        if existing_hashes.get(str(doc.metadata['task_id'])) != doc.metadata['content_hash']
+    ]
+    all_db_ids = {str(doc.metadata['task_id']) for doc in all_db_docs}
+
+    # A) Delete documents from Chroma that are no longer in SQLite
+    ids_to_delete = list(existing_hashes.keys() - all_db_ids)
+    if ids_to_delete:
+        logger.info("Deleting %d obsolete documents from ChromaDB.", len(ids_to_delete))
+        with span("chroma.delete", documents=len(ids_to_delete)):
+            vector_store.delete(ids=ids_to_delete)
+
+    # B) Re-embed only new or changed documents, in bounded batches.
+    for start in range(0, len(changed_docs), SYNC_BATCH_SIZE):
+        batch = changed_docs[start:start + SYNC_BATCH_SIZE]
+        with span("chroma.upsert", documents=len(batch)):
+            vector_store.add_documents(
+                documents=batch,
+                ids=[str(doc.metadata['task_id']) for doc in batch]
+            )
+
+    return {
+        "skipped": len(all_db_docs) - len(changed_docs),
+        "upserted": len(changed_docs),
+        "deleted": len(ids_to_delete),
+    }
+
+
+def wait_for_signal(queue: Queue, timeout: float) -> int:
+    """
+    Waits up to `timeout` seconds for a wake-up message, then empties the
+    queue. The messages only say "look at the change log now"; their content
+    is not needed. Without a queue this just sleeps. Returns the number of messages.
+    """
+    if queue is None:
+        time.sleep(timeout)
+        return 0
+    try:
+        queue.get(timeout=timeout)
+    except Empty:
+        return 0
+    received = 1
+    while True:
+        try:
+            queue.get_nowait()
+        except Empty:
+            return received
+        received += 1
+
+
+def read_changes(conn: sqlite3.Connection, after_seq: int,
+                 limit: int = CHANGE_BATCH_SIZE) -> tuple[dict[int, str], int, int, float | None]:
+    """
+    Reads up to `limit` change-log rows after `after_seq` and reduces them to
+    the last action per task. Returns (actions, last sequence read, rows read,
+    Unix time of the oldest change read).
+    """
+    actions = {}
+    last_seq = after_seq
+    rows = conn.execute(db.SQL_CHANGES_AFTER, (after_seq, limit)).fetchall()
+    oldest = rows[0]["changed_at"] if rows else None
+    for seq, task_id, action, _ in rows:
+        last_seq = seq
+        if action == "resync":
+            continue  # Only marks a full sync; the version still moves past it.
+        actions.pop(task_id, None)  # Re-insert so the dict keeps the latest ordering.
+        actions[task_id] = action
+    return actions, last_seq, len(rows), oldest
+
+
+def apply_update_batch(conn: sqlite3.Connection, vector_store: "Chroma", actions: dict[int, str]) -> dict:
+    """
+    Applies coalesced actions ("upsert" or "delete") with one SQLite query, one Chroma upsert and one
+    Chroma delete. Tasks that were added or updated but no longer exist in
+    SQLite are deleted from the vector store too. Returns the applied counts.
+    """
+    upsert_ids = [task_id for task_id, action in actions.items() if action != "delete"]
+    delete_ids = [task_id for task_id, action in actions.items() if action == "delete"]
+
+    documents = get_task_documents_by_ids(conn, upsert_ids) if upsert_ids else {}
+    missing_ids = [task_id for task_id in upsert_ids if task_id not in documents]
+    if missing_ids:
+        logger.info("Tasks %s no longer in DB; removing them from ChromaDB.", missing_ids)
+        delete_ids.extend(missing_ids)
+
+    if documents:
+        with span("chroma.upsert", documents=len(documents)):
+            vector_store.add_documents(
+                documents=list(documents.values()),
+                ids=[str(task_id) for task_id in documents]  # .add_documents also handles updates (upsert)
+            )
+    if delete_ids:
+        # Chroma requires a list of string IDs for deletion
+        with span("chroma.delete", documents=len(delete_ids)):
+            vector_store.delete(ids=[str(task_id) for task_id in delete_ids])
+
+    return {"upserted": len(documents), "deleted": len(delete_ids)}
+
+
+def publish_applied_seq(conn: sqlite3.Connection, data_version, seq: int):
+    """
+    Records `seq` as the last change the vector store reflects and publishes it
+    as the shared data version, so readers in the main process drop retrieval
+    results cached against an older state. Persisted, so the worker resumes
+    from here after a restart.
+    """
+    db.set_meta(conn, db.META_APPLIED_CHANGE_SEQ, seq)
+    if data_version is not None:
+        with data_version.get_lock():
+            data_version.value = max(data_version.value, seq)
+
+
+def apply_pending_changes(pool: db.ConnectionPool, vector_store: "Chroma", applied_seq: int,
+                          data_version=None, batch_size: int = CHANGE_BATCH_SIZE, collection: str | None = None) -> int:
+    """
+    Applies every change after `applied_seq` in batches of `batch_size` log
+    rows and returns the new applied sequence. Each batch is committed after
+    the vector store has been updated, so a crash replays it (upserts and
+    deletes are idempotent) instead of losing it.
+
+    With `collection`, a batch is only committed while that collection is
+    still the active one. Otherwise CollectionSwitched is raised: the re-index
+    that switched it already applied these changes to the new collection and
+    set the checkpoint for it.
+    """
+    while True:
+        with pool.connection() as conn:
+            with span("sql.read_changes") as s:
+                actions, last_seq, count, oldest = read_changes(conn, applied_seq, batch_size)
+                s.set(rows=count)
+            if not count:
+                return applied_seq
+            with span("worker.apply_batch", tasks=len(actions)):
+                counts = apply_update_batch(conn, vector_store, actions) if actions else {"upserted": 0, "deleted": 0}
+            with db.transaction(conn):
+                if collection is not None and active_collection(conn, EMBEDDING_MODEL)[0] != collection:
+                    raise CollectionSwitched(collection)
+                publish_applied_seq(conn, data_version, last_seq)
+                prune_to = last_seq - CHANGE_LOG_RETENTION
+                pinned = db.get_meta(conn, db.META_REINDEX_FROM_SEQ)
+                if pinned is not None:
+                    prune_to = min(prune_to, int(pinned))  # A re-index still has to replay these.
+                if prune_to > 0:
+                    conn.execute(db.SQL_PRUNE_CHANGES, (prune_to,))
+        metrics.inc("crucible_worker_changes_total", count, help="Change-log rows applied by the memory worker.")
+        if oldest is not None:
+            metrics.observe("crucible_index_lag_seconds", max(0.0, time.time() - oldest),
+                            help="Time from a change being written to the vector index reflecting it.")
+        logger.info("Applied changes %d-%d: %d upserted, %d deleted.",
+                    applied_seq + 1, last_seq, counts['upserted'], counts['deleted'])
+        applied_seq = last_seq
+        if count < batch_size:
+            return applied_seq
+
+
+def initial_sync(pool: db.ConnectionPool, vector_store: "Chroma", data_version=None) -> int:
+    """
+    Returns the change-log sequence to resume from. Normally that is the saved
+    checkpoint. The first time the change log is used, or when the vector
+    store is empty, the whole table is compared by content hash first and the
+    checkpoint starts at the log position read before that comparison.
+    """
+    with pool.connection() as conn:
+        db.ensure_change_log(conn)
+        checkpoint = db.get_meta(conn, db.META_APPLIED_CHANGE_SEQ)
+        if checkpoint is not None and count_documents(vector_store) > 0:
+            logger.info("Resuming from change %s.", checkpoint)
+            return int(checkpoint)
+
+        logger.info("No change-log checkpoint; comparing every task with ChromaDB...")
+        start_seq = conn.execute(db.SQL_MAX_CHANGE_SEQ).fetchone()[0]
+        with span("worker.initial_sync") as s:
+            counts = sync_vector_store(conn, vector_store)
+            s.set(**counts)
+        logger.info("Initial sync complete: %d unchanged, %d upserted, %d deleted.",
+                    counts['skipped'], counts['upserted'], counts['deleted'])
+        if counts["upserted"] or counts["deleted"]:
+            # Moves the data version on, so answers cached before the sync are not reused.
+            conn.execute(db.SQL_LOG_RESYNC)
+        publish_applied_seq(conn, data_version, start_seq)
+        return start_seq
+
+
+def open_active_collection(pool: db.ConnectionPool, default_model: str,
+                           embeddings_by_model: dict) -> tuple[str, "Chroma"]:
+    """
+    Opens the collection the meta pointer names as active. Its embedding model
+    is taken from `embeddings_by_model` if already loaded, otherwise loaded
+    here and added to it.
+    """
+    with pool.connection() as conn:
+        collection, model = active_collection(conn, default_model)
+    embeddings = embeddings_by_model.get(model)
+    if embeddings is None:
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+        embeddings = embeddings_by_model[model] = HuggingFaceEmbeddings(model_name=model)
+    return collection, open_vector_store(CHROMA_PERSIST_DIR, embeddings, collection_name=collection)
+
+
 # --- CORE WORKER FUNCTION ---
 
-def memory_worker(queue: Queue):
+def memory_worker(queue: Queue = None, data_version=None, ready_event=None, metrics_queue=None,
+                  embedding_address: str | None = None, embedding_authkey: bytes = b"",
+                  embedding_model: str = EMBEDDING_MODEL):
     """
     The main function for the memory manager process.
-    It listens on a queue for update signals from the main application
-    and keeps the ChromaDB vector store synchronized with the SQLite DB.
+    It keeps the ChromaDB vector store synchronized with the SQLite DB by
+    tailing the task_changes log, which triggers fill on every write. Messages
+    on `queue` only wake it up early; without them it polls every
+    CHANGE_POLL_SECONDS. The last applied sequence is published as
+    `data_version` (a shared multiprocessing.Value), and `ready_event` (a
+    multiprocessing.Event) is set once the worker has caught up at start-up.
+    The worker's spans and counters are sent to the main process over
+    `metrics_queue`, which serves them with its own. With `embedding_address`,
+    documents are embedded by the shared embedding server (running
+    `embedding_model`) instead of a model loaded in this process. When a
+    re-index switches the active collection, the worker reopens it and
+    continues from the checkpoint the re-index left.
     """
-    print("[MemoryManager] Worker process started.", flush=True)
+    configure_logging()
+    pusher = MetricsPusher(metrics_queue, "memory_worker")
+    logger.info("Worker process started.")
 
     # 1. Initialize Embeddings and Vector Store
     if not os.path.exists(CHROMA_PERSIST_DIR):
-        print(f"[MemoryManager] FATAL: ChromaDB directory not found at '{CHROMA_PERSIST_DIR}'.", flush=True)
-        print("[MemoryManager] Please run embed_db.py first.", flush=True)
+        logger.critical("ChromaDB directory not found at '%s'. Please run embed_db.py first.", CHROMA_PERSIST_DIR)
         return
 
+    pool = db.get_pool(DB_FILE)
+    embeddings_by_model = {}
     try:
-        embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
-        vector_store = Chroma(
-            persist_directory=CHROMA_PERSIST_DIR,
-            embedding_function=embeddings
-        )
-        print("[MemoryManager] Successfully connected to ChromaDB.", flush=True)
+        if embedding_address:
+            from embedding_server import remote_embeddings
+            embeddings_by_model[embedding_model] = remote_embeddings(embedding_address, embedding_authkey)
+        collection, vector_store = open_active_collection(pool, embedding_model, embeddings_by_model)
+        logger.info("Opened the %s vector store, collection '%s'.", VECTOR_BACKEND, collection)
     except Exception as e:
-        print(f"[MemoryManager] FATAL: Could not initialize ChromaDB. Error: {e}", flush=True)
+        logger.critical("Could not open the %s vector store. Error: %s", VECTOR_BACKEND, e)
         return
 
-
-    # 2. Initial Synchronization on Startup
-    # This ensures consistency if the bot was offline while the DB was changed.
-    print("[MemoryManager] Performing initial sync with database...", flush=True)
-    conn = create_connection(DB_FILE)
-    if conn:
+    def reopen():
+        nonlocal collection, vector_store
         try:
-            # Get all documents currently in the SQLite DB
-            all_db_docs = get_all_task_documents(conn)
-            all_db_ids = {str(doc.metadata['task_id']) for doc in all_db_docs}
-            print(f"[MemoryManager] Found {len(all_db_ids)} tasks in SQLite.", flush=True)
-
-            # Get all document IDs currently in the vector store
-            existing_vector_ids_dict = vector_store.get(include=[]) # Fast way to get IDs
-            existing_vector_ids = set(existing_vector_ids_dict['ids'])
-            print(f"[MemoryManager] Found {len(existing_vector_ids)} documents in ChromaDB.", flush=True)
-
-            # A) Delete documents from Chroma that are no longer in SQLite
-            ids_to_delete = list(existing_vector_ids - all_db_ids)
-            if ids_to_delete:
-                print(f"[MemoryManager] Deleting {len(ids_to_delete)} obsolete documents from ChromaDB.", flush=True)
-                vector_store.delete(ids=ids_to_delete)
-            
-            # B) Add/Update all current documents from SQLite to Chroma
-            # .add_documents will update existing documents if the IDs are the same.
-            if all_db_docs:
-                print(f"[MemoryManager] Upserting {len(all_db_docs)} documents into ChromaDB to ensure consistency.", flush=True)
-                vector_store.add_documents(
-                    documents=all_db_docs,
-                    ids=[str(doc.metadata['task_id']) for doc in all_db_docs]
-                )
-
-            print("[MemoryManager] Initial sync complete.", flush=True)
+            collection, vector_store = open_active_collection(pool, embedding_model, embeddings_by_model)
+            with pool.connection() as conn:
+                seq = int(db.get_meta(conn, db.META_APPLIED_CHANGE_SEQ, 0))
         except Exception as e:
-            print(f"[MemoryManager] Error during initial sync: {e}", flush=True)
-        finally:
-            conn.close()
+            # Keep the old collection; its next batch raises CollectionSwitched again and this is retried.
+            logger.exception("Could not open the new collection: %s", e)
+            time.sleep(5)
+            return applied_seq
+        logger.info("Re-index switched the active collection; now updating '%s' from change %d.", collection, seq)
+        return seq
 
-    # 3. Main Event Loop: Listen for messages from the main process
-    print("[MemoryManager] Now listening for real-time updates...", flush=True)
+    # 2. Catch up on startup: everything written while the bot was offline is
+    #    still in the change log, so only those tasks are re-embedded.
+    applied_seq = 0
+    try:
+        applied_seq = initial_sync(pool, vector_store, data_version)
+        with span("worker.catch_up"):
+            applied_seq = apply_pending_changes(pool, vector_store, applied_seq, data_version, collection=collection)
+    except CollectionSwitched:
+        applied_seq = reopen()
+    except Exception as e:
+        logger.exception("Error during initial sync: %s", e)
+    if ready_event is not None:
+        ready_event.set()
+    pusher.maybe_push(force=True)
+
+    # 3. Main Event Loop: tail the change log. A burst of N writes is read as
+    #    one batch and costs one query and one embedding batch.
+    logger.info("Now tailing the change log from %d...", applied_seq)
     while True:
         try:
-            # This call blocks until a message is available on the queue
-            message = queue.get()
-            print(f"[MemoryManager] Received message: {message}", flush=True)
-
-            action = message.get("action")
-            task_id = message.get("task_id")
-
-            if not action or not task_id:
-                print(f"[MemoryManager] WARNING: Received malformed message: {message}", flush=True)
-                continue
-            
-            # We need a fresh connection for each transaction
-            conn = create_connection(DB_FILE)
-            if not conn:
-                print("[MemoryManager] ERROR: Could not connect to DB to process update.", flush=True)
-                continue
-
-            if action in ["add", "update"]:
-                print(f"[MemoryManager] Processing '{action}' for task_id: {task_id}", flush=True)
-                doc_to_update = get_task_document_by_id(conn, task_id)
-                if doc_to_update:
-                    vector_store.add_documents(
-                        documents=[doc_to_update],
-                        ids=[str(task_id)] # Use .add_documents as it also handles updates (upsert)
-                    )
-                    print(f"[MemoryManager] Successfully upserted document for task {task_id}.", flush=True)
-                else:
-                    print(f"[MemoryManager] WARNING: Task {task_id} not found in DB for {action}.", flush=True)
-
-            elif action == "delete":
-                print(f"[MemoryManager] Processing 'delete' for task_id: {task_id}", flush=True)
-                # Chroma requires a list of string IDs for deletion
-                vector_store.delete(ids=[str(task_id)])
-                print(f"[MemoryManager] Successfully deleted document for task {task_id}.", flush=True)
-            
-            conn.close()
-
-        except queue.Empty:
-            # This part of the try-except is not strictly needed with queue.get()
-            # but is good practice if you switch to non-blocking gets.
-            time.sleep(1)
-            continue
+            wait_for_signal(queue, CHANGE_POLL_SECONDS)
+            applied_seq = apply_pending_changes(pool, vector_store, applied_seq, data_version, collection=collection)
+            pusher.maybe_push()
+
+        except CollectionSwitched:
+            applied_seq = reopen()
         except KeyboardInterrupt:
-            print("\n[MemoryManager] Worker process shutting down.", flush=True)
+            logger.info("Worker process shutting down.")
             break
         except Exception as e:
-            # Catch-all for any other errors to keep the worker alive
-            print(f"[MemoryManager] An unexpected error occurred in the event loop: {e}", flush=True)
+            # Catch-all for any other errors to keep the worker alive; the
+            # checkpoint was not advanced, so the failed batch is retried.
+            logger.exception("An unexpected error occurred in the event loop: %s", e)
             # Avoid rapid-fire error loops
             time.sleep(5)
-# --- END OF MEMORY MANAGER ---
\ No newline at end of file
+# --- END OF MEMORY MANAGER ---
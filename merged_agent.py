@@ -1,24 +1,28 @@
 # merged_agent.py (Modified for Graceful Error Handling)
-import os
+import asyncio
+import contextlib
 import sys
+import json
+import logging
 import sqlite3
+import time
+import urllib.request
 from multiprocessing import Queue
 
-# Langchain imports
-from langchain import hub
-from langchain.agents import AgentExecutor, create_react_agent
-from langchain.tools import Tool
-from langchain.memory import ConversationBufferWindowMemory
-from langchain.tools.render import render_text_description
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.messages import AIMessage, HumanMessage
 from pydantic import BaseModel, Field
 
-# Existing imports
-from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_openai import ChatOpenAI
-from sqlite3 import Error
+import db
+import freshness
+from knowledge_base import KnowledgeBase
+from answer_cache import SemanticAnswerCache
+from conversation import ConversationMemory, set_summarizer
+from prompt_budget import fit_task_records, prompt_token_callback
+from prompts import HISTORY_SUMMARY_TEMPLATE, load_react_chat_prompt
+from streaming import final_answer_callback
+from telemetry import configure_logging, llm_span_callback, span, traced
+
+# LangChain's agent and OpenAI-client modules are heavy; they are imported
+# inside initialize_agent() so importing this module stays cheap.
 
 # --- CONFIGURATION ---
 DB_FILE = "project_tasks.db"
@@ -28,34 +32,50 @@ LOCAL_LLM_URL = "http://localhost:1234/v1"
 DUMMY_API_KEY = "lm-studio"
 MODEL_NAME = "local-model"
 MODEL_TEMP = 0.4
+STREAM_TOKENS = True  # Stream completions so the bot can show the final answer while it is generated.
+RETRIEVER_K = 4
+ANSWER_CACHE_ENABLED = True  # Reuse answers for paraphrased questions while the task data is unchanged.
+LLM_READY_POLL_SECONDS = 5  # How often to re-check an LLM server that is not up yet.
+
+logger = logging.getLogger(__name__)
 
 # --- AGENT STATE ---
 agent_executor = None
+knowledge_base: KnowledgeBase = None
+answer_cache: SemanticAnswerCache = None
 memory_queue: Queue = None
+data_version = None  # multiprocessing.Value bumped by the memory manager on every vector-store change.
+shared_embeddings = None  # Embeddings backed by the embedding server process; None loads the model here.
+shared_embeddings_model = EMBEDDING_MODEL  # The model the embedding server runs.
+llm_gate = contextlib.nullcontext  # Context manager held around LLM calls made outside an agent turn.
 
 def set_memory_queue(queue: Queue):
     global memory_queue
     memory_queue = queue
 
-# --- DATABASE HELPER FUNCTIONS (Unchanged) ---
-def create_connection(db_file):
-    conn = None
-    try:
-        conn = sqlite3.connect(db_file, check_same_thread=False)
-        conn.row_factory = sqlite3.Row
-    except Error as e:
-        print(f"Error connecting to database: {e}")
-    return conn
+def set_data_version(version):
+    global data_version
+    data_version = version
+
+def set_llm_gate(gate):
+    """ Makes background LLM calls (history summaries) wait for the same slots as agent turns. """
+    global llm_gate
+    llm_gate = gate
 
+def set_embeddings(embeddings, model_name: str = EMBEDDING_MODEL):
+    global shared_embeddings, shared_embeddings_model
+    shared_embeddings = embeddings
+    shared_embeddings_model = model_name
+
+# --- DATABASE HELPER FUNCTIONS ---
+# Connections come from the shared, WAL-mode pool in db.py.
 def get_project_id_by_name(conn, project_name):
-    cursor = conn.cursor()
-    cursor.execute("SELECT id FROM projects WHERE name = ?", (project_name,))
+    cursor = conn.execute(db.SQL_PROJECT_ID_BY_NAME, (project_name,))
     result = cursor.fetchone()
     return result[0] if result else None
 
 def get_user_id_by_name(conn, user_name):
-    cursor = conn.cursor()
-    cursor.execute("SELECT id FROM users WHERE name LIKE ?", (f"%{user_name}%",))
+    cursor = conn.execute(db.SQL_USER_ID_BY_NAME, (f"%{user_name}%",))
     result = cursor.fetchone()
     return result[0] if result else None
 
@@ -68,95 +88,213 @@ class AddTaskSchema(BaseModel):
     priority: str = Field(description="The priority of the task, e.g., 'Low', 'Medium', 'High'.", default="Medium")
     status: str = Field(description="The current status of the task, e.g., 'To Do', 'In Progress'.", default="To Do")
 
+class SearchTasksSchema(BaseModel):
+    query: str = Field(description="Optional free-text description of what to look for. Leave empty to just list matching tasks.", default="")
+    status: str | None = Field(description="Only tasks with this status: 'To Do', 'In Progress' or 'Done'.", default=None)
+    priority: str | None = Field(description="Only tasks with this priority: 'Low', 'Medium' or 'High'.", default=None)
+    project_name: str | None = Field(description="Only tasks in this project (partial names match).", default=None)
+    assignee_name: str | None = Field(description="Only tasks assigned to this user (partial names match).", default=None)
+    due_after: str | None = Field(description="Only tasks due on or after this date (YYYY-MM-DD).", default=None)
+    due_before: str | None = Field(description="Only tasks due on or before this date (YYYY-MM-DD).", default=None)
+    open_only: bool = Field(description="Only tasks that are not Done.", default=False)
+    limit: int = Field(description="Maximum number of tasks to return.", default=10)
+
 # --- AGENT TOOLS (Unchanged) ---
 def knowledge_base_retriever(query: str) -> str:
     """
     Use this tool ONLY to answer questions about existing tasks, projects, or users by searching the knowledge base.
     The input must be a clear, specific question.
     """
-    print(f"\n>> Searching Knowledge Base for: '{query}'")
-    if not os.path.exists(CHROMA_PERSIST_DIR):
-        return f"Error: Knowledge base (ChromaDB) not found at '{CHROMA_PERSIST_DIR}'. Please run embed_db.py."
-    embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
-    vector_store = Chroma(persist_directory=CHROMA_PERSIST_DIR, embedding_function=embeddings)
-    retriever = vector_store.as_retriever(search_kwargs={"k": 4})
-    docs = retriever.get_relevant_documents(query)
-    return "\n\n".join(doc.page_content for doc in docs) if docs else "No relevant information found in the knowledge base for that query."
+    logger.info("Searching Knowledge Base for: '%s'", query)
+    if not knowledge_base:
+        return "Error: Knowledge base is not initialized. Please run initialize_agent() first."
+    try:
+        docs = knowledge_base.search(query)
+    except FileNotFoundError as e:
+        return f"Error: {e}"
+    # One dense line per task, within the tool-result token budget.
+    return fit_task_records(docs) if docs else "No relevant information found in the knowledge base for that query."
+
+def search_tasks(query: str = "", status: str = None, priority: str = None, project_name: str = None,
+                 assignee_name: str = None, due_after: str = None, due_before: str = None, open_only: bool = False,
+                 limit: int = 10) -> str:
+    """
+    Use this tool to find tasks by status, priority, project, assignee and/or due date, optionally ranked by a free-text query.
+    Prefer it over KnowledgeBaseRetriever whenever the question names any of these fields, e.g. "open high-priority tasks for Alice".
+    The input is a JSON object with any of the keys: query, status, priority, project_name, assignee_name, due_after, due_before (YYYY-MM-DD),
+    open_only (true to leave out Done tasks), limit.
+    """
+    # A text-based ReAct agent passes its whole action input as one string; accept a JSON object there.
+    if query and query.strip().startswith("{"):
+        try:
+            arguments = SearchTasksSchema.model_validate(json.loads(query))
+        except ValueError as e:
+            return f"Error: Invalid search arguments: {e}"
+        return search_tasks(**arguments.model_dump())
+
+    logger.info("Searching tasks: query='%s', status=%s, priority=%s, project=%s, assignee=%s, due_after=%s, "
+                "due_before=%s, open_only=%s, limit=%s", query, status, priority, project_name, assignee_name, due_after,
+                due_before, open_only, limit)
+    if status and status not in db.TASK_STATUSES:
+        return f"Error: Unknown status '{status}'. Use one of: {', '.join(db.TASK_STATUSES)}."
+    if priority and priority not in db.TASK_PRIORITIES:
+        return f"Error: Unknown priority '{priority}'. Use one of: {', '.join(db.TASK_PRIORITIES)}."
+    if not knowledge_base:
+        return "Error: Knowledge base is not initialized. Please run initialize_agent() first."
+    try:
+        docs = knowledge_base.filtered_search(
+            query, max(1, int(limit)), status=status, priority=priority, project_name=project_name,
+            assignee_name=assignee_name, due_after=due_after, due_before=due_before, open_only=bool(open_only),
+        )
+    except (FileNotFoundError, sqlite3.Error) as e:
+        return f"Error: {e}"
+    if not docs:
+        return "No tasks match those filters."
+    return f"Found {len(docs)} matching task(s):\n" + fit_task_records(docs)
 
 def list_users(dummy: str) -> str:
     """
     Use this tool when the user explicitly asks for a list of all available users in the system.
     This tool takes no input. It returns a formatted string of all user names, IDs, and emails.
     """
-    print("\n>> Listing all users...")
-    conn = create_connection(DB_FILE)
-    if not conn: return "Error: Could not connect to the database."
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, name, email FROM users")
-    users = cursor.fetchall()
-    conn.close()
+    logger.info("Listing all users...")
+    try:
+        with span("sql.list_users") as s, db.get_pool(DB_FILE).connection() as conn:
+            users = conn.execute(db.SQL_LIST_USERS).fetchall()
+            s.set(rows=len(users))
+    except sqlite3.Error as e:
+        return f"Error: Could not read users from the database: {e}"
     if not users: return "No users found in the database."
     return "\n".join([f"- ID: {user['id']}, Name: {user['name']}, Email: {user['email']}" for user in users])
 
+def known_names() -> list[str]:
+    """ All project and user names; the answer cache only reuses answers about the same ones. """
+    with db.get_pool(DB_FILE).connection() as conn:
+        return [row[0] for row in conn.execute(db.SQL_KNOWN_NAMES)]
+
 def add_task(title: str, project_name: str, assignee_name: str, description: str = "", priority: str = "Medium", status: str = "To Do") -> str:
     """
     Use this tool to add a new task to the database.
     You MUST provide a title, a project_name, and an assignee_name.
     """
-    print(f"\n>> Adding new task: '{title}'")
-    conn = create_connection(DB_FILE)
-    if not conn: return "Error: Could not connect to the database."
-    project_id = get_project_id_by_name(conn, project_name)
-    if not project_id: return f"Error: Project '{project_name}' not found."
-    assignee_id = get_user_id_by_name(conn, assignee_name)
-    if not assignee_id: return f"Error: User '{assignee_name}' not found."
+    logger.info("Adding new task: '%s'", title)
     try:
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO tasks (title, description, status, priority, project_id, assignee_id) VALUES (?, ?, ?, ?, ?, ?)",
-            (title, description, status, priority, project_id, assignee_id),
-        )
-        conn.commit()
-        task_id = cursor.lastrowid
-        conn.close()
-        if memory_queue:
-            print(f"   -> Sending 'add' signal for task_id: {task_id} to memory manager.")
-            memory_queue.put({"action": "add", "task_id": task_id})
-        else:
-            print("   -> WARNING: Memory queue not available. Change will not be reflected in real-time.")
-        return f"Successfully added new task '{title}' with ID {task_id} to project '{project_name}', assigned to {assignee_name}."
+        # The lookups and the insert share one transaction; the connection is
+        # returned to the pool on every path, including the early returns.
+        with span("sql.add_task"), db.get_pool(DB_FILE).transaction() as conn:
+            project_id = get_project_id_by_name(conn, project_name)
+            if not project_id: return f"Error: Project '{project_name}' not found."
+            assignee_id = get_user_id_by_name(conn, assignee_name)
+            if not assignee_id: return f"Error: User '{assignee_name}' not found."
+            cursor = conn.execute(
+                db.SQL_INSERT_TASK,
+                (title, description, status, priority, project_id, assignee_id),
+            )
+            task_id = cursor.lastrowid
+            # The change the insert trigger just logged; the write lock makes it ours.
+            version = conn.execute(db.SQL_MAX_CHANGE_SEQ).fetchone()[0]
     except sqlite3.Error as e:
         return f"Error adding task: {e}"
 
+    # Lets this conversation's next retrieval find the task before it is indexed.
+    freshness.record_write(task_id, version)
+
+    # The insert trigger already logged the change; this only wakes the memory
+    # manager so it does not wait for its next poll.
+    if memory_queue:
+        memory_queue.put({"action": "add", "task_id": task_id})
+    return f"Successfully added new task '{title}' with ID {task_id} to project '{project_name}', assigned to {assignee_name}."
+
 # --- AGENT INITIALIZATION (MODIFIED) ---
-def initialize_agent():
+def initialize_knowledge_base():
+    """
+    Loads the embedding model and vector store once and warms them up; every
+    tool call then shares them.
+    """
+    global knowledge_base, answer_cache
+    knowledge_base = KnowledgeBase(persist_directory=CHROMA_PERSIST_DIR, embedding_model=shared_embeddings_model, k=RETRIEVER_K,
+                                   data_version=data_version, db_file=DB_FILE, embeddings=shared_embeddings)
+    try:
+        knowledge_base.warm_up()
+        stats = knowledge_base.stats()
+        logger.info("Knowledge base loaded in %.2fs and warmed up in %.2fs.", stats['load_seconds'], stats['warm_up_seconds'])
+    except FileNotFoundError as e:
+        logger.warning("%s", e)
+        return
+    if ANSWER_CACHE_ENABLED:
+        # Shares the knowledge base's already-loaded embedding model.
+        answer_cache = SemanticAnswerCache(knowledge_base.embed_query, knowledge_base.current_version,
+                                           names_fn=known_names, model_fn=lambda: knowledge_base.active_model)
+
+def knowledge_base_stats() -> dict:
+    """ The knowledge base's statistics; empty until it has been initialized. """
+    return knowledge_base.stats() if knowledge_base else {}
+
+def answer_cache_stats() -> dict:
+    """ The answer cache's statistics; empty until it has been initialized (or if it is disabled). """
+    return answer_cache.stats() if answer_cache else {}
+
+def wait_for_llm_server(timeout: float | None = None) -> bool:
+    """
+    Polls the local LLM server's model list until it answers, so the bot does
+    not report ready while LM Studio is still loading. Returns False on timeout.
+    """
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    while True:
+        try:
+            request = urllib.request.Request(f"{LOCAL_LLM_URL}/models", headers={"Authorization": f"Bearer {DUMMY_API_KEY}"})
+            with urllib.request.urlopen(request, timeout=LLM_READY_POLL_SECONDS):
+                return True
+        except OSError as e:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            logger.info("Waiting for the local LLM server at %s (%s)...", LOCAL_LLM_URL, e)
+            time.sleep(LLM_READY_POLL_SECONDS)
+
+def initialize_agent(load_knowledge_base: bool = True):
     """
     Sets up the agent components (LLM, tools, prompt) with enhanced error handling.
+    Pass load_knowledge_base=False when initialize_knowledge_base() runs separately
+    (e.g. concurrently during bot start-up).
     """
     global agent_executor
-    print("--- Initializing The Crucible AI Agent (with Conversational ReAct Prompt) ---")
+    from langchain.agents import AgentExecutor, create_react_agent
+    from langchain.tools import Tool
+    from langchain.tools.render import render_text_description
+    from langchain_openai import ChatOpenAI
 
-    # ... (file existence checks are unchanged) ...
+    logger.info("Initializing The Crucible AI Agent (with Conversational ReAct Prompt)...")
+    if load_knowledge_base:
+        initialize_knowledge_base()
 
     try:
-        llm = ChatOpenAI(base_url=LOCAL_LLM_URL, api_key=DUMMY_API_KEY, model=MODEL_NAME, temperature=MODEL_TEMP)
-        print("Successfully connected to local LLM server.")
+        llm = ChatOpenAI(base_url=LOCAL_LLM_URL, api_key=DUMMY_API_KEY, model=MODEL_NAME, temperature=MODEL_TEMP,
+                         streaming=STREAM_TOKENS)
+        logger.info("Successfully connected to local LLM server.")
     except Exception as e:
-        print(f"FATAL ERROR: Could not connect to LLM server: {e}")
+        logger.critical("Could not connect to LLM server: %s", e)
         sys.exit(1)
 
+    # Each tool call is traced as its own span within the turn.
     tools = [
-        Tool(name="KnowledgeBaseRetriever", func=knowledge_base_retriever, description=knowledge_base_retriever.__doc__),
-        Tool(name="ListUsers", func=list_users, description=list_users.__doc__),
-        Tool(name="AddTask", func=add_task, description=add_task.__doc__, args_schema=AddTaskSchema),
+        Tool(name="KnowledgeBaseRetriever", func=traced("tool.KnowledgeBaseRetriever")(knowledge_base_retriever),
+             description=knowledge_base_retriever.__doc__),
+        Tool(name="SearchTasks", func=traced("tool.SearchTasks")(search_tasks), description=search_tasks.__doc__,
+             args_schema=SearchTasksSchema),
+        Tool(name="ListUsers", func=traced("tool.ListUsers")(list_users), description=list_users.__doc__),
+        Tool(name="AddTask", func=traced("tool.AddTask")(add_task), description=add_task.__doc__,
+             args_schema=AddTaskSchema),
     ]
 
-    prompt = hub.pull("hwchase17/react-chat")
+    # Bundled locally (prompts.py) instead of hub.pull(), so boot works offline.
+    prompt = load_react_chat_prompt()
     rendered_tools = render_text_description(tools)
     tool_names = ", ".join([t.name for t in tools])
 
     prompt = prompt.partial(tools=rendered_tools, tool_names=tool_names)
     agent = create_react_agent(llm, tools, prompt)
+    # Older conversation turns are condensed by the same model, in the background.
+    set_summarizer(lambda summary, turns: summarize_history(llm, summary, turns))
 
     # --- MODIFIED: Added 'handle_tool_error' to the AgentExecutor ---
     agent_executor = AgentExecutor(
@@ -164,47 +302,143 @@ def initialize_agent():
         tools=tools,
         verbose=True,
         handle_parsing_errors="I made a formatting error. I will try again.",
+        # Lets the answer cache see which tools a turn used (write turns are never cached).
+        return_intermediate_steps=True,
         # This new parameter tells the agent to catch tool errors and pass them back to the LLM.
         handle_tool_error=True
     )
 
-    print("Agent initialized successfully with enhanced error handling.")
+    logger.info("Agent initialized successfully with enhanced error handling.")
+
+def summarize_history(llm, previous_summary: str, turns: list[tuple[str, str]]) -> str:
+    """ Folds older exchanges into the running conversation summary. """
+    exchanges = "\n".join(f"Human: {user_text}\nAI: {ai_text}" for user_text, ai_text in turns)
+    prompt = HISTORY_SUMMARY_TEMPLATE.format(summary=previous_summary or "(none)", exchanges=exchanges)
+    with llm_gate():
+        return llm.invoke(prompt).content.strip()
 
 
 # --- AGENT INVOCATION (MODIFIED) ---
-def invoke_agent(query: str, memory: ConversationBufferWindowMemory) -> str:
+def cached_answer(query: str, conversation_id=None) -> str | None:
+    """
+    Returns a cached answer to an equivalent question, if the answer cache has
+    one. Cheap enough to call before queueing for the LLM. A cached answer
+    predates the conversation's own writes if the index has not caught up, so
+    none is returned then.
+    """
+    if not answer_cache:
+        return None
+    conversation = freshness.bind_conversation(conversation_id)
+    try:
+        if has_unindexed_writes():
+            return None
+        with span("answer_cache.lookup"):
+            return answer_cache.lookup(query)
+    except Exception as e:
+        # The cache is an optimisation; never let it break a turn.
+        logger.warning("Answer cache lookup failed: %s", e)
+        return None
+    finally:
+        freshness.unbind_conversation(conversation)
+
+def remember_answer(query: str, result: dict, data_version: int):
+    """
+    Caches a completed turn's answer under the data version read before the
+    turn started, unless the turn used a write tool.
+    """
+    if not answer_cache or "output" not in result or result["output"].startswith("Agent stopped"):
+        return
+    tools_used = [action.tool for action, _ in result.get("intermediate_steps", [])]
+    try:
+        answer_cache.store(query, result["output"], data_version, tools_used)
+    except Exception as e:
+        logger.warning("Could not cache answer: %s", e)
+
+def has_unindexed_writes() -> bool:
+    """ True if the current conversation wrote tasks the knowledge base does not reflect yet. """
+    return bool(knowledge_base and freshness.pending_writes(knowledge_base.current_version()))
+
+def invoke_agent(query: str, memory: ConversationMemory, conversation_id=None) -> str:
     """
     Invokes the agent and handles any unrecoverable errors gracefully.
+    `conversation_id` scopes read-your-writes: tasks added in one turn are
+    visible to retrieval in the same conversation's later turns.
     """
     global agent_executor
     if not agent_executor:
         return "Error: Agent is not initialized. Please run initialize_agent() first."
 
+    cached = cached_answer(query, conversation_id)
+    if cached is not None:
+        return cached
+    conversation = freshness.bind_conversation(conversation_id)
     try:
+        version = knowledge_base.current_version() if knowledge_base else 0
         chat_history = memory.load_memory_variables({}).get("chat_history", [])
-        print(f"--- Invoking Agent with Query: '{query}' ---")
-        result = agent_executor.invoke({
-            "input": query,
-            "chat_history": chat_history
-        })
+        logger.info("Invoking Agent with Query: '%s'", query)
+        token_counter = prompt_token_callback()
+        with span("agent.run"):
+            result = agent_executor.invoke({
+                "input": query,
+                "chat_history": chat_history
+            }, config={"callbacks": [token_counter, llm_span_callback()]})
+        token_counter.report()
+        remember_answer(query, result, version)
         return result.get('output', "Error: No output from agent.")
     # --- MODIFIED: This block now returns a detailed error message to the user ---
     except Exception as e:
-        error_message = f"An error occurred during agent invocation: {e}"
-        print(error_message)
+        logger.exception("An error occurred during agent invocation: %s", e)
         # Return a more informative message to the user in a formatted block
         return f"Sorry, I encountered an unrecoverable error. Please see the details below:\n```\n{e}\n```"
+    finally:
+        freshness.unbind_conversation(conversation)
+
+async def ainvoke_agent(query: str, memory: ConversationMemory, on_token=None, conversation_id=None) -> str:
+    """
+    Async counterpart of invoke_agent(). The LLM calls run on ChatOpenAI's async
+    client on the event loop instead of tying up a worker thread per turn;
+    the (synchronous) tools are run in the executor by LangChain.
+    If given, `on_token(text)` is called with each new piece of the final answer.
+    Callers check cached_answer() first, before waiting for an LLM slot.
+    """
+    if not agent_executor:
+        return "Error: Agent is not initialized. Please run initialize_agent() first."
+
+    # Set in this task's context; asyncio.to_thread and LangChain's executor calls copy it to the tools.
+    conversation = freshness.bind_conversation(conversation_id)
+    try:
+        version = knowledge_base.current_version() if knowledge_base else 0
+        chat_history = memory.load_memory_variables({}).get("chat_history", [])
+        logger.info("Invoking Agent (async) with Query: '%s'", query)
+        token_counter = prompt_token_callback()
+        callbacks = [token_counter, llm_span_callback()]
+        if on_token:
+            callbacks.append(final_answer_callback(on_token))
+        with span("agent.run"):
+            result = await agent_executor.ainvoke({
+                "input": query,
+                "chat_history": chat_history
+            }, config={"callbacks": callbacks})
+        token_counter.report()
+        await asyncio.to_thread(remember_answer, query, result, version)
+        return result.get('output', "Error: No output from agent.")
+    except Exception as e:
+        logger.exception("An error occurred during agent invocation: %s", e)
+        return f"Sorry, I encountered an unrecoverable error. Please see the details below:\n```\n{e}\n```"
+    finally:
+        freshness.unbind_conversation(conversation)
 
 # --- MAIN CHAT LOOP (Unchanged) ---
 def main():
+    configure_logging()
     initialize_agent()
-    cli_memory = ConversationBufferWindowMemory(k=5, memory_key="chat_history", return_messages=True)
+    cli_memory = ConversationMemory()
     print("\n--- Agent CLI Ready (type 'exit' or 'quit' to stop) ---")
     while True:
         try:
             query = input("\nYou: ")
             if query.lower() in ["exit", "quit"]: break
-            response = invoke_agent(query, cli_memory)
+            response = invoke_agent(query, cli_memory, conversation_id="cli")
             cli_memory.save_context({"input": query}, {"output": response})
             print(f"\nAgent: {response}")
         except (KeyboardInterrupt, EOFError):
@@ -0,0 +1,143 @@
+# prompt_budget.py
+import logging
+import threading
+from collections import deque
+
+# --- CONFIGURATION ---
+# The local model's own tokenizer is not available through LM Studio's API;
+# cl100k_base is a close enough stand-in for budgeting Llama-style models.
+TOKENIZER_ENCODING = "cl100k_base"
+CHARS_PER_TOKEN = 4  # Estimate used when tiktoken (or its encoding file) is unavailable.
+TOOL_RESULT_TOKEN_BUDGET = 600  # Per tool observation fed back to the model.
+HISTORY_TOKEN_BUDGET = 800  # Summary plus recent turns.
+SUMMARY_TOKEN_BUDGET = 250
+DESCRIPTION_CHARS = 120  # Task descriptions are cut to this many characters in compact records.
+PROMPT_SAMPLES = 1000  # Recent per-turn prompt sizes kept for statistics.
+
+logger = logging.getLogger(__name__)
+_encoding = None
+_encoding_lock = threading.Lock()
+_prompt_tokens = deque(maxlen=PROMPT_SAMPLES)
+
+
+def _get_encoding():
+    """ Loads the tiktoken encoding once; returns False if it cannot be loaded (e.g. offline). """
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+                except Exception as e:
+                    logger.warning("tiktoken unavailable (%s); estimating %d characters per token.", e, CHARS_PER_TOKEN)
+                    _encoding = False
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def truncate_to_tokens(text: str, budget: int, keep: str = "head") -> str:
+    """ Cuts text to at most `budget` tokens, keeping the start ("head") or the end ("tail"). """
+    if count_tokens(text) <= budget:
+        return text
+    encoding = _get_encoding()
+    if encoding:
+        tokens = encoding.encode(text, disallowed_special=())
+        tokens = tokens[:budget] if keep == "head" else tokens[-budget:]
+        text = encoding.decode(tokens)
+    else:
+        chars = budget * CHARS_PER_TOKEN
+        text = text[:chars] if keep == "head" else text[-chars:]
+    return text + "…" if keep == "head" else "…" + text
+
+
+# --- RETRIEVED CONTEXT ---
+def compact_task_record(doc) -> str:
+    """
+    Renders a task Document as one dense line, e.g.
+    `#42 Fix login bug | Website Redesign | In Progress | High | @Jane Doe | due 2025-07-01 | Users can't...`.
+    """
+    meta = doc.metadata
+    description = doc.page_content.partition("Description: ")[2].replace("\n", " ").strip()
+    if len(description) > DESCRIPTION_CHARS:
+        description = description[:DESCRIPTION_CHARS].rstrip() + "…"
+    fields = [
+        f"#{meta.get('task_id')} {meta.get('title')}",
+        meta.get("project") or "no project",
+        meta.get("status"),
+        meta.get("priority"),
+        f"@{meta.get('assignee') or 'unassigned'}",
+    ]
+    if meta.get("due_date"):
+        fields.append(f"due {meta['due_date']}")
+    if description and description != "None":
+        fields.append(description)
+    return " | ".join(str(field) for field in fields)
+
+
+def fit_task_records(docs, budget: int = TOOL_RESULT_TOKEN_BUDGET) -> str:
+    """ Compacts documents into one line each, adding lines (best first) until the token budget is used. """
+    lines, used = [], 0
+    for doc in docs:
+        line = compact_task_record(doc)
+        cost = count_tokens(line) + 1
+        if lines and used + cost > budget:
+            lines.append(f"(+{len(docs) - len(lines)} more not shown; ask a narrower question to see them)")
+            break
+        lines.append(line if cost <= budget else truncate_to_tokens(line, budget))
+        used += cost
+    return "\n".join(lines)
+
+
+# --- PER-TURN REPORTING ---
+def record_prompt_tokens(tokens: int, llm_calls: int):
+    _prompt_tokens.append(tokens)
+    logger.info("Turn used %d prompt tokens over %d LLM call(s).", tokens, llm_calls)
+
+
+def prompt_stats() -> dict:
+    """ Prompt tokens per agent turn (summed over the turn's LLM calls) for recent turns. """
+    samples = sorted(_prompt_tokens)
+
+    def percentile(p):
+        return samples[min(len(samples) - 1, int(p * len(samples)))] if samples else 0
+
+    return {
+        "turns": len(samples),
+        "prompt_tokens_mean": sum(samples) / len(samples) if samples else 0.0,
+        "prompt_tokens_p50": percentile(0.50),
+        "prompt_tokens_p95": percentile(0.95),
+    }
+
+
+def prompt_token_callback():
+    """
+    Returns a LangChain callback handler that counts the prompt tokens sent to
+    the model. Call its report() once the turn has finished.
+    """
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class PromptTokenCallback(BaseCallbackHandler):
+        def __init__(self):
+            self.tokens = 0
+            self.llm_calls = 0
+
+        def on_llm_start(self, serialized, prompts, **kwargs):
+            self.llm_calls += 1
+            self.tokens += sum(count_tokens(prompt) for prompt in prompts)
+
+        def on_chat_model_start(self, serialized, messages, **kwargs):
+            self.llm_calls += 1
+            self.tokens += sum(count_tokens(str(message.content)) for batch in messages for message in batch)
+
+        def report(self):
+            if self.llm_calls:
+                record_prompt_tokens(self.tokens, self.llm_calls)
+
+    return PromptTokenCallback()
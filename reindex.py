@@ -0,0 +1,245 @@
+# reindex.py
+# Blue-green re-indexing: rebuilds every task embedding into a new collection
+# while the bot keeps answering from the live one, then switches readers over.
+#
+# The build records the change-log position first and holds the memory worker
+# off pruning the log after it, so every change made during the build is
+# replayed into the new collection afterwards. Before switching, a sample of
+# tasks must find themselves by their own text (a recall spot check), and the
+# document count must equal the task count. The switch itself is one
+# transaction on the task database: the last changes are replayed and the
+# active-collection pointer and worker checkpoint are moved together, while
+# task writes wait. The bot and the memory worker pick up the new collection
+# within seconds. The old collection is kept, and --rollback switches back to
+# it after replaying what it missed.
+#
+#   python reindex.py                                  # re-embed with EMBEDDING_MODEL and switch
+#   python reindex.py --model all-mpnet-base-v2        # change the embedding model
+#   python reindex.py --no-switch                      # build and verify only
+#   python reindex.py --rollback
+#   python reindex.py --status
+import argparse
+import json
+import sys
+import time
+
+import db
+from embed_db import iter_document_batches
+from memory_manager import apply_update_batch, get_task_documents_by_ids, read_changes, sync_vector_store
+from vector_index import VECTOR_BACKEND, active_collection, count_documents, open_vector_store, set_active_collection
+
+# --- CONFIGURATION ---
+DB_FILE = "project_tasks.db"
+CHROMA_PERSIST_DIR = "./chroma_db"
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+BATCH_SIZE = 256  # Documents per embedding batch during the build.
+CHANGE_BATCH_SIZE = 512
+SWITCH_MAX_PENDING = 200  # Replay until at most this many changes are left, then finish under the write lock.
+SPOT_CHECKS = 50  # Random tasks that must be found by their own text in the new collection.
+SPOT_CHECK_K = 5
+MIN_RECALL = 0.9
+
+SQL_COUNT_TASKS = "SELECT COUNT(*) FROM tasks"
+SQL_OLDEST_CHANGE = "SELECT MIN(seq) FROM task_changes"
+SQL_PENDING_CHANGES = "SELECT COUNT(*) FROM task_changes WHERE seq > ?"
+SQL_RANDOM_TASK_IDS = "SELECT id FROM tasks ORDER BY RANDOM() LIMIT ?"
+SQL_CLEAR_META = "DELETE FROM meta WHERE key = ?"
+
+
+class ReindexError(Exception):
+    """ A check failed; the active collection was left unchanged. """
+
+
+def new_collection_name() -> str:
+    return time.strftime("tasks_%Y%m%d_%H%M%S")
+
+
+def load_embeddings(model_name: str):
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name=model_name)
+
+
+def build(pool: db.ConnectionPool, vector_store, batch_size: int = BATCH_SIZE) -> int:
+    """ Embeds every task into `vector_store`. Returns the number of documents written. """
+    started = time.perf_counter()
+    written = 0
+    with pool.connection() as conn:
+        for documents in iter_document_batches(conn, 0, batch_size):
+            vector_store.add_documents(documents=documents, ids=[str(doc.metadata['task_id']) for doc in documents])
+            written += len(documents)
+            if written % (batch_size * 20) < batch_size:
+                print(f"[Reindex] Embedded {written} tasks ({written / (time.perf_counter() - started):.1f}/s).")
+    return written
+
+
+def replay(conn, vector_store, after_seq: int) -> int:
+    """
+    Applies every logged change after `after_seq` to `vector_store` and returns
+    the last sequence applied. If the log has already been pruned past
+    `after_seq`, every task is compared by content hash instead.
+    """
+    oldest = conn.execute(SQL_OLDEST_CHANGE).fetchone()[0]
+    if oldest is not None and oldest > after_seq + 1:
+        seq = conn.execute(db.SQL_MAX_CHANGE_SEQ).fetchone()[0]
+        counts = sync_vector_store(conn, vector_store)
+        print(f"[Reindex] Change log no longer reaches change {after_seq}; compared every task instead "
+              f"({counts['upserted']} upserted, {counts['deleted']} deleted).")
+        return seq
+    while True:
+        actions, last_seq, count, _ = read_changes(conn, after_seq, CHANGE_BATCH_SIZE)
+        if not count:
+            return after_seq
+        if actions:
+            apply_update_batch(conn, vector_store, actions)
+        after_seq = last_seq
+
+
+def catch_up(pool: db.ConnectionPool, vector_store, after_seq: int) -> int:
+    """ Replays changes until few enough are left to finish inside the switch transaction. """
+    while True:
+        with pool.connection() as conn:
+            after_seq = replay(conn, vector_store, after_seq)
+            pending = conn.execute(SQL_PENDING_CHANGES, (after_seq,)).fetchone()[0]
+        if pending <= SWITCH_MAX_PENDING:
+            return after_seq
+
+
+def spot_check(pool: db.ConnectionPool, vector_store, embeddings, samples: int = SPOT_CHECKS,
+               k: int = SPOT_CHECK_K) -> float:
+    """ Fraction of randomly chosen tasks that appear in the top k when searching for their own text. """
+    with pool.connection() as conn:
+        task_ids = [row[0] for row in conn.execute(SQL_RANDOM_TASK_IDS, (samples,))]
+        documents = get_task_documents_by_ids(conn, task_ids)
+    if not documents:
+        return 1.0
+    hits = 0
+    for task_id, document in documents.items():
+        found = vector_store.similarity_search_by_vector(embeddings.embed_query(document.page_content), k=k)
+        hits += any(result.metadata.get("task_id") == task_id for result in found)
+    return hits / len(documents)
+
+
+def switch(pool: db.ConnectionPool, vector_store, name: str, embedding_model: str, after_seq: int,
+           force: bool = False) -> int:
+    """
+    Makes `name` the active collection. Runs as one IMMEDIATE transaction, so
+    no task can change between the last replayed change and the new
+    checkpoint. The collection it replaces is recorded for --rollback.
+    Returns the checkpoint the memory worker continues from.
+    """
+    with pool.transaction() as conn:
+        seq = replay(conn, vector_store, after_seq)
+        expected = conn.execute(SQL_COUNT_TASKS).fetchone()[0]
+        actual = count_documents(vector_store)
+        if actual != expected and not force:
+            raise ReindexError(f"Collection '{name}' holds {actual} documents for {expected} tasks.")
+        live_name, live_model = active_collection(conn, EMBEDDING_MODEL)
+        previous = {"name": live_name, "embedding_model": live_model,
+                    "applied_seq": int(db.get_meta(conn, db.META_APPLIED_CHANGE_SEQ, 0))}
+        db.set_meta(conn, db.META_PREVIOUS_VECTOR_COLLECTION, json.dumps(previous))
+        set_active_collection(conn, name, embedding_model)
+        db.set_meta(conn, db.META_APPLIED_CHANGE_SEQ, seq)
+        # Moves the data version on, so results cached from the old collection are not reused.
+        conn.execute(db.SQL_LOG_RESYNC)
+    return seq
+
+
+def reindex(pool: db.ConnectionPool, embedding_model: str, name: str | None = None, do_switch: bool = True,
+            force: bool = False, min_recall: float = MIN_RECALL, batch_size: int = BATCH_SIZE) -> str:
+    """ Builds, verifies and (unless `do_switch` is False) activates a new collection. Returns its name. """
+    name = name or new_collection_name()
+    with pool.connection() as conn:
+        db.ensure_change_log(conn)
+        live_name, _ = active_collection(conn, EMBEDDING_MODEL)
+        if name == live_name:
+            raise ReindexError(f"'{name}' is the active collection; choose another name.")
+        start_seq = conn.execute(db.SQL_MAX_CHANGE_SEQ).fetchone()[0]
+        db.set_meta(conn, db.META_REINDEX_FROM_SEQ, start_seq)
+
+    try:
+        embeddings = load_embeddings(embedding_model)
+        vector_store = open_vector_store(CHROMA_PERSIST_DIR, embeddings, collection_name=name)
+        if count_documents(vector_store):
+            raise ReindexError(f"Collection '{name}' already exists; choose another name.")
+        print(f"[Reindex] Building '{name}' with '{embedding_model}' ({VECTOR_BACKEND} backend) "
+              f"while '{live_name}' stays live...")
+        started = time.perf_counter()
+        written = build(pool, vector_store, batch_size)
+        print(f"[Reindex] Embedded {written} tasks in {time.perf_counter() - started:.1f}s. Replaying later changes...")
+        seq = catch_up(pool, vector_store, start_seq)
+
+        recall = spot_check(pool, vector_store, embeddings)
+        print(f"[Reindex] Spot-check recall@{SPOT_CHECK_K}: {recall:.0%}.")
+        if recall < min_recall and not force:
+            raise ReindexError(f"Spot-check recall {recall:.0%} is below {min_recall:.0%}.")
+        if not do_switch:
+            print(f"[Reindex] '{name}' is ready; not switching (--no-switch).")
+            return name
+        seq = switch(pool, vector_store, name, embedding_model, seq, force)
+    finally:
+        with pool.connection() as conn:
+            conn.execute(SQL_CLEAR_META, (db.META_REINDEX_FROM_SEQ,))
+    print(f"[Reindex] Switched to '{name}' at change {seq}. '{live_name}' is kept for --rollback.")
+    return name
+
+
+def rollback(pool: db.ConnectionPool, force: bool = False) -> str:
+    """ Re-activates the collection the last switch replaced, after replaying the changes it missed. """
+    with pool.connection() as conn:
+        previous = db.get_meta(conn, db.META_PREVIOUS_VECTOR_COLLECTION)
+    if previous is None:
+        raise ReindexError("No previous collection to roll back to.")
+    previous = json.loads(previous)
+    embeddings = load_embeddings(previous["embedding_model"])
+    vector_store = open_vector_store(CHROMA_PERSIST_DIR, embeddings, collection_name=previous["name"])
+    print(f"[Reindex] Catching '{previous['name']}' up from change {previous['applied_seq']}...")
+    seq = catch_up(pool, vector_store, previous["applied_seq"])
+    seq = switch(pool, vector_store, previous["name"], previous["embedding_model"], seq, force)
+    print(f"[Reindex] Rolled back to '{previous['name']}' at change {seq}.")
+    return previous["name"]
+
+
+def print_status(pool: db.ConnectionPool):
+    with pool.connection() as conn:
+        name, model = active_collection(conn, EMBEDDING_MODEL)
+        previous = db.get_meta(conn, db.META_PREVIOUS_VECTOR_COLLECTION)
+        tasks = conn.execute(SQL_COUNT_TASKS).fetchone()[0]
+        checkpoint = db.get_meta(conn, db.META_APPLIED_CHANGE_SEQ)
+    documents = count_documents(open_vector_store(CHROMA_PERSIST_DIR, collection_name=name))
+    print(f"Active collection: '{name}' ({model}, {VECTOR_BACKEND} backend), {documents} documents for {tasks} tasks, "
+          f"applied through change {checkpoint}.")
+    if previous:
+        previous = json.loads(previous)
+        print(f"Previous collection: '{previous['name']}' ({previous['embedding_model']}).")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the vector index into a new collection without downtime.")
+    parser.add_argument("--model", default=EMBEDDING_MODEL, help="Embedding model for the new collection.")
+    parser.add_argument("--collection", help="Name of the new collection (default: tasks_<timestamp>).")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--min-recall", type=float, default=MIN_RECALL, help="Spot-check recall needed to switch.")
+    parser.add_argument("--no-switch", action="store_true", help="Build and verify, but keep the live collection.")
+    parser.add_argument("--force", action="store_true", help="Switch even if a verification check fails.")
+    parser.add_argument("--rollback", action="store_true", help="Switch back to the previous collection.")
+    parser.add_argument("--status", action="store_true", help="Show the active and previous collections.")
+    args = parser.parse_args()
+
+    pool = db.get_pool(DB_FILE)
+    try:
+        if args.status:
+            print_status(pool)
+        elif args.rollback:
+            rollback(pool, args.force)
+        else:
+            reindex(pool, args.model, args.collection, not args.no_switch, args.force, args.min_recall,
+                    args.batch_size)
+    except ReindexError as e:
+        print(f"[Reindex] {e} The active collection is unchanged.")
+        sys.exit(1)
+    finally:
+        db.close_pools()
+
+
+if __name__ == "__main__":
+    main()
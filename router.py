@@ -0,0 +1,241 @@
+# router.py
+import logging
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+
+import db
+from memory_manager import format_task_as_document
+
+# --- CONFIGURATION (Should match other scripts) ---
+DB_FILE = "project_tasks.db"
+MIN_CONFIDENCE = 0.9  # Below this, the query goes to the full agent.
+NAME_REFRESH_SECONDS = 60  # How long the project/user name lists are reused.
+MAX_LISTED_TASKS = 15
+
+logger = logging.getLogger(__name__)
+
+# Anything that asks the bot to change data, explain or judge needs the agent.
+AGENT_ONLY = re.compile(
+    r"\b(add|create|new|assign|reassign|update|change|set|mark|move|delete|remove|close|rename|"
+    r"why|should|could|would|summari[sz]e|explain|compare|recommend|plan|help|how)\b",
+    re.IGNORECASE,
+)
+LIST_USERS = re.compile(
+    r"^\s*(please\s+)?((list|show|get|give me)\s+(me\s+)?(all\s+)?(the\s+)?(available\s+)?(users|people|team members)"
+    r"|who\s+(are\s+)?(all\s+)?the\s+(users|team members))\s*[?.!]*\s*$",
+    re.IGNORECASE,
+)
+TASK_BY_ID = re.compile(r"^\s*(show|get|what(?:'s| is)|describe)?\s*(me\s+)?task\s*(#|id|number)?\s*(\d+)\s*[?.!]*\s*$", re.IGNORECASE)
+LIST_TASKS = re.compile(r"^\s*(please\s+)?(list|show|get|give me|what are|which are|what)\b.*\btasks?\b", re.IGNORECASE)
+STATUS_WORDS = {
+    "to do": "To Do", "todo": "To Do", "not started": "To Do",
+    "in progress": "In Progress", "ongoing": "In Progress",
+    "done": "Done", "completed": "Done", "finished": "Done",
+}
+# "tasks for X" / "assigned to X": if X is not a known user or project, the rules cannot answer.
+OWNER_HINT = re.compile(r"\b(?:for|assigned to|owned by|belonging to)\s+([a-z][\w'-]*)", re.IGNORECASE)
+PRIORITY_WORDS = {"high": "High", "urgent": "High", "medium": "Medium", "low": "Low"}
+# A negated filter ("not in progress", "except done ones") would be read as its opposite; only
+# "not done" is understood (as open tasks), anything else negated goes to the agent.
+NEGATION = re.compile(r"\b(not|no|never|except|excluding|without|besides|other than)\b|n['’]t\b")
+NOT_DONE = re.compile(r"(\bnot|n['’]t)\s+(yet\s+|been\s+)*(done|completed|finished)\b")
+
+
+@dataclass
+class RouteResult:
+    intent: str
+    confidence: float
+    params: dict = field(default_factory=dict)
+    answer: str | None = None
+
+
+class FastPathRouter:
+    """
+    A cheap, deterministic pre-dispatch step in front of the agent.
+
+    Common read-only intents (list users, look up a task by ID, list tasks by
+    project/assignee/status/priority) are recognised with rules and answered
+    straight from SQL, skipping the LLM entirely. Anything else, or anything
+    the rules are unsure about, falls back to the agent. Per-intent hit counts
+    and latencies are kept so the savings can be measured.
+    """
+
+    def __init__(self, db_file: str = DB_FILE, min_confidence: float = MIN_CONFIDENCE):
+        self.db_file = db_file
+        self.min_confidence = min_confidence
+        self._names_lock = threading.Lock()
+        self._names_loaded_at = 0.0
+        self._project_names = []
+        self._user_names = []
+        self._stats_lock = threading.Lock()
+        self._stats = {"routed": {}, "routed_seconds": {}, "fallbacks": 0, "agent_seconds": 0.0, "agent_runs": 0}
+
+    # --- CLASSIFICATION ---
+    def classify(self, query: str) -> RouteResult:
+        """ Maps a query to an intent and its parameters, with a confidence score. """
+        if AGENT_ONLY.search(query):
+            return RouteResult("agent", 1.0)
+        if LIST_USERS.match(query):
+            return RouteResult("list_users", 0.95)
+        match = TASK_BY_ID.match(query)
+        if match:
+            return RouteResult("task_by_id", 0.95, {"task_id": int(match.group(4))})
+        if LIST_TASKS.match(query):
+            filters = self._extract_task_filters(query)
+            if filters:
+                return RouteResult("list_tasks", 0.9, filters)
+            return RouteResult("list_tasks", 0.5)  # A vague listing request; let the agent decide.
+        return RouteResult("agent", 1.0)
+
+    def _extract_task_filters(self, query: str) -> dict:
+        text = query.lower()
+        if re.search(r"\b(my|mine|me|i|our|us)\b", text):
+            return {}  # The rules do not know which user "me" is.
+        text = text.replace("not started", "to do")  # A status name, not a negation.
+        filters = {}
+        if NOT_DONE.search(text):
+            text = NOT_DONE.sub(" ", text)
+            filters["open_only"] = True
+        if NEGATION.search(text):
+            return {}
+        for phrase, status in STATUS_WORDS.items():
+            if "open_only" not in filters and re.search(rf"\b{phrase}\b", text):
+                filters["status"] = status
+                break
+        if re.search(r"\b(open|outstanding|remaining)\b", text) and "status" not in filters:
+            filters["open_only"] = True
+        for word, priority in PRIORITY_WORDS.items():
+            if re.search(rf"\b{word}[- ]priority\b|\bpriority (is )?{word}\b", text):
+                filters["priority"] = priority
+                break
+
+        self._refresh_names()
+        projects = [name for name in self._project_names if name.lower() in text]
+        if len(projects) == 1:
+            filters["project_name"] = projects[0]
+        users = [name for name in self._user_names if self._mentions_user(text, name)]
+        if len(users) == 1:
+            filters["assignee_name"] = users[0]
+        elif len(users) > 1:
+            return {}  # Ambiguous person; the agent can ask.
+        owner = OWNER_HINT.search(text)
+        if owner and not users and not projects:
+            return {}  # Names someone we do not know (or "me"); the agent can work out who.
+        return filters
+
+    @staticmethod
+    def _mentions_user(text: str, name: str) -> bool:
+        if name.lower() in text:
+            return True
+        # Also accept a unique first name ("tasks for alice").
+        first = name.split()[0].lower() if name.split() else ""
+        return len(first) > 2 and re.search(rf"\b{re.escape(first)}\b", text) is not None
+
+    def _refresh_names(self):
+        with self._names_lock:
+            if time.monotonic() - self._names_loaded_at < NAME_REFRESH_SECONDS:
+                return
+            with db.get_pool(self.db_file).connection() as conn:
+                self._project_names = [row[0] for row in conn.execute("SELECT name FROM projects")]
+                self._user_names = [row[0] for row in conn.execute("SELECT name FROM users")]
+            self._names_loaded_at = time.monotonic()
+
+    # --- DISPATCH ---
+    def route(self, query: str) -> RouteResult | None:
+        """
+        Answers the query directly if it matches a high-confidence intent.
+        Returns None when the query should go to the agent instead.
+        """
+        start = time.perf_counter()
+        try:
+            result = self.classify(query)
+            if result.intent == "agent" or result.confidence < self.min_confidence:
+                with self._stats_lock:
+                    self._stats["fallbacks"] += 1
+                return None
+            result.answer = getattr(self, f"_answer_{result.intent}")(**result.params)
+        except Exception as e:
+            # The fast path must never break a turn; the agent can still answer.
+            logger.warning("Fast path failed, falling back to the agent: %s", e)
+            with self._stats_lock:
+                self._stats["fallbacks"] += 1
+            return None
+
+        elapsed = time.perf_counter() - start
+        with self._stats_lock:
+            self._stats["routed"][result.intent] = self._stats["routed"].get(result.intent, 0) + 1
+            self._stats["routed_seconds"][result.intent] = self._stats["routed_seconds"].get(result.intent, 0.0) + elapsed
+        logger.info("Answered '%s' via fast path '%s' in %.1f ms.", query, result.intent, elapsed * 1000)
+        return result
+
+    def _answer_list_users(self) -> str:
+        from merged_agent import list_users  # The agent module is heavy; only this intent needs it.
+        return list_users("")
+
+    def _answer_task_by_id(self, task_id: int) -> str:
+        with db.get_pool(self.db_file).connection() as conn:
+            row = conn.execute(db.SQL_TASK_BY_ID, (task_id,)).fetchone()
+        if not row:
+            return f"There is no task with ID {task_id}."
+        return f"Task ID {task_id}:\n" + format_task_as_document(row).page_content
+
+    def _answer_list_tasks(self, **filters) -> str:
+        # Fetch one extra row to know whether the list was cut short.
+        sql, params = db.build_task_filter_query(**filters, limit=MAX_LISTED_TASKS + 1)
+        with db.get_pool(self.db_file).connection() as conn:
+            task_ids = [row["id"] for row in conn.execute(sql, params)]
+            shown = task_ids[:MAX_LISTED_TASKS]
+            rows = conn.execute(db.sql_tasks_by_ids(len(shown)), shown).fetchall() if shown else []
+        if not task_ids:
+            return "No tasks match that."
+        by_id = {row["id"]: row for row in rows}
+        lines = []
+        for task_id in shown:
+            row = by_id[task_id]
+            due = f" | due {row['due_date']}" if row['due_date'] else ""
+            lines.append(
+                f"- #{task_id} {row['title']} | {row['project_name']} | {row['status']} | "
+                f"{row['priority']} | {row['assignee_name'] or 'Unassigned'}{due}"
+            )
+        if len(task_ids) > MAX_LISTED_TASKS:
+            return f"Here are the first {MAX_LISTED_TASKS} matching tasks:\n" + "\n".join(lines)
+        return f"Found {len(task_ids)} task(s):\n" + "\n".join(lines)
+
+    # --- STATISTICS ---
+    def record_agent_run(self, seconds: float):
+        """ Records how long a full agent turn took, as the baseline for latency savings. """
+        with self._stats_lock:
+            self._stats["agent_runs"] += 1
+            self._stats["agent_seconds"] += seconds
+
+    def stats(self) -> dict:
+        """ Per-intent hit counts and mean latencies, plus the estimated time saved versus the agent. """
+        with self._stats_lock:
+            routed = dict(self._stats["routed"])
+            routed_seconds = dict(self._stats["routed_seconds"])
+            fallbacks = self._stats["fallbacks"]
+            agent_runs = self._stats["agent_runs"]
+            agent_seconds = self._stats["agent_seconds"]
+        total = sum(routed.values()) + fallbacks
+        avg_agent = agent_seconds / agent_runs if agent_runs else None
+        intents = {
+            intent: {
+                "hits": hits,
+                "hit_rate": hits / total if total else 0.0,
+                "avg_ms": 1000 * routed_seconds[intent] / hits,
+            }
+            for intent, hits in routed.items()
+        }
+        saved = (
+            sum(hits * avg_agent - routed_seconds[intent] for intent, hits in routed.items())
+            if avg_agent is not None else None
+        )
+        return {
+            "queries": total,
+            "fallbacks": fallbacks,
+            "intents": intents,
+            "avg_agent_ms": 1000 * avg_agent if avg_agent is not None else None,
+            "estimated_seconds_saved": saved,
+        }
@@ -0,0 +1,231 @@
+# scheduler.py
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+from cache import normalize_query
+from concurrency import MAX_CONCURRENT_AGENT_RUNS
+
+# --- CONFIGURATION ---
+MAX_QUEUE_SIZE = 32  # Requests waiting for an agent run; beyond this, new ones are turned away.
+MAX_QUEUE_WAIT_SECONDS = 120  # Requests that waited longer are dropped instead of answered late.
+WAIT_SAMPLES = 1000  # Recent queue waits kept for percentile statistics.
+
+# Lower runs first.
+PRIORITY_DM = 0
+PRIORITY_ROLE = 1
+PRIORITY_DEFAULT = 2
+
+
+class QueueFullError(Exception):
+    """ Raised by submit() when the queue is at capacity. """
+
+
+class RequestExpiredError(Exception):
+    """ Set on a request's future when it waited longer than MAX_QUEUE_WAIT_SECONDS. """
+
+
+@dataclass
+class Waiter:
+    user_id: int
+    memory: object
+    future: asyncio.Future
+    on_token: object = None  # Optional callable receiving streamed pieces of the answer.
+
+
+@dataclass(eq=False)  # Jobs are compared by identity; ordering comes from __lt__.
+class AgentJob:
+    """ One agent run, possibly answering several identical requests. """
+    key: tuple
+    query: str
+    user_id: int
+    memory: object
+    priority: int
+    seq: int
+    enqueued_at: float = field(default_factory=time.monotonic)
+    waiters: list = field(default_factory=list)
+    streamed: str = ""  # Answer text streamed so far, replayed to waiters that join late.
+
+    def publish_token(self, text: str):
+        """ Forwards a streamed piece of the answer to every waiter that wants it. """
+        self.streamed += text
+        for waiter in self.waiters:
+            if waiter.on_token is not None:
+                waiter.on_token(text)
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class AgentScheduler:
+    """
+    Admission control and priority scheduling in front of the agent.
+
+    Requests wait in a bounded priority queue (DMs and privileged roles first,
+    FIFO within a priority) and a fixed number of workers feed them to
+    `run_fn`. When the queue is full, submit() fails fast so the caller can
+    reply immediately; requests that waited too long are dropped. An identical
+    query from the same user (same normalized text and same data version) that
+    is already queued or running is not run again: the new request simply waits
+    for that run's answer. Queries from different users never share a run, as
+    each run answers from its own user's conversation memory.
+
+    A user's jobs run one at a time, in arrival order. A worker that takes a
+    job whose user already has one running sets it aside in that user's FIFO
+    and moves on to the next job, so one user's backlog never ties up the
+    workers; when the running job finishes, the user's next job goes back
+    into the queue in its original place.
+    """
+
+    def __init__(self, run_fn, version_fn=lambda: 0, workers: int = MAX_CONCURRENT_AGENT_RUNS,
+                 max_queue: int = MAX_QUEUE_SIZE, max_wait: float = MAX_QUEUE_WAIT_SECONDS):
+        self.run_fn = run_fn  # async callable taking an AgentJob and returning the answer.
+        self.version_fn = version_fn
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._ready = []  # Heap of jobs a worker may take next, highest priority first.
+        self._ready_count = None  # asyncio.Semaphore counting the jobs in _ready.
+        self._tasks = []
+        self._pending = {}  # Coalescing key -> job, for queued and running jobs.
+        self._lane_owner = {}  # User -> the job running (or next to run) for them.
+        self._deferred = {}  # User -> deque of their jobs waiting for the lane, oldest first.
+        self._seq = itertools.count()
+        self.running = 0
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self._counters = {"submitted": 0, "coalesced": 0, "rejected": 0, "expired": 0, "completed": 0, "failed": 0}
+
+    def start(self):
+        """ Starts the worker tasks; call from within the running event loop. """
+        if self._ready_count is None:
+            self._ready_count = asyncio.Semaphore(0)
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def submit(self, query: str, user_id: int, memory, priority: int = PRIORITY_DEFAULT,
+               coalesce: bool = True, on_token=None) -> tuple[asyncio.Future, int]:
+        """
+        Queues a request and returns (future, position). The future resolves to
+        the answer; position is 0 if a worker is free, else the place in line.
+        Pass coalesce=False for requests that must run on their own (e.g. ones
+        that add data). `on_token`, if given, receives the answer as it streams
+        in. Raises QueueFullError when there is no room.
+        """
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        waiter = Waiter(user_id, memory, future, on_token)
+        seq = next(self._seq)
+        # Non-coalescable requests get a unique key so nothing can join them.
+        key = (user_id, normalize_query(query), self.version_fn()) if coalesce else (user_id, "", seq)
+
+        job = self._pending.get(key)
+        if job is not None:
+            job.waiters.append(waiter)
+            if on_token is not None and job.streamed:
+                on_token(job.streamed)
+            self._counters["coalesced"] += 1
+            return future, self.position(job)
+
+        if self.queue_depth() >= self.max_queue:
+            self._counters["rejected"] += 1
+            raise QueueFullError(f"{self.queue_depth()} requests are already waiting.")
+
+        job = AgentJob(key, query, user_id, memory, priority, seq, waiters=[waiter])
+        self._pending[key] = job
+        self._push(job)
+        self._counters["submitted"] += 1
+        return future, self.position(job)
+
+    def queue_depth(self) -> int:
+        """ Jobs waiting, whether in the queue or set aside behind their user's running job. """
+        return len(self._ready) + sum(len(jobs) for jobs in self._deferred.values())
+
+    def _push(self, job: AgentJob):
+        heapq.heappush(self._ready, job)
+        self._ready_count.release()
+
+    def _waiting_jobs(self):
+        yield from self._ready
+        for jobs in self._deferred.values():
+            yield from jobs
+
+    def position(self, job: AgentJob) -> int:
+        """ 0 if the job is running or a worker is free for it, otherwise its 1-based place in line. """
+        if not any(other is job for other in self._waiting_jobs()):
+            return 0
+        ahead = sum(1 for other in self._waiting_jobs() if other < job)
+        if self._lane_owner.get(job.user_id) not in (None, job):
+            # Waits for the user's running job, however many workers are free.
+            return ahead + 1
+        free_workers = max(0, self.workers - self.running)
+        return max(0, ahead + 1 - free_workers)
+
+    async def _worker(self):
+        while True:
+            await self._ready_count.acquire()
+            job = heapq.heappop(self._ready)
+            owner = self._lane_owner.get(job.user_id)
+            if owner is not None and owner is not job:
+                # The user already has a job running; wait behind it without holding a worker.
+                self._deferred.setdefault(job.user_id, deque()).append(job)
+                continue
+            self._lane_owner[job.user_id] = job
+            waited = time.monotonic() - job.enqueued_at
+            self._waits.append(waited)
+            if waited > self.max_wait:
+                self._counters["expired"] += 1
+                self._resolve(job, error=RequestExpiredError(f"Waited {waited:.0f}s in the queue."))
+                continue
+            self.running += 1
+            try:
+                answer = await self.run_fn(job)
+            except Exception as e:
+                self._counters["failed"] += 1
+                self._resolve(job, error=e)
+            else:
+                self._counters["completed"] += 1
+                self._resolve(job, answer=answer)
+            finally:
+                self.running -= 1
+
+    def _release_lane(self, job: AgentJob):
+        """ Hands the user's lane to their next set-aside job, which goes back into the queue. """
+        deferred = self._deferred.get(job.user_id)
+        if not deferred:
+            self._lane_owner.pop(job.user_id, None)
+            return
+        next_job = deferred.popleft()
+        if not deferred:
+            del self._deferred[job.user_id]
+        self._lane_owner[job.user_id] = next_job
+        self._push(next_job)
+
+    def _resolve(self, job: AgentJob, answer=None, error=None):
+        self._pending.pop(job.key, None)
+        self._release_lane(job)
+        for waiter in job.waiters:
+            if waiter.future.done():
+                continue
+            if error is not None:
+                waiter.future.set_exception(error)
+            else:
+                waiter.future.set_result(answer)
+
+    def stats(self) -> dict:
+        """ Queue depth, running jobs, users with a job in progress, counters and queue-wait percentiles (seconds). """
+        waits = sorted(self._waits)
+
+        def percentile(p):
+            return waits[min(len(waits) - 1, int(p * len(waits)))] if waits else 0.0
+
+        return {
+            "queue_depth": self.queue_depth(),
+            "running": self.running,
+            "busy_users": len(self._lane_owner),
+            **self._counters,
+            "wait_p50": percentile(0.50),
+            "wait_p95": percentile(0.95),
+            "wait_max": waits[-1] if waits else 0.0,
+        }
@@ -1,8 +1,15 @@
+import argparse
+import csv
+import json
+import os
 import sqlite3
+import time
+from contextlib import contextmanager, nullcontext
 from sqlite3 import Error
 import datetime
 import random
-from faker import Faker
+
+import db
 
 # --- CONFIGURATION ---
 DB_FILE = "project_tasks.db"
@@ -83,79 +90,390 @@ def setup_database_schema(conn):
     create_table(conn, sql_create_users_table)
     create_table(conn, sql_create_tasks_table)
     create_table(conn, sql_create_tasks_update_trigger)
+    create_table(conn, db.SQL_CREATE_META)
+    create_indexes(conn)
+    setup_search_index(conn)
+    db.ensure_change_log(conn)
+    conn.commit()
     print("Schema setup complete.")
 
 
-def populate_fake_data(conn):
-    """Populates the database with fake data for projects, users, and tasks."""
-    fake = Faker()
-    cursor = conn.cursor()
-
-    print(f"Populating database with {NUM_FAKE_PROJECTS} projects, {NUM_FAKE_USERS} users, and {NUM_FAKE_TASKS} tasks...")
-
-    # --- Populate Projects ---
-    project_ids = []
-    project_names = ['AI Agent Development', 'Website Redesign', 'Q3 Marketing Campaign', 'Mobile App Launch', 'Data Warehouse Migration']
-    random.shuffle(project_names)
-    for i in range(NUM_FAKE_PROJECTS):
-        try:
-            name = project_names[i]
-            cursor.execute("INSERT INTO projects (name) VALUES (?)", (name,))
-            project_ids.append(cursor.lastrowid)
-        except sqlite3.IntegrityError:
-            # In case the randomly chosen name already exists
-            print(f"Project '{name}' already exists. Skipping.")
-            cursor.execute("SELECT id FROM projects WHERE name=?", (name,))
-            project_ids.append(cursor.fetchone()[0])
-
-
-    # --- Populate Users ---
-    user_ids = []
-    for _ in range(NUM_FAKE_USERS):
-        try:
-            name = fake.name()
-            email = fake.unique.email()
-            cursor.execute("INSERT INTO users (name, email) VALUES (?, ?)", (name, email))
-            user_ids.append(cursor.lastrowid)
-        except sqlite3.IntegrityError:
-             print(f"User with email '{email}' already exists. Skipping.")
-             cursor.execute("SELECT id FROM users WHERE email=?", (email,))
-             user_ids.append(cursor.fetchone()[0])
-
-
-    # --- Populate Tasks ---
-    task_statuses = ['To Do', 'In Progress', 'Done']
-    task_priorities = ['Low', 'Medium', 'High']
-    for _ in range(NUM_FAKE_TASKS):
-        title = fake.catch_phrase()
-        description = fake.text(max_nb_chars=200)
-        status = random.choice(task_statuses)
-        priority = random.choice(task_priorities)
-        # Make some tasks have a due date in the near future
-        due_date = fake.future_date(end_date="+60d").isoformat() if random.random() > 0.3 else None
-        project_id = random.choice(project_ids)
-        # Allow some tasks to be unassigned
-        assignee_id = random.choice(user_ids + [None]) 
+def create_indexes(conn):
+    """ Creates the indexes that structured task filters are pushed down to. """
+    sql_create_task_indexes = [
+        "CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status);",
+        "CREATE INDEX IF NOT EXISTS idx_tasks_priority ON tasks (priority);",
+        "CREATE INDEX IF NOT EXISTS idx_tasks_project_id ON tasks (project_id);",
+        "CREATE INDEX IF NOT EXISTS idx_tasks_assignee_id ON tasks (assignee_id);",
+        "CREATE INDEX IF NOT EXISTS idx_tasks_due_date ON tasks (due_date);",
+    ]
+    for sql in sql_create_task_indexes:
+        create_table(conn, sql)
+
 
+def setup_search_index(conn):
+    """
+    Creates the FTS5 full-text index over task title, description, project name
+    and assignee name (rowid = task id), plus the triggers that keep it in sync
+    with the tasks, projects and users tables. Existing tasks are backfilled.
+    """
+    sql_create_tasks_fts_table = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5(
+        title, description, project_name, assignee_name,
+        tokenize = 'porter unicode61'
+    );
+    """
+
+    # Denormalised row for one task, used by the insert and update triggers.
+    fts_row_for_new = """
+        INSERT INTO tasks_fts (rowid, title, description, project_name, assignee_name)
+        VALUES (
+            NEW.id, NEW.title, NEW.description,
+            (SELECT name FROM projects WHERE id = NEW.project_id),
+            (SELECT name FROM users WHERE id = NEW.assignee_id)
+        );
+    """
+
+    sql_create_fts_insert_trigger = f"""
+    CREATE TRIGGER IF NOT EXISTS tasks_fts_after_insert
+    AFTER INSERT ON tasks
+    FOR EACH ROW
+    BEGIN
+        {fts_row_for_new}
+    END;
+    """
+
+    # Only fires for indexed columns, so the updated_at trigger does not re-index.
+    sql_create_fts_update_trigger = f"""
+    CREATE TRIGGER IF NOT EXISTS tasks_fts_after_update
+    AFTER UPDATE OF title, description, project_id, assignee_id ON tasks
+    FOR EACH ROW
+    BEGIN
+        DELETE FROM tasks_fts WHERE rowid = OLD.id;
+        {fts_row_for_new}
+    END;
+    """
+
+    sql_create_fts_delete_trigger = """
+    CREATE TRIGGER IF NOT EXISTS tasks_fts_after_delete
+    AFTER DELETE ON tasks
+    FOR EACH ROW
+    BEGIN
+        DELETE FROM tasks_fts WHERE rowid = OLD.id;
+    END;
+    """
+
+    sql_create_fts_project_rename_trigger = """
+    CREATE TRIGGER IF NOT EXISTS tasks_fts_after_project_rename
+    AFTER UPDATE OF name ON projects
+    FOR EACH ROW
+    BEGIN
+        UPDATE tasks_fts SET project_name = NEW.name
+        WHERE rowid IN (SELECT id FROM tasks WHERE project_id = NEW.id);
+    END;
+    """
+
+    sql_create_fts_user_rename_trigger = """
+    CREATE TRIGGER IF NOT EXISTS tasks_fts_after_user_rename
+    AFTER UPDATE OF name ON users
+    FOR EACH ROW
+    BEGIN
+        UPDATE tasks_fts SET assignee_name = NEW.name
+        WHERE rowid IN (SELECT id FROM tasks WHERE assignee_id = NEW.id);
+    END;
+    """
+
+    create_table(conn, sql_create_tasks_fts_table)
+    create_table(conn, sql_create_fts_insert_trigger)
+    create_table(conn, sql_create_fts_update_trigger)
+    create_table(conn, sql_create_fts_delete_trigger)
+    create_table(conn, sql_create_fts_project_rename_trigger)
+    create_table(conn, sql_create_fts_user_rename_trigger)
+    rebuild_search_index(conn, only_missing=True)
+
+
+def rebuild_search_index(conn, only_missing=False):
+    """ Repopulates tasks_fts from the tasks table (or just the tasks it is missing). """
+    try:
+        cursor = conn.cursor()
+        if not only_missing:
+            cursor.execute("DELETE FROM tasks_fts")
         cursor.execute("""
-            INSERT INTO tasks (title, description, status, priority, due_date, project_id, assignee_id)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (title, description, status, priority, due_date, project_id, assignee_id))
+            INSERT INTO tasks_fts (rowid, title, description, project_name, assignee_name)
+            SELECT t.id, t.title, t.description, p.name, u.name
+            FROM tasks t
+            LEFT JOIN projects p ON t.project_id = p.id
+            LEFT JOIN users u ON t.assignee_id = u.id
+            WHERE t.id NOT IN (SELECT rowid FROM tasks_fts)
+        """)
+        if cursor.rowcount:
+            print(f"Indexed {cursor.rowcount} existing tasks for full-text search.")
+        conn.commit()
+    except Error as e:
+        print(e)
+
+
+def populate_fake_data(conn):
+    """Populates the database with the small default set of fake projects, users, and tasks."""
+    generate_fake_data(conn, NUM_FAKE_PROJECTS, NUM_FAKE_USERS, NUM_FAKE_TASKS)
+
 
+# --- BULK LOADING ---
+# Durability is pointless while building a database from scratch, so a bulk
+# load (--bulk) runs without a journal or fsyncs; the normal settings
+# (db.PRAGMAS) are put back afterwards. Without --bulk, rows are inserted in
+# ordinary transactions with every index and trigger in place.
+BULK_LOAD_PRAGMAS = (
+    ("journal_mode", "OFF"),
+    ("synchronous", "OFF"),
+    ("locking_mode", "EXCLUSIVE"),
+    ("cache_size", "-262144"),  # 256 MiB
+    ("temp_store", "MEMORY"),
+    ("foreign_keys", "OFF"),
+)
+BULK_BATCH_SIZE = 50_000  # Rows per executemany() call.
+DESCRIPTION_POOL_SIZE = 20_000  # Faker descriptions generated up front and reused across tasks.
+TITLE_POOL_SIZE = 10_000
+PROJECT_NAMES = ['AI Agent Development', 'Website Redesign', 'Q3 Marketing Campaign', 'Mobile App Launch', 'Data Warehouse Migration']
+# Dropped before a bulk load and rebuilt once afterwards, instead of being maintained row by row.
+DEFERRED_INDEXES = ("idx_tasks_status", "idx_tasks_priority", "idx_tasks_project_id", "idx_tasks_assignee_id", "idx_tasks_due_date")
+DEFERRED_TRIGGERS = ("tasks_fts_after_insert", "tasks_fts_after_update", "tasks_fts_after_delete",
+                     "tasks_fts_after_project_rename", "tasks_fts_after_user_rename", *db.CHANGE_TRIGGERS)
+TASK_INSERT_SQL = """
+    INSERT INTO tasks (title, description, status, priority, due_date, project_id, assignee_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+@contextmanager
+def bulk_load(conn):
+    """
+    Puts the connection into bulk-load mode, drops the task indexes and the
+    full-text and change-log triggers, and yields. Afterwards the indexes,
+    triggers and full-text index are built once over all rows and the normal
+    pragmas are restored. The loaded rows are not in the change log, so the
+    memory manager's checkpoint is cleared and its next start compares every
+    task; a `resync` row moves the data version on. A running bot would miss
+    the rows, so the load refuses to start while another connection has the
+    database open.
+    """
+    started = time.perf_counter()
+    conn.commit()
+    try:
+        # Leaving WAL mode needs the only connection to the database.
+        conn.execute("PRAGMA journal_mode = OFF")
+    except sqlite3.OperationalError as e:
+        raise RuntimeError("The database is in use; stop the bot before a bulk load, or load without --bulk.") from e
+    for name, value in BULK_LOAD_PRAGMAS:
+        conn.execute(f"PRAGMA {name} = {value}")
+    for index in DEFERRED_INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {index}")
+    for trigger in DEFERRED_TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
     conn.commit()
-    print("Fake data population complete.")
+    try:
+        yield conn
+    finally:
+        conn.commit()
+        loaded = time.perf_counter()
+        print(f"Rows loaded in {loaded - started:.1f}s; building indexes...")
+        create_indexes(conn)
+        setup_search_index(conn)
+        db.ensure_change_log(conn)
+        conn.execute(db.SQL_LOG_RESYNC)
+        conn.execute("DELETE FROM meta WHERE key = ?", (db.META_APPLIED_CHANGE_SEQ,))
+        conn.execute("PRAGMA analysis_limit = 1000")  # Sampled statistics are enough for the planner.
+        conn.execute("ANALYZE")
+        conn.commit()
+        print(f"Indexes built in {time.perf_counter() - loaded:.1f}s.")
+        conn.execute("PRAGMA locking_mode = NORMAL")
+        for name, value in db.PRAGMAS:
+            conn.execute(f"PRAGMA {name} = {value}")
+
+
+def insert_in_batches(conn, sql, rows, batch_size=BULK_BATCH_SIZE):
+    """ Inserts an iterable of rows with executemany(), one transaction per batch. Returns the row count. """
+    total = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            conn.executemany(sql, batch)
+            conn.commit()
+            total += len(batch)
+            batch.clear()
+    if batch:
+        conn.executemany(sql, batch)
+        conn.commit()
+        total += len(batch)
+    return total
+
+
+def loading(conn, bulk: bool):
+    """ bulk_load() for --bulk; otherwise rows go in through ordinary transactions. """
+    return bulk_load(conn) if bulk else nullcontext(conn)
+
+
+def generate_fake_data(conn, num_projects, num_users, num_tasks, seed=None, batch_size=BULK_BATCH_SIZE,
+                       bulk=False):
+    """
+    Generates projects, users and tasks with Faker. The same seed always
+    produces the same data. Faker is slow per call, so titles and description
+    sentences are drawn from pools generated up front and recombined per task,
+    which keeps millions of rows cheap while still reading naturally.
+    """
+    if num_tasks and not num_projects:
+        raise ValueError("Fake tasks need at least one project.")
+    from faker import Faker  # Only needed to generate data, not to create the schema.
+    fake = Faker()
+    Faker.seed(seed)
+    rng = random.Random(seed)
+    print(f"Populating database with {num_projects} projects, {num_users} users, and {num_tasks} tasks (seed={seed})...")
+
+    with loading(conn, bulk):
+        # --- Populate Projects ---
+        project_names = list(PROJECT_NAMES)
+        rng.shuffle(project_names)
+        seen = set(project_names)
+        while len(project_names) < num_projects:
+            name = fake.bs().title()
+            if name in seen:
+                name = f"{name} {len(project_names)}"
+            seen.add(name)
+            project_names.append(name)
+        project_names = project_names[:num_projects]
+        conn.executemany("INSERT OR IGNORE INTO projects (name) VALUES (?)", [(name,) for name in project_names])
+        ids_by_name = {name: pid for pid, name in conn.execute("SELECT id, name FROM projects")}
+        project_ids = [ids_by_name[name] for name in project_names]
+
+        # --- Populate Users ---
+        first_names = [fake.first_name() for _ in range(min(num_users, 1000) or 1)]
+        last_names = [fake.last_name() for _ in range(min(num_users, 1000) or 1)]
+        users = []
+        for i in range(num_users):
+            first, last = rng.choice(first_names), rng.choice(last_names)
+            users.append((f"{first} {last}", f"{first}.{last}.{seed if seed is not None else 'x'}{i}@example.com".lower()))
+        conn.executemany("INSERT OR IGNORE INTO users (name, email) VALUES (?, ?)", users)
+        conn.commit()
+        ids_by_email = {email: uid for uid, email in conn.execute("SELECT id, email FROM users")}
+        user_ids = [ids_by_email[email] for _, email in users]
+
+        # --- Populate Tasks ---
+        titles = [fake.catch_phrase() for _ in range(min(num_tasks, TITLE_POOL_SIZE))]
+        descriptions = [fake.text(max_nb_chars=200) for _ in range(min(num_tasks, DESCRIPTION_POOL_SIZE))]
+        today = datetime.date.today()
+        # Make some tasks (about 70%) have a due date in the near future
+        due_dates = [(today + datetime.timedelta(days=day)).isoformat() for day in range(1, 61)]
+        due_dates += [None] * (len(due_dates) * 3 // 7)
+        assignees = user_ids + [None]  # Allow some tasks to be unassigned
+        choice = rng.choice
+
+        def task_rows():
+            for _ in range(num_tasks):
+                yield (choice(titles), choice(descriptions), choice(db.TASK_STATUSES), choice(db.TASK_PRIORITIES),
+                       choice(due_dates), choice(project_ids), choice(assignees))
+
+        inserted = insert_in_batches(conn, TASK_INSERT_SQL, task_rows(), batch_size)
+
+    print(f"Fake data population complete: {inserted} tasks.")
+
+
+def read_task_export(path):
+    """ Yields task dicts from a CSV (with a header row) or JSONL export. """
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.lower().endswith((".jsonl", ".ndjson")):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+
+def import_tasks(conn, path, batch_size=BULK_BATCH_SIZE, bulk=False):
+    """
+    Imports tasks from a CSV or JSONL export. Recognised fields: title,
+    description, status, priority, due_date, project (or project_name),
+    assignee (or assignee_name) and assignee_email. Unknown projects and users
+    are created; invalid statuses and priorities fall back to 'To Do'/'Medium'.
+    """
+    print(f"Importing tasks from {path}...")
+    project_ids = {name: pid for pid, name in conn.execute("SELECT id, name FROM projects")}
+    user_ids = {name: uid for uid, name in conn.execute("SELECT id, name FROM users")}
+
+    def lookup_or_create(cache, name, create):
+        if not name:
+            return None
+        if name not in cache:
+            cache[name] = create(name)
+        return cache[name]
+
+    def create_project(name):
+        return conn.execute("INSERT INTO projects (name) VALUES (?)", (name,)).lastrowid
+
+    def create_user(name, email=None):
+        email = email or f"{'.'.join(name.lower().split())}.{len(user_ids)}@imported.invalid"
+        cursor = conn.execute("INSERT OR IGNORE INTO users (name, email) VALUES (?, ?)", (name, email))
+        if cursor.rowcount:
+            return cursor.lastrowid
+        return conn.execute("SELECT id FROM users WHERE email = ?", (email,)).fetchone()[0]
+
+    def task_rows():
+        for record in read_task_export(path):
+            title = (record.get("title") or "").strip()
+            if not title:
+                continue
+            status = record.get("status") if record.get("status") in db.TASK_STATUSES else "To Do"
+            priority = record.get("priority") if record.get("priority") in db.TASK_PRIORITIES else "Medium"
+            project = (record.get("project") or record.get("project_name") or "").strip()
+            assignee = (record.get("assignee") or record.get("assignee_name") or "").strip()
+            email = (record.get("assignee_email") or "").strip() or None
+            yield (
+                title, record.get("description") or "", status, priority, record.get("due_date") or None,
+                lookup_or_create(project_ids, project, create_project),
+                lookup_or_create(user_ids, assignee, lambda name: create_user(name, email)),
+            )
+
+    with loading(conn, bulk):
+        inserted = insert_in_batches(conn, TASK_INSERT_SQL, task_rows(), batch_size)
+    print(f"Import complete: {inserted} tasks.")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Create the task database and fill it with fake or imported data.")
+    parser.add_argument("--db-file", default=DB_FILE)
+    parser.add_argument("--projects", type=int, default=NUM_FAKE_PROJECTS, help="Number of fake projects.")
+    parser.add_argument("--users", type=int, default=NUM_FAKE_USERS, help="Number of fake users.")
+    parser.add_argument("--tasks", type=int, default=NUM_FAKE_TASKS, help="Number of fake tasks.")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for reproducible fake data.")
+    parser.add_argument("--batch-size", type=int, default=BULK_BATCH_SIZE, help="Rows per insert batch.")
+    parser.add_argument("--import", dest="import_path", metavar="FILE",
+                        help="Import tasks from a CSV or JSONL export instead of generating fake ones.")
+    parser.add_argument("--fresh", action="store_true", help="Delete an existing database file first.")
+    parser.add_argument("--bulk", action="store_true",
+                        help="Load without a journal, indexes or triggers, rebuilding them afterwards. Much faster "
+                             "for large loads; needs the bot to be stopped.")
+    return parser.parse_args()
 
 
 def main():
     """Main function to orchestrate DB creation and population."""
-    conn = create_connection(DB_FILE)
+    args = parse_args()
+    if args.fresh:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.db_file + suffix):
+                os.remove(args.db_file + suffix)
+    conn = create_connection(args.db_file)
 
     if conn is not None:
+        started = time.perf_counter()
         # Set up the tables and triggers
         setup_database_schema(conn)
 
-        # Populate with fake data
-        populate_fake_data(conn)
+        if args.import_path:
+            import_tasks(conn, args.import_path, args.batch_size, args.bulk)
+        else:
+            generate_fake_data(conn, args.projects, args.users, args.tasks, args.seed, args.batch_size, args.bulk)
+        print(f"Database ready in {time.perf_counter() - started:.1f}s.")
 
         # Close the connection
         conn.close()
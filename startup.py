@@ -0,0 +1,81 @@
+# startup.py
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Readiness:
+    """
+    Tracks the start-up of independent components and records each one's
+    time-to-ready, so cold-start regressions show up in the logs.
+
+    A component is settled once it is either ready or has failed; the system is
+    ready when every registered component has settled. Failures are reported
+    but do not block readiness, so the bot can still answer in a degraded mode.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started_at = time.perf_counter()
+        self._components = {}
+        self._all_settled = threading.Event()
+
+    def register(self, name: str):
+        with self._lock:
+            self._components[name] = {"state": "starting", "seconds": None, "error": None}
+            self._all_settled.clear()
+
+    def mark_ready(self, name: str):
+        self._settle(name, "ready", None)
+
+    def mark_failed(self, name: str, error: Exception | str):
+        self._settle(name, "failed", str(error))
+
+    def _settle(self, name: str, state: str, error: str | None):
+        seconds = time.perf_counter() - self._started_at
+        with self._lock:
+            self._components[name] = {"state": state, "seconds": seconds, "error": error}
+            settled = all(c["state"] != "starting" for c in self._components.values())
+        if state == "ready":
+            logger.info("%s ready after %.2fs.", name, seconds)
+        else:
+            logger.error("%s FAILED after %.2fs: %s", name, seconds, error)
+        if settled:
+            self._all_settled.set()
+            logger.info("All components settled after %.2fs.", seconds)
+
+    def is_ready(self) -> bool:
+        return self._all_settled.is_set()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        return self._all_settled.wait(timeout)
+
+    def pending(self) -> list[str]:
+        with self._lock:
+            return [name for name, c in self._components.items() if c["state"] == "starting"]
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {name: dict(c) for name, c in self._components.items()}
+
+
+def start_component(readiness: Readiness, name: str, init_fn, *args) -> threading.Thread:
+    """
+    Runs `init_fn(*args)` on a background thread and records when it becomes
+    ready. Register every component before starting any of them, so the system
+    cannot look ready while later components are still unregistered.
+    """
+
+    def run():
+        try:
+            init_fn(*args)
+        except BaseException as e:
+            readiness.mark_failed(name, e)
+        else:
+            readiness.mark_ready(name)
+
+    thread = threading.Thread(target=run, name=f"startup-{name}", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,229 @@
+# streaming.py
+import asyncio
+import logging
+import time
+from collections import deque
+
+# --- CONFIGURATION ---
+DISCORD_MESSAGE_LIMIT = 2000  # Characters per Discord message.
+EDIT_INTERVAL_SECONDS = 1.2  # Minimum gap between edits; Discord allows about 5 edits per 5 s per channel.
+MAX_EDIT_INTERVAL_SECONDS = 10.0  # Upper bound for the back-off after being rate limited.
+PLACEHOLDER_TEXT = "_Thinking…_"
+EMPTY_ANSWER_TEXT = "Sorry, I don't have an answer to that."  # Replaces the placeholder if the answer is empty.
+FINAL_RENDER_ATTEMPTS = 3  # Edits of the streamed messages tried before the answer is sent as new messages.
+FINAL_ANSWER_MARKER = "Final Answer:"  # Must match the ReAct prompt in prompts.py.
+FIRST_TOKEN_SAMPLES = 1000  # Recent time-to-first-visible-token samples kept for statistics.
+
+logger = logging.getLogger(__name__)
+_first_token_seconds = deque(maxlen=FIRST_TOKEN_SAMPLES)
+
+
+def split_message(text: str, limit: int = DISCORD_MESSAGE_LIMIT) -> list[str]:
+    """
+    Splits text into chunks of at most `limit` characters, preferring to break
+    at a newline, then at a space, so words and lines are not cut in half.
+    """
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit + 1)
+        if cut <= 0:
+            cut = text.rfind(" ", 0, limit + 1)
+        if cut <= 0:
+            chunks.append(text[:limit])
+            text = text[limit:]
+        else:
+            chunks.append(text[:cut])
+            text = text[cut + 1:]
+    chunks.append(text)
+    return chunks
+
+
+class FinalAnswerExtractor:
+    """
+    Picks the user-visible answer out of a ReAct completion as it streams in.
+
+    The LLM's intermediate steps (Thought/Action/Observation) must not be shown,
+    so tokens are only passed on once the current completion has produced the
+    "Final Answer:" marker. Call reset() at the start of every LLM call.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._raw = ""
+        self._emitted = 0
+        self._answer_start = None
+
+    def feed(self, token: str) -> str:
+        """ Adds a token and returns the newly visible part of the answer (may be empty). """
+        self._raw += token
+        if self._answer_start is None:
+            index = self._raw.find(FINAL_ANSWER_MARKER)
+            if index < 0:
+                return ""
+            self._answer_start = index + len(FINAL_ANSWER_MARKER)
+        answer = self._raw[self._answer_start:].lstrip()
+        delta = answer[self._emitted:]
+        self._emitted = len(answer)
+        return delta
+
+
+def final_answer_callback(on_token):
+    """
+    Returns a LangChain callback handler that calls `on_token(text)` with each
+    new piece of the agent's final answer. LangChain is imported here so that
+    importing this module stays cheap.
+    """
+    from langchain_core.callbacks import AsyncCallbackHandler
+
+    class FinalAnswerCallback(AsyncCallbackHandler):
+        def __init__(self):
+            self.extractor = FinalAnswerExtractor()
+
+        async def on_chat_model_start(self, *args, **kwargs):
+            self.extractor.reset()
+
+        async def on_llm_start(self, *args, **kwargs):
+            self.extractor.reset()
+
+        async def on_llm_new_token(self, token: str, **kwargs):
+            delta = self.extractor.feed(token)
+            if delta:
+                on_token(delta)
+
+    return FinalAnswerCallback()
+
+
+class DiscordStreamer:
+    """
+    Shows an answer in Discord while it is being generated.
+
+    start() posts a placeholder message; feed() appends text, and a background
+    task edits the message at most once per edit interval. If Discord rate
+    limits an edit the interval is doubled (up to MAX_EDIT_INTERVAL_SECONDS).
+    Text beyond Discord's 2000-character limit continues in follow-up messages.
+    finish() replaces the streamed text with the authoritative final answer;
+    if the messages cannot be edited it sends the answer as new messages, so
+    a failed edit never loses the answer.
+    """
+
+    def __init__(self, channel, started_at: float | None = None):
+        self.channel = channel
+        self.started_at = started_at if started_at is not None else time.perf_counter()
+        self.first_token_seconds = None
+        self.interval = EDIT_INTERVAL_SECONDS
+        self._text = ""
+        self._messages = []  # Discord messages, one per chunk.
+        self._shown = []  # What each message currently displays.
+        self._dirty = asyncio.Event()
+        self._flusher = None
+        self._render_lock = asyncio.Lock()
+
+    async def start(self):
+        message = await self.channel.send(PLACEHOLDER_TEXT)
+        self._messages.append(message)
+        self._shown.append(PLACEHOLDER_TEXT)
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    def feed(self, delta: str):
+        self._text += delta
+        self._dirty.set()
+
+    async def _flush_loop(self):
+        import discord
+
+        while True:
+            await self._dirty.wait()
+            self._dirty.clear()
+            try:
+                await self._render(self._text, streaming=True)
+            except discord.HTTPException as e:
+                # A failed progress update is not fatal; the next one or finish() catches up.
+                logger.warning("Could not update the streamed answer: %s", e)
+            await asyncio.sleep(self.interval)
+
+    async def _render(self, text: str, streaming: bool) -> bool:
+        """ Brings the messages up to date with `text`; returns False if rate limited. """
+        import discord
+
+        if not text.strip():
+            return True
+        async with self._render_lock:
+            # Leave room for the cursor shown while the answer is still being written.
+            chunks = split_message(text, DISCORD_MESSAGE_LIMIT - 2 if streaming else DISCORD_MESSAGE_LIMIT)
+            for i, chunk in enumerate(chunks):
+                if streaming and i == len(chunks) - 1:
+                    chunk += " ▌"
+                try:
+                    if i < len(self._messages):
+                        if self._shown[i] != chunk:
+                            await self._messages[i].edit(content=chunk)
+                    else:
+                        self._messages.append(await self.channel.send(chunk))
+                        self._shown.append(chunk)
+                    self._shown[i] = chunk
+                except discord.HTTPException as e:
+                    if e.status != 429:
+                        raise
+                    # discord.py already waited out the limit; edit less often from now on.
+                    self.interval = min(self.interval * 2, MAX_EDIT_INTERVAL_SECONDS)
+                    return False
+            if self.first_token_seconds is None:
+                self.first_token_seconds = time.perf_counter() - self.started_at
+                _first_token_seconds.append(self.first_token_seconds)
+                logger.info("First visible token after %.2fs.", self.first_token_seconds)
+            return True
+
+    async def finish(self, final_text: str):
+        """ Stops streaming and shows `final_text` in full. """
+        if self._flusher:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                logger.warning("Streaming stopped early: %s", e)
+        if not final_text.strip():
+            final_text = EMPTY_ANSWER_TEXT
+        shown = False
+        for _ in range(FINAL_RENDER_ATTEMPTS):
+            try:
+                shown = await self._render(final_text, streaming=False)
+            except Exception as e:
+                logger.warning("Could not edit in the final answer: %s", e)
+                break
+            if shown:
+                break
+            await asyncio.sleep(self.interval)
+        if not shown:
+            # Replace the partial, streamed messages with fresh ones holding the whole answer.
+            await self._delete(self._messages)
+            self._messages, self._shown = [], []
+            for chunk in split_message(final_text):
+                self._messages.append(await self.channel.send(chunk))
+                self._shown.append(chunk)
+            return
+        # Remove follow-up messages the final answer no longer needs.
+        keep = len(split_message(final_text))
+        await self._delete(self._messages[keep:])
+        del self._messages[keep:], self._shown[keep:]
+
+    @staticmethod
+    async def _delete(messages: list):
+        for message in messages:
+            try:
+                await message.delete()
+            except Exception as e:
+                logger.warning("Could not delete a streamed message: %s", e)
+
+
+def stream_stats() -> dict:
+    """ Time-to-first-visible-token percentiles (seconds) over recent streamed answers. """
+    samples = sorted(_first_token_seconds)
+
+    def percentile(p):
+        return samples[min(len(samples) - 1, int(p * len(samples)))] if samples else 0.0
+
+    return {"streamed_answers": len(samples), "first_token_p50": percentile(0.50), "first_token_p95": percentile(0.95)}
@@ -0,0 +1,347 @@
+# telemetry.py
+import contextvars
+import functools
+import itertools
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Empty
+
+# --- CONFIGURATION ---
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = "%(asctime)s %(levelname)s [%(name)s] %(message)s"
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))  # 0 disables the endpoint.
+METRICS_PUSH_SECONDS = 5  # How often a child process sends its metrics to the main process.
+SLOW_TURN_SECONDS = 20.0  # Root spans slower than this log a per-stage breakdown.
+# Histogram buckets: seconds for durations, counts for sizes (rows, documents, tokens).
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000)
+
+logger = logging.getLogger(__name__)
+
+
+def configure_logging(level: str = LOG_LEVEL):
+    """ Sets up the root logger once per process (the memory worker calls this too). """
+    logging.basicConfig(level=level, format=LOG_FORMAT)
+
+
+# --- METRICS ---
+def _label_text(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (f'{key}="{str(value)}"'.replace("\n", " ") for key, value in labels)
+    return "{" + ",".join(escaped) + "}"
+
+
+def _metric_name(text: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_]", "_", text)
+
+
+def _flatten(values: dict, prefix: str = "") -> dict:
+    """ Numeric leaves of a nested stats dict, keyed by their joined path. """
+    flat = {}
+    for key, value in values.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}_"))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+class MetricsRegistry:
+    """
+    Counters and histograms in the Prometheus text format.
+
+    Each metric is keyed by name and a sorted tuple of label pairs. Other
+    processes send snapshots of their own registry (see MetricsPusher); the
+    latest snapshot per process is rendered alongside the local metrics with a
+    `process` label, so the counters stay cumulative without double counting.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}  # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+        self._buckets = {}  # name -> bucket bounds
+        self._help = {}
+        self._remote = {}  # process name -> snapshot
+        self._collectors = {}  # prefix -> callable returning a (nested) dict of numbers
+
+    def inc(self, name: str, value: float = 1, help: str = "", **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+            self._help.setdefault(name, help)
+
+    def observe(self, name: str, value: float, buckets=DURATION_BUCKETS, help: str = "", **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            bounds = self._buckets.setdefault(name, tuple(buckets))
+            entry = self._histograms.get(key)
+            if entry is None:
+                entry = self._histograms[key] = [0] * (len(bounds) + 2)
+            for i, bound in enumerate(bounds):
+                if value <= bound:
+                    entry[i] += 1
+            entry[-2] += value
+            entry[-1] += 1
+            self._help.setdefault(name, help)
+
+    def snapshot(self) -> dict:
+        """ A picklable copy of the local metrics, for sending to another process. """
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "histograms": {key: list(entry) for key, entry in self._histograms.items()},
+                "buckets": dict(self._buckets),
+                "help": dict(self._help),
+            }
+
+    def add_collector(self, prefix: str, fn):
+        """ Registers a stats() method whose numeric values are read as gauges at scrape time. """
+        with self._lock:
+            self._collectors[prefix] = fn
+
+    def merge_remote(self, process: str, snapshot: dict):
+        with self._lock:
+            self._remote[process] = snapshot
+
+    def render(self) -> str:
+        """ Returns every metric in the Prometheus text exposition format. """
+        local = self.snapshot()
+        with self._lock:
+            sources = [(None, local)] + list(self._remote.items())
+            collectors = list(self._collectors.items())
+        counters, histograms, buckets, helps = {}, {}, {}, {}
+        for process, snap in sources:
+            extra = (("process", process),) if process else ()
+            for (name, labels), value in snap["counters"].items():
+                counters.setdefault(name, []).append((tuple(sorted(labels + extra)), value))
+            for (name, labels), entry in snap["histograms"].items():
+                histograms.setdefault(name, []).append((tuple(sorted(labels + extra)), entry))
+            buckets.update(snap["buckets"])
+            for name, text in snap["help"].items():
+                helps.setdefault(name, text)
+
+        lines = []
+        for prefix, fn in collectors:
+            try:
+                values = _flatten(fn())
+            except Exception as e:
+                logger.debug("Collector %s failed: %s", prefix, e)
+                continue
+            for key, value in sorted(values.items()):
+                name = _metric_name(f"crucible_{prefix}_{key}")
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {value}")
+        for name, series in sorted(counters.items()):
+            lines.append(f"# HELP {name} {helps.get(name) or name}")
+            lines.append(f"# TYPE {name} counter")
+            lines.extend(f"{name}{_label_text(labels)} {value}" for labels, value in series)
+        for name, series in sorted(histograms.items()):
+            lines.append(f"# HELP {name} {helps.get(name) or name}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, entry in series:
+                for bound, count in zip(buckets[name], entry):
+                    lines.append(f"{name}_bucket{_label_text(labels + (('le', bound),))} {count}")
+                lines.append(f"{name}_bucket{_label_text(labels + (('le', '+Inf'),))} {entry[-1]}")
+                lines.append(f"{name}_sum{_label_text(labels)} {entry[-2]}")
+                lines.append(f"{name}_count{_label_text(labels)} {entry[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+# --- TRACING ---
+_trace_ids = itertools.count(1)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """ One timed stage. Sizes set with set() are recorded as histograms next to the duration. """
+
+    def __init__(self, name: str, parent: "Span | None", attributes: dict):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent else next(_trace_ids)
+        self.root = parent.root if parent else self
+        self.attributes = dict(attributes)
+        self.children = []  # Finished descendants, collected on the root only.
+        self.duration = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Times a stage and records `crucible_span_seconds{span=name}`. Numeric
+    attributes (rows, documents, tokens, ...) become `crucible_span_size`
+    histograms. Spans nest through a contextvar, so each stage of a turn shares
+    the turn's trace id; a root span slower than SLOW_TURN_SECONDS logs where
+    its time went.
+    """
+    parent = _current_span.get()
+    current = Span(name, parent, attributes)
+    token = _current_span.set(current)
+    start = time.perf_counter()
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        current.duration = time.perf_counter() - start
+        _current_span.reset(token)
+        metrics.observe("crucible_span_seconds", current.duration, help="Duration of each traced stage.", span=name)
+        if error:
+            metrics.inc("crucible_span_errors_total", help="Traced stages that raised.", span=name, error=error)
+        for key, value in current.attributes.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                metrics.observe("crucible_span_size", value, buckets=SIZE_BUCKETS,
+                                help="Sizes (rows, documents, tokens) handled by each stage.", span=name, unit=key)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("trace=%s span=%s %.1fms %s", current.trace_id, name, current.duration * 1000, current.attributes)
+        if parent is not None:
+            current.root.children.append(current)
+        elif current.duration > SLOW_TURN_SECONDS and current.children:
+            breakdown = ", ".join(f"{child.name}={child.duration:.2f}s" for child in current.children)
+            logger.info("Slow %s (trace %s) took %.2fs: %s", name, current.trace_id, current.duration, breakdown)
+
+
+def traced(name: str):
+    """ Decorator form of span() for functions such as agent tools. """
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def llm_span_callback():
+    """
+    Returns a LangChain callback handler that records every LLM call as an
+    `llm.call` span (duration, prompt and completion tokens) in the current trace.
+    """
+    from langchain_core.callbacks import BaseCallbackHandler
+    from prompt_budget import count_tokens
+
+    class LLMSpanCallback(BaseCallbackHandler):
+        def __init__(self):
+            self._started = {}
+
+        def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+            prompt_tokens = sum(count_tokens(str(message.content)) for batch in messages for message in batch)
+            self._started[run_id] = (time.perf_counter(), prompt_tokens)
+
+        def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+            self._started[run_id] = (time.perf_counter(), sum(count_tokens(prompt) for prompt in prompts))
+
+        def on_llm_end(self, response, *, run_id, **kwargs):
+            started = self._started.pop(run_id, None)
+            if started is None:
+                return
+            completion = "".join(gen.text for generations in response.generations for gen in generations)
+            record_span("llm.call", time.perf_counter() - started[0],
+                        prompt_tokens=started[1], completion_tokens=count_tokens(completion))
+
+        def on_llm_error(self, error, *, run_id, **kwargs):
+            started = self._started.pop(run_id, None)
+            if started is not None:
+                metrics.inc("crucible_span_errors_total", span="llm.call", error=type(error).__name__)
+
+    return LLMSpanCallback()
+
+
+def record_span(name: str, duration: float, **attributes):
+    """ Records an already-measured stage (e.g. from callbacks) as if it had been a span. """
+    metrics.observe("crucible_span_seconds", duration, span=name)
+    for key, value in attributes.items():
+        metrics.observe("crucible_span_size", value, buckets=SIZE_BUCKETS, span=name, unit=key)
+    parent = _current_span.get()
+    if parent is not None:
+        finished = Span(name, parent, attributes)
+        finished.duration = duration
+        parent.root.children.append(finished)
+
+
+# --- CROSS-PROCESS ---
+class MetricsPusher:
+    """ Sends this process's metrics snapshot over a multiprocessing queue every few seconds. """
+
+    def __init__(self, queue, process: str, interval: float = METRICS_PUSH_SECONDS):
+        self.queue = queue
+        self.process = process
+        self.interval = interval
+        self._last_push = 0.0
+
+    def maybe_push(self, force: bool = False):
+        now = time.monotonic()
+        if self.queue is None or (not force and now - self._last_push < self.interval):
+            return
+        self._last_push = now
+        try:
+            self.queue.put_nowait((self.process, metrics.snapshot()))
+        except Exception as e:
+            logger.debug("Could not push metrics: %s", e)
+
+
+def start_metrics_collector(queue) -> threading.Thread:
+    """ Merges snapshots sent by child processes into this process's registry, on a daemon thread. """
+
+    def run():
+        while True:
+            try:
+                process, snapshot = queue.get(timeout=1)
+            except Empty:
+                continue
+            except (EOFError, OSError):
+                return
+            metrics.merge_remote(process, snapshot)
+
+    thread = threading.Thread(target=run, name="metrics-collector", daemon=True)
+    thread.start()
+    return thread
+
+
+def start_metrics_server(port: int = METRICS_PORT, host: str = METRICS_HOST):
+    """ Serves GET /metrics in the Prometheus text format on a daemon thread. Returns the server, or None if disabled. """
+    if not port:
+        return None
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    try:
+        server = ThreadingHTTPServer((host, port), Handler)
+    except OSError as e:
+        logger.warning("Metrics endpoint not started on %s:%s: %s", host, port, e)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info("Serving metrics on http://%s:%s/metrics", host, port)
+    return server
@@ -0,0 +1,92 @@
+# conftest.py
+import hashlib
+import os
+import sys
+import types
+
+import numpy as np
+import pytest
+
+# The modules under test are flat scripts at the repository root.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import langchain_core.documents  # noqa: F401
+except ImportError:
+    # The modules under test only need LangChain's Document; a stand-in keeps
+    # the suite runnable where LangChain is not installed.
+    class Document:
+        def __init__(self, page_content: str = "", metadata: dict | None = None, **kwargs):
+            self.page_content = page_content
+            self.metadata = metadata or {}
+
+        def __repr__(self):
+            return f"Document(page_content={self.page_content!r}, metadata={self.metadata!r})"
+
+    documents = types.ModuleType("langchain_core.documents")
+    documents.Document = Document
+    langchain_core = sys.modules.setdefault("langchain_core", types.ModuleType("langchain_core"))
+    langchain_core.documents = documents
+    sys.modules["langchain_core.documents"] = documents
+
+try:
+    import discord  # noqa: F401
+except ImportError:
+    # streaming.py only needs discord.HTTPException; mirror its (response, message) signature.
+    class HTTPException(Exception):
+        def __init__(self, response, message=None):
+            self.response = response
+            self.status = response.status
+            super().__init__(f"{response.status} {response.reason}: {message}")
+
+    discord = types.ModuleType("discord")
+    discord.HTTPException = HTTPException
+    sys.modules["discord"] = discord
+
+import db  # noqa: E402
+import setup_db  # noqa: E402
+from conversation import SQL_CREATE_CONVERSATIONS  # noqa: E402
+
+DIMENSIONS = 16
+
+
+class FakeEmbeddings:
+    """ Deterministic unit vectors derived from the text, so a document's own text finds it. """
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        vectors = []
+        for text in texts:
+            seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:4], "little")
+            vector = np.random.default_rng(seed).standard_normal(DIMENSIONS)
+            vectors.append((vector / np.linalg.norm(vector)).tolist())
+        return vectors
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+
+@pytest.fixture(autouse=True)
+def _close_pools():
+    yield
+    db.close_pools()
+
+
+@pytest.fixture
+def embeddings():
+    return FakeEmbeddings()
+
+
+@pytest.fixture
+def task_db(tmp_path) -> str:
+    """ An empty task database with setup_db's schema: tables, indexes, FTS and change-log triggers. """
+    path = str(tmp_path / "project_tasks.db")
+    conn = db.create_connection(path)
+    setup_db.setup_database_schema(conn)
+    conn.execute(SQL_CREATE_CONVERSATIONS)
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def pool(task_db) -> db.ConnectionPool:
+    return db.get_pool(task_db)
@@ -0,0 +1,118 @@
+import hashlib
+import re
+
+import numpy as np
+import pytest
+
+from answer_cache import SemanticAnswerCache, is_cacheable_query
+
+DIMENSIONS = 64
+
+
+def bag_of_words(text: str, ignored: frozenset = frozenset()) -> list[float]:
+    """ Word-count embedding: questions with the same words in any order or case are identical. """
+    vector = np.zeros(DIMENSIONS)
+    for word in re.findall(r"[a-z]+", text.lower()):
+        if word not in ignored:
+            vector[int(hashlib.sha1(word.encode()).hexdigest(), 16) % DIMENSIONS] += 1
+    return vector.tolist()
+
+
+def blind_to(*words):
+    """ An embedder that cannot tell the given words apart, like a real model with near-synonyms. """
+    return lambda text: bag_of_words(text, frozenset(words))
+
+
+@pytest.fixture
+def version():
+    return [1]
+
+
+@pytest.fixture
+def cache(tmp_path, version):
+    return SemanticAnswerCache(bag_of_words, lambda: version[0], db_file=str(tmp_path / "answers.db"))
+
+
+def test_reuses_answer_for_same_question(cache):
+    cache.store("Which tasks are overdue?", "Three tasks are overdue.", 1)
+
+    assert cache.lookup("which tasks are OVERDUE") == "Three tasks are overdue."
+    assert cache.lookup("Which projects are overdue?") is None
+    assert cache.stats()["hits"] == 1
+
+
+@pytest.mark.parametrize("stored, asked", [
+    ("Who owns task 12?", "Who owns task 13?"),
+    ("Which high priority tasks are overdue?", "Which low priority tasks are overdue?"),
+    ("Which tasks are due in March?", "Which tasks are due in April?"),
+    ("How many tasks does Alice have?", "How many tasks does Bob have?"),
+])
+def test_near_misses_with_different_key_terms_are_not_reused(tmp_path, version, stored, asked):
+    cache = SemanticAnswerCache(blind_to("high", "low", "march", "april", "alice", "bob"), lambda: version[0],
+                                db_file=str(tmp_path / "answers.db"), names_fn=lambda: ["Alice Smith", "Bob Jones"])
+    cache.store(stored, "Cached answer.", 1)
+
+    assert cache.lookup(asked) is None
+    assert cache.lookup(stored) == "Cached answer."
+    assert cache.stats()["mismatched"] == 1
+
+
+def test_same_key_terms_in_other_words_are_reused(tmp_path, version):
+    cache = SemanticAnswerCache(blind_to("who", "whose", "is", "owns", "owner", "the", "of"), lambda: version[0],
+                                db_file=str(tmp_path / "answers.db"), names_fn=lambda: ["Alice Smith"])
+    cache.store("Who owns task 12 in Alice's project?", "Alice Smith.", 1)
+
+    assert cache.lookup("Whose is task 12 in alice's project") == "Alice Smith."
+
+
+def test_answers_from_an_older_data_version_are_dropped(cache, version):
+    cache.store("Which tasks are overdue?", "Three tasks are overdue.", 1)
+    version[0] = 2
+
+    assert cache.lookup("Which tasks are overdue?") is None
+    assert cache.stats()["stale"] == 1 and cache.stats()["size"] == 0
+
+
+@pytest.mark.parametrize("query", [
+    "What are my open tasks?",
+    "Which tasks are assigned to me?",
+    "what do I have due this week",
+    "show our team's overdue tasks",
+])
+def test_first_person_questions_are_not_cached(cache, query):
+    assert not is_cacheable_query(query)
+    cache.store(query, "Your tasks: ...", 1)
+
+    assert cache.lookup(query) is None
+    assert cache.stats()["size"] == 0
+
+
+@pytest.mark.parametrize("query", ["Add a task for Bob", "What about that one?"])
+def test_writes_and_follow_ups_are_not_cached(query):
+    assert not is_cacheable_query(query)
+
+
+def test_turns_that_used_a_write_tool_are_not_cached(cache):
+    cache.store("Which tasks are overdue?", "Done.", 1, tools_used=["AddTask"])
+
+    assert cache.stats()["size"] == 0
+
+
+def test_persists_across_instances(tmp_path, cache, version):
+    cache.store("Which tasks are overdue?", "Three tasks are overdue.", 1)
+    reopened = SemanticAnswerCache(bag_of_words, lambda: version[0], db_file=cache.db_file)
+
+    assert reopened.lookup("Which tasks are overdue?") == "Three tasks are overdue."
+
+
+def test_entries_from_another_embedding_model_are_dropped(tmp_path, version):
+    model = ["all-MiniLM-L6-v2"]
+    cache = SemanticAnswerCache(bag_of_words, lambda: version[0], db_file=str(tmp_path / "answers.db"),
+                                model_fn=lambda: model[0])
+    cache.store("Which tasks are overdue?", "Three tasks are overdue.", 1)
+    assert cache.lookup("Which tasks are overdue?") == "Three tasks are overdue."
+
+    model[0] = "all-mpnet-base-v2"  # A re-index switched models; the vectors have the same size.
+
+    assert cache.lookup("Which tasks are overdue?") is None
+    assert cache.stats()["size"] == 0
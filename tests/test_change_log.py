@@ -0,0 +1,147 @@
+import pytest
+
+import db
+import memory_manager
+from memory_manager import CollectionSwitched, apply_pending_changes, initial_sync, read_changes
+from vector_index import DEFAULT_COLLECTION, NumpyVectorStore, set_active_collection
+
+
+@pytest.fixture
+def store(tmp_path, embeddings):
+    return NumpyVectorStore(str(tmp_path / "index"), embeddings)
+
+
+@pytest.fixture
+def tasks(pool):
+    """ Two projects, two users and four tasks; returns the IDs by title. """
+    with pool.transaction() as conn:
+        conn.execute("INSERT INTO projects (name) VALUES ('Website'), ('Mobile App')")
+        conn.execute("INSERT INTO users (name, email) VALUES ('Alice', 'alice@example.com'), "
+                     "('Bob', 'bob@example.com')")
+        conn.executemany(
+            "INSERT INTO tasks (title, status, priority, due_date, project_id, assignee_id) VALUES (?, ?, ?, ?, ?, ?)",
+            [("Landing page", "To Do", "High", "2025-01-10", 1, 1),
+             ("Pricing page", "In Progress", "Medium", "2025-01-20", 1, 2),
+             ("Login screen", "To Do", "Low", None, 2, 1),
+             ("Push alerts", "Done", "Low", "2025-02-01", 2, 2)])
+        return {row["title"]: row["id"] for row in conn.execute("SELECT id, title FROM tasks")}
+
+
+def logged_changes(pool, after_seq: int = 0) -> list[tuple[int, str]]:
+    with pool.connection() as conn:
+        return [(row["task_id"], row["action"]) for row in conn.execute(db.SQL_CHANGES_AFTER, (after_seq, 1000))]
+
+
+def max_seq(pool) -> int:
+    with pool.connection() as conn:
+        return conn.execute(db.SQL_MAX_CHANGE_SEQ).fetchone()[0]
+
+
+def stored(store, task_id: int) -> dict | None:
+    result = store.get(ids=[str(task_id)])
+    return result["metadatas"][0] if result["ids"] else None
+
+
+def test_triggers_log_task_writes(pool, tasks):
+    seq = max_seq(pool)
+    with pool.transaction() as conn:
+        conn.execute("UPDATE tasks SET status = 'Done' WHERE id = ?", (tasks["Landing page"],))
+        conn.execute("DELETE FROM tasks WHERE id = ?", (tasks["Push alerts"],))
+
+    assert logged_changes(pool, seq) == [(tasks["Landing page"], "upsert"), (tasks["Push alerts"], "delete")]
+
+
+def test_renames_fan_out_to_affected_tasks(pool, tasks):
+    seq = max_seq(pool)
+    with pool.transaction() as conn:
+        conn.execute("UPDATE projects SET name = 'Website 2.0' WHERE id = 1")
+        conn.execute("UPDATE users SET name = 'Robert' WHERE id = 2")
+        conn.execute("UPDATE users SET name = 'Alice' WHERE id = 1")  # Unchanged name: not logged.
+
+    changes = logged_changes(pool, seq)
+    assert sorted(changes[:2]) == [(tasks["Landing page"], "upsert"), (tasks["Pricing page"], "upsert")]
+    assert sorted(changes[2:]) == [(tasks["Pricing page"], "upsert"), (tasks["Push alerts"], "upsert")]
+
+
+def test_read_changes_keeps_last_action_per_task(pool, tasks):
+    seq = max_seq(pool)
+    with pool.transaction() as conn:
+        conn.execute("UPDATE tasks SET priority = 'High' WHERE id = ?", (tasks["Login screen"],))
+        conn.execute("DELETE FROM tasks WHERE id = ?", (tasks["Login screen"],))
+        conn.execute("UPDATE tasks SET priority = 'High' WHERE id = ?", (tasks["Pricing page"],))
+        conn.execute(db.SQL_LOG_RESYNC)
+
+    with pool.connection() as conn:
+        actions, last_seq, count, oldest = read_changes(conn, seq)
+    assert actions == {tasks["Login screen"]: "delete", tasks["Pricing page"]: "upsert"}
+    assert (last_seq, count) == (seq + 4, 4)
+    assert oldest is not None
+
+
+def test_initial_sync_then_apply_renames_and_deletes(pool, store, tasks):
+    seq = initial_sync(pool, store)
+    assert store.count() == 4
+    # The sync itself is logged, so the data version moves past answers cached before it.
+    assert logged_changes(pool, seq) == [(0, "resync")]
+
+    with pool.transaction() as conn:
+        conn.execute("UPDATE projects SET name = 'Website 2.0' WHERE id = 1")
+        conn.execute("UPDATE users SET name = 'Robert' WHERE id = 2")
+        conn.execute("DELETE FROM tasks WHERE id = ?", (tasks["Login screen"],))
+        conn.execute("INSERT INTO tasks (title, status, priority, project_id, assignee_id) "
+                     "VALUES ('Dark mode', 'To Do', 'Medium', 2, 1)")
+    applied = apply_pending_changes(pool, store, seq, batch_size=2)
+
+    assert applied == max_seq(pool)
+    assert store.count() == 4
+    assert stored(store, tasks["Login screen"]) is None
+    assert stored(store, tasks["Landing page"])["project"] == "Website 2.0"
+    assert stored(store, tasks["Pricing page"])["project"] == "Website 2.0"
+    assert stored(store, tasks["Pricing page"])["assignee"] == "Robert"
+    assert stored(store, tasks["Push alerts"])["assignee"] == "Robert"
+    assert stored(store, tasks["Landing page"])["assignee"] == "Alice"
+    with pool.connection() as conn:
+        new_id = conn.execute("SELECT id FROM tasks WHERE title = 'Dark mode'").fetchone()[0]
+        assert int(db.get_meta(conn, db.META_APPLIED_CHANGE_SEQ)) == applied
+    assert "Dark mode" in store.get(ids=[str(new_id)])["documents"][0]
+
+    # The checkpoint is where a restarted worker resumes.
+    assert initial_sync(pool, store) == applied
+    assert apply_pending_changes(pool, store, applied) == applied
+
+
+def test_upsert_of_a_task_deleted_since_removes_it(pool, store, tasks):
+    seq = initial_sync(pool, store)
+    with pool.transaction() as conn:
+        conn.execute("UPDATE tasks SET status = 'Done' WHERE id = ?", (tasks["Landing page"],))
+    with pool.transaction() as conn:
+        # Logged after the upsert, but applied in one batch with it.
+        conn.execute("DELETE FROM tasks WHERE id = ?", (tasks["Landing page"],))
+    apply_pending_changes(pool, store, seq)
+
+    assert stored(store, tasks["Landing page"]) is None
+
+
+def test_applied_changes_are_pruned_beyond_retention(monkeypatch, pool, store, tasks):
+    monkeypatch.setattr(memory_manager, "CHANGE_LOG_RETENTION", 2)
+    seq = initial_sync(pool, store)
+    with pool.transaction() as conn:
+        for priority in ("High", "Low", "Medium", "High"):
+            conn.execute("UPDATE tasks SET priority = ? WHERE id = ?", (priority, tasks["Login screen"]))
+    applied = apply_pending_changes(pool, store, seq)
+
+    with pool.connection() as conn:
+        remaining = [row[0] for row in conn.execute("SELECT seq FROM task_changes ORDER BY seq")]
+    assert remaining == [applied - 1, applied]
+
+
+def test_switched_collection_stops_the_worker(pool, store, tasks):
+    seq = initial_sync(pool, store)
+    with pool.transaction() as conn:
+        conn.execute("UPDATE tasks SET status = 'Done' WHERE id = ?", (tasks["Landing page"],))
+        set_active_collection(conn, "tasks_new", "all-MiniLM-L6-v2")
+
+    with pytest.raises(CollectionSwitched):
+        apply_pending_changes(pool, store, seq, collection=DEFAULT_COLLECTION)
+    with pool.connection() as conn:
+        assert int(db.get_meta(conn, db.META_APPLIED_CHANGE_SEQ)) == seq
@@ -0,0 +1,117 @@
+import time
+
+import pytest
+
+import conversation
+from conversation import ConversationMemory, ConversationStore
+from prompt_budget import count_tokens
+
+
+@pytest.fixture(autouse=True)
+def no_llm_summarizer():
+    conversation.set_summarizer(None)
+    yield
+    conversation.set_summarizer(None)
+
+
+def chat(memory: ConversationMemory, turns: int, start: int = 0):
+    for n in range(start, start + turns):
+        memory.save_context({"input": f"question {n}"}, {"output": f"answer {n}"})
+
+
+def wait_for_summary(memory: ConversationMemory, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while len(memory.turns) > memory.recent_turns or memory._summarizing:
+        assert time.monotonic() < deadline, "the background summary did not finish"
+        time.sleep(0.01)
+
+
+def test_older_turns_are_folded_into_the_summary():
+    memory = ConversationMemory(recent_turns=2)
+    chat(memory, 5)
+    wait_for_summary(memory)
+
+    assert memory.turns == [("question 3", "answer 3"), ("question 4", "answer 4")]
+    assert "question 0" in memory.summary and "question 2" in memory.summary
+    history = memory.load_memory_variables()["chat_history"]
+    assert history.startswith("Summary of the earlier conversation: ")
+    assert history.endswith("Human: question 4\nAI: answer 4")
+
+
+def test_llm_summary_is_used_and_failures_fall_back_to_an_extract():
+    conversation.set_summarizer(lambda previous, turns: f"{len(turns)} earlier exchanges")
+    memory = ConversationMemory(recent_turns=1)
+    chat(memory, 3)
+    wait_for_summary(memory)
+    assert memory.summary.endswith("earlier exchanges")
+
+    def failing(previous, turns):
+        raise RuntimeError("LLM down")
+
+    conversation.set_summarizer(failing)
+    chat(memory, 1, start=3)
+    wait_for_summary(memory)
+    assert "User asked: question 2" in memory.summary
+
+
+def test_history_stays_within_the_token_budget():
+    memory = ConversationMemory(recent_turns=10, token_budget=60)
+    for n in range(6):
+        memory.save_context({"input": f"question {n} " + "detail " * 20}, {"output": f"answer {n} " * 20})
+
+    history = memory.render()
+    assert count_tokens(history) <= 60 + 2  # Allows for the ellipsis on the shortened latest exchange.
+    assert history.rstrip().endswith("answer 5")  # The latest exchange is always kept, cut from the front.
+    assert "answer 4" not in history
+
+
+def test_serialisation_round_trip():
+    memory = ConversationMemory()
+    memory.summary = "Earlier: asked about Website tasks."
+    chat(memory, 2)
+
+    restored = ConversationMemory.loads(memory.dumps())
+    assert restored.summary == memory.summary and restored.turns == memory.turns
+
+
+def test_store_writes_through_and_reloads(task_db):
+    store = ConversationStore(task_db)
+    memory = store.get(1)
+    chat(memory, 1)
+    store.save(1, memory)
+    store.save(1, memory)  # Unchanged, so not written again.
+
+    reloaded = ConversationStore(task_db).get(1)
+    assert reloaded.turns == [("question 0", "answer 0")]
+    assert store.stats()["saved"] == 1 and store.stats()["created"] == 1
+
+
+def test_least_recently_used_conversations_are_saved_and_evicted(task_db):
+    store = ConversationStore(task_db, max_resident=2)
+    for user_id in (1, 2):
+        chat(store.get(user_id), 1, start=user_id)
+    store.get(1)  # User 2 is now the least recently used.
+    store.get(3)
+
+    assert len(store) == 2
+    assert store.stats()["evicted"] == 1
+    assert store.get(2).turns == [("question 2", "answer 2")]  # Loaded back from SQLite.
+    assert store.stats()["loaded"] == 1
+
+
+def test_idle_conversations_are_evicted(task_db):
+    store = ConversationStore(task_db, idle_ttl=0.0)
+    chat(store.get(1), 1)
+    time.sleep(0.01)
+    store.get(2)
+
+    assert len(store) == 1
+    assert store.get(1).turns == [("question 0", "answer 0")]
+
+
+def test_unreadable_history_starts_a_new_conversation(pool, task_db):
+    with pool.transaction() as conn:
+        conn.execute(conversation.SQL_SAVE_CONVERSATION, (7, "not json", time.time()))
+
+    memory = ConversationStore(task_db).get(7)
+    assert memory.turns == [] and memory.summary == ""
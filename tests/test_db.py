@@ -0,0 +1,127 @@
+import sqlite3
+import threading
+
+import pytest
+
+import db
+
+
+@pytest.fixture
+def tasks(pool):
+    with pool.transaction() as conn:
+        conn.execute("INSERT INTO projects (name) VALUES ('Website Redesign'), ('Mobile App')")
+        conn.execute("INSERT INTO users (name, email) VALUES ('Alice Smith', 'alice@example.com')")
+        conn.executemany(
+            "INSERT INTO tasks (title, status, priority, due_date, project_id, assignee_id) VALUES (?, ?, ?, ?, ?, ?)",
+            [("Landing page", "To Do", "High", "2025-01-10", 1, 1),
+             ("Pricing page", "In Progress", "Low", "2025-01-05", 1, None),
+             ("Login screen", "Done", "High", None, 2, 1),
+             ("Push alerts", "To Do", "Medium", None, 2, None)])
+
+
+def task_count(conn) -> int:
+    return conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+
+
+def test_one_shared_pool_per_file(task_db, tmp_path):
+    assert db.get_pool(task_db) is db.get_pool(task_db)
+    assert db.get_pool(task_db) is not db.get_pool(str(tmp_path / "other.db"))
+
+
+def test_connections_are_tuned_and_reused(pool):
+    with pool.connection() as conn:
+        first = conn
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+        assert isinstance(conn.execute("SELECT 1 AS one").fetchone(), sqlite3.Row)
+    with pool.connection() as conn:
+        assert conn is first
+
+
+def test_pool_is_bounded_and_waits_for_a_free_connection(task_db):
+    pool = db.ConnectionPool(task_db, size=1, timeout=2)
+    conn = pool.acquire()
+    released = threading.Timer(0.05, pool.release, args=(conn,))
+    released.start()
+
+    assert pool.acquire() is conn  # Handed over once the holder released it.
+    released.join()
+
+
+def test_exhausted_pool_times_out(task_db):
+    pool = db.ConnectionPool(task_db, size=1, timeout=0.05)
+    pool.acquire()
+
+    with pytest.raises(db.Error, match="Timed out"):
+        pool.acquire()
+
+
+def test_closed_pool_refuses_connections(task_db):
+    pool = db.ConnectionPool(task_db)
+    pool.close()
+
+    with pytest.raises(db.Error, match="closed"):
+        pool.acquire()
+
+
+def test_transaction_commits_or_rolls_back(pool, tasks):
+    with pytest.raises(ValueError):
+        with pool.transaction() as conn:
+            conn.execute("DELETE FROM tasks")
+            raise ValueError("abort")
+    with pool.transaction() as conn:
+        conn.execute("DELETE FROM tasks WHERE status = 'Done'")
+
+    with pool.connection() as conn:
+        assert task_count(conn) == 3
+
+
+def test_released_connections_never_carry_an_open_transaction(task_db, tasks):
+    pool = db.ConnectionPool(task_db, size=1)
+    with pool.connection() as conn:
+        conn.execute("BEGIN")
+        conn.execute("DELETE FROM tasks")
+
+    with pool.connection() as conn:
+        assert not conn.in_transaction
+        assert task_count(conn) == 4
+
+
+def test_readers_are_not_blocked_by_a_writer(task_db, tasks):
+    writer, reader = db.create_connection(task_db), db.create_connection(task_db)
+    with db.transaction(writer):
+        writer.execute("DELETE FROM tasks")
+        assert task_count(reader) == 4  # Sees the last committed state while the write is open.
+    assert task_count(reader) == 0
+    writer.close()
+    reader.close()
+
+
+@pytest.mark.parametrize("filters, expected", [
+    ({}, ["Pricing page", "Landing page", "Login screen", "Push alerts"]),
+    ({"priority": "High"}, ["Landing page", "Login screen"]),
+    ({"project_name": "website"}, ["Pricing page", "Landing page"]),
+    ({"assignee_name": "Alice", "open_only": True}, ["Landing page"]),
+    ({"due_after": "2025-01-06", "due_before": "2025-01-31"}, ["Landing page"]),
+    ({"status": "To Do", "limit": 1}, ["Landing page"]),
+])
+def test_task_filter_query(pool, tasks, filters, expected):
+    sql, params = db.build_task_filter_query(**filters)
+    with pool.connection() as conn:
+        ids = [row["id"] for row in conn.execute(sql, params)]
+        titles = {row["id"]: row["title"] for row in conn.execute(db.sql_tasks_by_ids(len(ids)), ids)}
+
+    assert [titles[task_id] for task_id in ids] == expected
+
+
+def test_fts_query_quotes_words_and_drops_stopwords():
+    assert db.to_fts_query('Show me the "login" tasks, NOW!') == '"login" OR "now"'
+    assert db.to_fts_query("what are my tasks?") is None
+
+
+def test_meta_defaults_before_the_table_exists(tmp_path):
+    conn = db.create_connection(str(tmp_path / "old.db"))
+    assert db.get_meta(conn, "missing", "default") == "default"
+    db.set_meta(conn, "key", 3)
+    assert db.get_meta(conn, "key") == "3"
+    conn.close()
@@ -0,0 +1,132 @@
+import threading
+
+import numpy as np
+import pytest
+
+from embedding_server import EmbeddingClient, _Batcher, serve_embeddings
+
+
+class RecordingEmbeddings:
+    """ Wraps the fake embeddings, recording each batch; blocks while `gate` is cleared. """
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+        self.batches = []
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.gate.wait()
+        self.batches.append(list(texts))
+        if any(text == "boom" for text in texts):
+            raise ValueError("model failed")
+        return self.embeddings.embed_documents(texts)
+
+
+class Replies:
+    def __init__(self):
+        self.results = {}
+        self.done = threading.Event()
+        self.expected = 0
+
+    def to(self, name: str):
+        self.expected += 1
+
+        def reply(vectors=None, error=None):
+            self.results[name] = error if error is not None else vectors
+            if len(self.results) == self.expected:
+                self.done.set()
+        return reply
+
+
+def run_batcher(batcher: _Batcher, replies: Replies):
+    threading.Thread(target=batcher.run, daemon=True).start()
+    assert replies.done.wait(5)
+
+
+def test_requests_waiting_together_are_embedded_as_one_batch(embeddings):
+    model = RecordingEmbeddings(embeddings)
+    batcher = _Batcher(model, max_texts=64, max_latency=0.05)
+    replies = Replies()
+    batcher.submit(["a", "b"], replies.to("first"))
+    batcher.submit(["c"], replies.to("second"))
+    run_batcher(batcher, replies)
+
+    assert model.batches == [["a", "b", "c"]]
+    np.testing.assert_allclose(replies.results["first"], embeddings.embed_documents(["a", "b"]), rtol=1e-6)
+    np.testing.assert_allclose(replies.results["second"], embeddings.embed_documents(["c"]), rtol=1e-6)
+    stats = batcher.stats()
+    assert stats["requests"] == 2 and stats["batches"] == 1 and stats["max_batch_texts"] == 3
+
+
+def test_batches_are_capped_at_max_texts(embeddings):
+    model = RecordingEmbeddings(embeddings)
+    batcher = _Batcher(model, max_texts=3, max_latency=0.05)
+    replies = Replies()
+    for n in range(3):
+        batcher.submit([f"{n}-a", f"{n}-b"], replies.to(str(n)))
+    run_batcher(batcher, replies)
+
+    assert [len(batch) for batch in model.batches] == [4, 2]
+
+
+def test_a_failed_batch_answers_every_request_with_the_error(embeddings):
+    batcher = _Batcher(RecordingEmbeddings(embeddings), max_latency=0.05)
+    replies = Replies()
+    batcher.submit(["fine"], replies.to("fine"))
+    batcher.submit(["boom"], replies.to("boom"))
+    run_batcher(batcher, replies)
+
+    assert replies.results == {"fine": "model failed", "boom": "model failed"}
+
+
+@pytest.fixture
+def server(tmp_path, embeddings):
+    """ An embedding server on a Unix socket in a daemon thread; yields (address, model). """
+    address = str(tmp_path / "emb.sock")
+    model = RecordingEmbeddings(embeddings)
+    ready = threading.Event()
+    threading.Thread(target=serve_embeddings, kwargs={"address": address, "embeddings": model, "ready_event": ready},
+                     daemon=True).start()
+    assert ready.wait(5)
+    yield address, model
+    model.gate.set()
+
+
+def test_client_gets_each_callers_vectors(server, embeddings):
+    address, _ = server
+    client = EmbeddingClient(address, connect_timeout=5)
+    texts = [[f"text {n}", f"other {n}"] for n in range(8)]
+    results = {}
+
+    def call(n):
+        results[n] = client.embed(texts[n])
+
+    threads = [threading.Thread(target=call, args=(n,)) for n in range(len(texts))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    for n, vectors in results.items():
+        np.testing.assert_allclose(vectors, embeddings.embed_documents(texts[n]), rtol=1e-6)
+    assert len(results) == len(texts)
+    assert client.stats()["texts"] == 16
+    client.close()
+
+
+def test_client_times_out_on_a_stuck_server(server):
+    address, model = server
+    model.gate.clear()
+    client = EmbeddingClient(address, connect_timeout=5, request_timeout=0.1)
+
+    with pytest.raises(TimeoutError):
+        client.embed(["slow"])
+    client.close()
+
+
+def test_client_gives_up_when_no_server_is_listening(tmp_path):
+    client = EmbeddingClient(str(tmp_path / "missing.sock"), connect_timeout=0.1)
+
+    with pytest.raises(ConnectionError):
+        client.embed(["anything"])
@@ -0,0 +1,85 @@
+import functools
+import threading
+import time
+
+import pytest
+
+import db
+import freshness
+
+
+@pytest.fixture(autouse=True)
+def clean_writes():
+    freshness._writes.clear()
+    yield
+    freshness._writes.clear()
+
+
+@pytest.fixture
+def conversation():
+    """ Runs the test inside conversation "c1". """
+    token = freshness.bind_conversation("c1")
+    yield "c1"
+    freshness.unbind_conversation(token)
+
+
+def in_conversation(conversation_id, fn, *args):
+    token = freshness.bind_conversation(conversation_id)
+    try:
+        return fn(*args)
+    finally:
+        freshness.unbind_conversation(token)
+
+
+def test_writes_outside_a_conversation_are_not_tracked():
+    freshness.record_write(1, 10)
+
+    assert freshness.pending_writes(0) == {}
+
+
+def test_pending_writes_are_per_conversation_and_forgotten_once_indexed(conversation):
+    freshness.record_write(1, 10)
+    freshness.record_write(2, 12)
+    in_conversation("c2", freshness.record_write, 3, 11)
+
+    assert freshness.pending_writes(10) == {2: 12}
+    assert in_conversation("c2", freshness.pending_writes, 10) == {3: 11}
+    assert freshness.pending_writes(12) == {}
+
+
+def test_a_conversation_keeps_only_its_latest_writes(monkeypatch, conversation):
+    monkeypatch.setattr(freshness, "MAX_WRITES_PER_CONVERSATION", 2)
+    for task_id in range(1, 5):
+        freshness.record_write(task_id, task_id)
+
+    assert freshness.pending_writes(0) == {3: 3, 4: 4}
+
+
+def test_retrieval_waits_for_the_index_to_catch_up(conversation):
+    version = [5]
+    freshness.record_write(1, 6)
+    threading.Timer(0.1, lambda: version.__setitem__(0, 6)).start()
+
+    started = time.monotonic()
+    assert freshness.unindexed_own_writes(lambda: version[0]) == []
+    assert time.monotonic() - started >= 0.1
+
+
+def test_writes_the_index_misses_are_returned_for_sqlite(monkeypatch, conversation):
+    monkeypatch.setattr(freshness, "wait_for_version", functools.partial(freshness.wait_for_version, timeout=0.05))
+    freshness.record_write(1, 6)
+    freshness.record_write(2, 7)
+
+    assert sorted(freshness.unindexed_own_writes(lambda: 6)) == [2]
+
+
+def test_index_lag(pool):
+    with pool.transaction() as conn:
+        conn.execute("INSERT INTO projects (name) VALUES ('Website')")
+        conn.execute("INSERT INTO tasks (title, status, priority, project_id) VALUES ('Landing page', 'To Do', 'High', 1)")
+        conn.execute("UPDATE task_changes SET changed_at = changed_at - 30")
+        latest = conn.execute(db.SQL_MAX_CHANGE_SEQ).fetchone()[0]
+
+    with pool.connection() as conn:
+        assert freshness.index_lag_seconds(conn, 0) >= 30
+        assert freshness.index_lag_seconds(conn, latest) == 0.0
@@ -0,0 +1,108 @@
+import functools
+
+import pytest
+from langchain_core.documents import Document
+
+import freshness
+from knowledge_base import KnowledgeBase, reciprocal_rank_fusion
+from memory_manager import sync_vector_store
+from vector_index import open_vector_store
+
+TASKS = [
+    ("Landing page", "Hero section and sign-up form", "To Do", "High", "2025-01-10", 1, 1),
+    ("Pricing page", "Compare the three plans", "In Progress", "High", "2025-01-20", 1, 2),
+    ("Login screen", "Password and magic link", "Done", "High", "2025-01-05", 2, 1),
+    ("Push alerts", "Opt-in flow for reminders", "To Do", "Low", None, 2, 2),
+    ("Release notes", "Summarise the changes", "To Do", "Medium", "2025-02-01", 2, None),
+    ("Analytics events", "Track sign-ups and churn", "In Progress", "Medium", None, 1, 1),
+]
+
+
+def doc(task_id: int) -> Document:
+    return Document(page_content=f"task {task_id}", metadata={"task_id": task_id})
+
+
+def ids(docs) -> list[int]:
+    return [d.metadata["task_id"] for d in docs]
+
+
+def titles(docs) -> list[str]:
+    return [d.metadata["title"] for d in docs]
+
+
+@pytest.fixture
+def knowledge_base(tmp_path, pool, task_db, embeddings):
+    with pool.transaction() as conn:
+        conn.execute("INSERT INTO projects (name) VALUES ('Website Redesign'), ('Mobile App')")
+        conn.execute("INSERT INTO users (name, email) VALUES ('Alice Smith', 'alice@example.com'), "
+                     "('Bob Jones', 'bob@example.com')")
+        conn.executemany("INSERT INTO tasks (title, description, status, priority, due_date, project_id, assignee_id) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?)", TASKS)
+    persist_directory = str(tmp_path / "index")
+    with pool.connection() as conn:
+        sync_vector_store(conn, open_vector_store(persist_directory, embeddings, backend="numpy"))
+    return KnowledgeBase(persist_directory, db_file=task_db, embeddings=embeddings, backend="numpy")
+
+
+def test_rrf_favours_tasks_both_retrievers_rank_well():
+    lexical = [doc(1), doc(2), doc(3)]
+    vector = [doc(4), doc(2), doc(5)]
+
+    assert ids(reciprocal_rank_fusion([lexical, vector], k=3)) == [2, 1, 4]
+    assert ids(reciprocal_rank_fusion([lexical, vector], k=1)) == [2]
+
+
+def test_hybrid_search_finds_exact_words_the_embedding_misses(knowledge_base):
+    # The test embeddings are random per text, so only the BM25 side knows which task says "pricing".
+    assert titles(knowledge_base.search("pricing", k=1)) == ["Pricing page"]
+    assert knowledge_base.stats()["lexical_searches"] == 1
+
+
+def test_repeated_searches_are_served_from_the_result_cache(knowledge_base):
+    first = knowledge_base.search("magic link login", k=2)
+
+    assert knowledge_base.search("Magic link LOGIN?", k=2) == first
+    assert knowledge_base.stats()["result_cache"]["hits"] == 1
+
+
+def test_search_without_the_fts_index_uses_vectors_only(pool, knowledge_base):
+    with pool.transaction() as conn:
+        conn.execute("DROP TABLE tasks_fts")
+
+    assert len(knowledge_base.search("pricing", k=2)) == 2
+    assert knowledge_base.stats()["lexical_searches"] == 0
+
+
+def test_filtered_search_without_a_query_keeps_the_sql_order(knowledge_base):
+    docs = knowledge_base.filtered_search("", limit=3, priority="High")
+
+    assert titles(docs) == ["Login screen", "Landing page", "Pricing page"]
+
+
+def test_filtered_search_ranks_only_matching_tasks(knowledge_base):
+    docs = knowledge_base.filtered_search("sign-up", limit=3, status="To Do", project_name="Website")
+
+    assert titles(docs) == ["Landing page"]
+
+
+def test_filtered_search_fills_up_in_sql_order(knowledge_base):
+    docs = knowledge_base.filtered_search("reminders", limit=3, open_only=True, assignee_name="Bob")
+
+    assert titles(docs)[0] == "Push alerts"
+    assert sorted(titles(docs)) == ["Pricing page", "Push alerts"]
+
+
+def test_own_unindexed_writes_are_found(monkeypatch, pool, knowledge_base):
+    monkeypatch.setattr(freshness, "wait_for_version", functools.partial(freshness.wait_for_version, timeout=0.01))
+    with pool.transaction() as conn:
+        task_id = conn.execute("INSERT INTO tasks (title, status, priority, project_id) "
+                               "VALUES ('Dark mode', 'To Do', 'Low', 1)").lastrowid
+    token = freshness.bind_conversation("c1")
+    try:
+        freshness.record_write(task_id, 100)
+        docs = knowledge_base.search("colour themes", k=2)
+    finally:
+        freshness.unbind_conversation(token)
+        freshness._writes.clear()
+
+    assert titles(docs)[0] == "Dark mode"
@@ -0,0 +1,96 @@
+import pytest
+
+from router import FastPathRouter
+
+
+@pytest.fixture
+def router(pool, task_db):
+    with pool.transaction() as conn:
+        conn.execute("INSERT INTO projects (name) VALUES ('Website Redesign'), ('Mobile App Launch')")
+        conn.execute("INSERT INTO users (name, email) VALUES ('Alice Smith', 'alice@example.com'), "
+                     "('Bob Jones', 'bob@example.com')")
+        conn.executemany(
+            "INSERT INTO tasks (title, status, priority, due_date, project_id, assignee_id) VALUES (?, ?, ?, ?, ?, ?)",
+            [("Landing page", "To Do", "High", "2025-01-10", 1, 1),
+             ("Pricing page", "In Progress", "High", "2025-01-20", 1, 2),
+             ("Login screen", "Done", "High", "2025-01-05", 2, 1),
+             ("Push alerts", "Done", "Low", None, 2, 2)])
+    return FastPathRouter(task_db)
+
+
+def filters(router, query: str) -> dict | None:
+    """ The filters the query is answered with on the fast path, or None if it goes to the agent. """
+    result = router.classify(query)
+    if result.intent == "agent" or result.confidence < router.min_confidence:
+        return None
+    return result.params
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("show tasks that are done", {"status": "Done"}),
+    ("list tasks in progress", {"status": "In Progress"}),
+    ("show tasks not started", {"status": "To Do"}),
+    ("list open high priority tasks", {"open_only": True, "priority": "High"}),
+    ("show tasks for Alice", {"assignee_name": "Alice Smith"}),
+    ("list done tasks in Website Redesign", {"status": "Done", "project_name": "Website Redesign"}),
+])
+def test_structured_listing(router, query, expected):
+    assert filters(router, query) == expected
+
+
+@pytest.mark.parametrize("query", [
+    "show tasks that are not completed",
+    "list tasks that aren't finished",
+    "show tasks that are not done yet",
+])
+def test_not_done_means_open(router, query):
+    assert filters(router, query) == {"open_only": True}
+
+
+def test_not_done_keeps_other_filters(router):
+    assert filters(router, "list high priority tasks that are not done") == {"open_only": True, "priority": "High"}
+
+
+@pytest.mark.parametrize("query", [
+    "what tasks are not in progress",
+    "show tasks that aren't to do",
+    "list all tasks except done ones",
+    "show tasks other than completed",
+    "list tasks without high priority",
+    "show tasks that are not high priority",
+    "list tasks that are not open",
+])
+def test_other_negations_go_to_the_agent(router, query):
+    assert filters(router, query) is None
+
+
+@pytest.mark.parametrize("query", [
+    "show my open tasks",
+    "list tasks for Zed",  # Not a known user or project.
+    "show tasks",  # Nothing to filter on.
+    "add a task for Alice",
+    "why are the high priority tasks late?",
+])
+def test_near_misses_go_to_the_agent(router, query):
+    assert filters(router, query) is None
+
+
+def test_route_answers_open_tasks_from_sql(router):
+    result = router.route("show tasks that are not done")
+
+    assert result.intent == "list_tasks"
+    assert "Landing page" in result.answer and "Pricing page" in result.answer
+    assert "Login screen" not in result.answer and "Push alerts" not in result.answer
+
+
+def test_route_task_by_id_and_stats(router):
+    assert "Pricing page" in router.route("show task 2").answer
+    assert router.route("task 99").answer == "There is no task with ID 99."
+    assert router.route("show tasks that are not in progress") is None
+
+    router.record_agent_run(2.0)
+    stats = router.stats()
+    assert stats["queries"] == 3
+    assert stats["fallbacks"] == 1
+    assert stats["intents"]["task_by_id"]["hits"] == 2
+    assert stats["estimated_seconds_saved"] > 3.9
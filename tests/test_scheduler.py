@@ -0,0 +1,136 @@
+import asyncio
+
+import pytest
+
+from scheduler import PRIORITY_DEFAULT, PRIORITY_DM, AgentScheduler, QueueFullError, RequestExpiredError
+
+
+class Recorder:
+    """ A run_fn that records the jobs it runs and answers after `delay` seconds. """
+
+    def __init__(self, delay: float = 0.01):
+        self.delay = delay
+        self.runs = []
+        self.active_users = set()
+        self.overlapped = False
+
+    async def __call__(self, job):
+        self.runs.append((job.user_id, job.query))
+        self.overlapped |= job.user_id in self.active_users
+        self.active_users.add(job.user_id)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.active_users.discard(job.user_id)
+        return f"answer to {job.query}"
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_same_users_identical_question_runs_once():
+    async def scenario():
+        recorder = Recorder()
+        scheduler = AgentScheduler(recorder, workers=2)
+        first, _ = scheduler.submit("What is due today?", 1, None)
+        second, _ = scheduler.submit("what is due today", 1, None)
+        answers = await asyncio.gather(first, second)
+        return recorder, scheduler, answers
+
+    recorder, scheduler, answers = run(scenario())
+    assert answers == ["answer to What is due today?"] * 2
+    assert len(recorder.runs) == 1
+    assert scheduler.stats()["coalesced"] == 1
+
+
+def test_different_users_are_never_coalesced():
+    async def scenario():
+        recorder = Recorder()
+        scheduler = AgentScheduler(recorder, workers=2)
+        futures = [scheduler.submit("What is due today?", user_id, None)[0] for user_id in (1, 2)]
+        await asyncio.gather(*futures)
+        return recorder, scheduler
+
+    recorder, scheduler = run(scenario())
+    assert sorted(recorder.runs) == [(1, "What is due today?"), (2, "What is due today?")]
+    assert scheduler.stats()["coalesced"] == 0
+
+
+def test_no_coalescing_across_data_versions_or_when_disabled():
+    async def scenario():
+        recorder = Recorder()
+        version = [0]
+        scheduler = AgentScheduler(recorder, version_fn=lambda: version[0], workers=1)
+        futures = [scheduler.submit("List open tasks", 1, None)[0]]
+        version[0] = 1
+        futures.append(scheduler.submit("List open tasks", 1, None)[0])
+        futures.append(scheduler.submit("List open tasks", 1, None, coalesce=False)[0])
+        await asyncio.gather(*futures)
+        return recorder
+
+    assert len(run(scenario()).runs) == 3
+
+
+def test_requests_that_waited_too_long_expire():
+    async def scenario():
+        recorder = Recorder(delay=0.05)
+        scheduler = AgentScheduler(recorder, workers=1, max_wait=0.02)
+        first, _ = scheduler.submit("first", 1, None)
+        second, position = scheduler.submit("second", 2, None)
+        results = await asyncio.gather(first, second, return_exceptions=True)
+        return recorder, scheduler, results, position
+
+    recorder, scheduler, results, position = run(scenario())
+    assert position == 1
+    assert results[0] == "answer to first"
+    assert isinstance(results[1], RequestExpiredError)
+    assert recorder.runs == [(1, "first")]
+    assert scheduler.stats()["expired"] == 1
+
+
+def test_full_queue_rejects_new_requests():
+    async def scenario():
+        scheduler = AgentScheduler(Recorder(), workers=1, max_queue=2)
+        futures = [scheduler.submit(f"question {n}", n, None)[0] for n in range(2)]
+        with pytest.raises(QueueFullError):
+            scheduler.submit("one too many", 9, None)
+        # Joining a queued identical request needs no room.
+        futures.append(scheduler.submit("question 1", 1, None)[0])
+        await asyncio.gather(*futures)
+        return scheduler
+
+    assert run(scenario()).stats()["rejected"] == 1
+
+
+def test_priority_order():
+    async def scenario():
+        recorder = Recorder()
+        scheduler = AgentScheduler(recorder, workers=1)
+        futures = [scheduler.submit("blocker", 0, None)[0]]
+        await asyncio.sleep(0)  # Let the worker take the blocker.
+        futures.append(scheduler.submit("channel", 1, None, priority=PRIORITY_DEFAULT)[0])
+        futures.append(scheduler.submit("direct message", 2, None, priority=PRIORITY_DM)[0])
+        await asyncio.gather(*futures)
+        return recorder
+
+    assert [query for _, query in run(scenario()).runs] == ["blocker", "direct message", "channel"]
+
+
+def test_a_users_backlog_does_not_hold_the_workers():
+    async def scenario():
+        recorder = Recorder(delay=0.02)
+        scheduler = AgentScheduler(recorder, workers=2)
+        futures = [scheduler.submit(f"question {n}", 1, None, coalesce=False)[0] for n in range(3)]
+        futures.append(scheduler.submit("another user", 2, None)[0])
+        await asyncio.sleep(0.01)
+        started_while_user_busy = (2, "another user") in recorder.runs
+        await asyncio.gather(*futures)
+        return recorder, scheduler, started_while_user_busy
+
+    recorder, scheduler, started_while_user_busy = run(scenario())
+    assert started_while_user_busy
+    assert not recorder.overlapped
+    assert [query for user_id, query in recorder.runs if user_id == 1] == ["question 0", "question 1", "question 2"]
+    stats = scheduler.stats()
+    assert stats["queue_depth"] == 0 and stats["busy_users"] == 0 and stats["running"] == 0
@@ -0,0 +1,53 @@
+import pytest
+
+import db
+import setup_db
+
+CSV_EXPORT = """title,description,status,priority,due_date,project,assignee
+Landing page,Hero and pricing,To Do,High,2025-01-10,Website,Alice
+Login screen,,Done,Low,,Mobile App,Bob
+Push alerts,Opt-in flow,Blocked,Urgent,,Mobile App,
+"""
+
+
+@pytest.fixture
+def export(tmp_path) -> str:
+    path = tmp_path / "tasks.csv"
+    path.write_text(CSV_EXPORT, encoding="utf-8")
+    return str(path)
+
+
+def logged_actions(conn) -> list[str]:
+    return [row["action"] for row in conn.execute(db.SQL_CHANGES_AFTER, (0, 1000))]
+
+
+def test_import_keeps_the_change_log_by_default(task_db, export):
+    conn = db.create_connection(task_db)
+    setup_db.import_tasks(conn, export)
+
+    assert logged_actions(conn) == ["upsert"] * 3
+    rows = conn.execute("SELECT title, status, priority FROM tasks ORDER BY id").fetchall()
+    assert [tuple(row) for row in rows][-1] == ("Push alerts", "To Do", "Medium")
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    conn.close()
+
+
+def test_bulk_import_rebuilds_indexes_and_logs_a_resync(task_db, export):
+    conn = db.create_connection(task_db)
+    setup_db.import_tasks(conn, export, bulk=True)
+
+    assert logged_actions(conn) == ["resync"]
+    assert [row[0] for row in conn.execute("SELECT rowid FROM tasks_fts WHERE tasks_fts MATCH 'pricing'")] == [1]
+    triggers = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")}
+    assert set(setup_db.DEFERRED_TRIGGERS) <= triggers
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    conn.close()
+
+
+def test_bulk_import_refuses_while_the_database_is_in_use(pool, task_db, export):
+    conn = db.create_connection(task_db)
+    with pool.connection() as reader:
+        reader.execute("SELECT COUNT(*) FROM tasks").fetchone()
+        with pytest.raises(RuntimeError, match="in use"):
+            setup_db.import_tasks(conn, export, bulk=True)
+    conn.close()
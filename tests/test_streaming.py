@@ -0,0 +1,104 @@
+import asyncio
+import types
+
+import discord
+import pytest
+
+import streaming
+from streaming import EMPTY_ANSWER_TEXT, PLACEHOLDER_TEXT, DiscordStreamer
+
+
+def http_error(status: int) -> discord.HTTPException:
+    return discord.HTTPException(types.SimpleNamespace(status=status, reason="error"), "failed")
+
+
+class FakeMessage:
+    def __init__(self, channel, content: str):
+        self.channel = channel
+        self.content = content
+        self.deleted = False
+
+    async def edit(self, content: str):
+        if self.channel.edit_errors:
+            raise self.channel.edit_errors.pop(0)
+        self.content = content
+
+    async def delete(self):
+        self.deleted = True
+
+
+class FakeChannel:
+    """ Records sent messages; edits raise the queued `edit_errors` first. """
+
+    def __init__(self, edit_errors=()):
+        self.edit_errors = list(edit_errors)
+        self.messages = []
+
+    async def send(self, content: str) -> FakeMessage:
+        message = FakeMessage(self, content)
+        self.messages.append(message)
+        return message
+
+    def visible(self) -> list[str]:
+        return [message.content for message in self.messages if not message.deleted]
+
+
+@pytest.fixture(autouse=True)
+def no_waiting(monkeypatch):
+    monkeypatch.setattr(streaming, "EDIT_INTERVAL_SECONDS", 0.001)
+
+
+async def stream(channel, deltas, final_text):
+    streamer = DiscordStreamer(channel)
+    await streamer.start()
+    for delta in deltas:
+        streamer.feed(delta)
+        await asyncio.sleep(0.01)  # Lets the flusher edit in between.
+    await streamer.finish(final_text)
+    return streamer
+
+
+def test_final_answer_replaces_streamed_text():
+    channel = FakeChannel()
+    streamer = asyncio.run(stream(channel, ["Three ", "tasks"], "Three tasks are overdue."))
+
+    assert channel.visible() == ["Three tasks are overdue."]
+    assert streamer.first_token_seconds is not None
+
+
+def test_long_answers_continue_in_follow_up_messages():
+    channel = FakeChannel()
+    asyncio.run(stream(channel, ["x " * 1500], "x " * 1500))
+
+    assert len(channel.visible()) == 2
+    assert all(len(content) <= 2000 for content in channel.visible())
+
+
+def test_failed_streaming_edit_does_not_lose_the_answer():
+    channel = FakeChannel(edit_errors=[http_error(500)])
+    asyncio.run(stream(channel, ["Partial"], "The full answer."))
+
+    assert channel.visible() == ["The full answer."]
+
+
+def test_falls_back_to_a_new_message_when_editing_keeps_failing():
+    channel = FakeChannel(edit_errors=[http_error(403)] * 10)
+    asyncio.run(stream(channel, [], "The full answer."))
+
+    assert channel.visible() == ["The full answer."]
+    assert channel.messages[0].deleted and channel.messages[0].content == PLACEHOLDER_TEXT
+
+
+def test_rate_limited_final_edit_is_retried():
+    channel = FakeChannel(edit_errors=[http_error(429)])
+    streamer = asyncio.run(stream(channel, [], "The full answer."))
+
+    assert channel.visible() == ["The full answer."]
+    assert streamer.interval > streaming.EDIT_INTERVAL_SECONDS  # Edits less often from now on.
+
+
+def test_empty_answer_replaces_the_placeholder():
+    channel = FakeChannel()
+    asyncio.run(stream(channel, [], "  "))
+
+    assert channel.visible() == [EMPTY_ANSWER_TEXT]
@@ -0,0 +1,113 @@
+import pytest
+from langchain_core.documents import Document
+
+import vector_index
+from vector_index import NumpyVectorStore
+
+
+def task_document(task_id: int, status: str = "To Do", priority: str = "Medium") -> Document:
+    return Document(page_content=f"Task {task_id}: write the quarterly report, part {task_id}",
+                    metadata={"task_id": task_id, "status": status, "priority": priority})
+
+
+def add_tasks(store: NumpyVectorStore, task_ids, **metadata):
+    documents = [task_document(task_id, **metadata) for task_id in task_ids]
+    store.add_documents(documents, ids=[str(task_id) for task_id in task_ids])
+    return documents
+
+
+def found_ids(results) -> list[int]:
+    return [doc.metadata["task_id"] for doc in results]
+
+
+@pytest.fixture(params=["float16", "int8"])
+def store(request, tmp_path, embeddings):
+    return NumpyVectorStore(str(tmp_path / "index"), embeddings, dtype=request.param)
+
+
+def test_add_and_search_finds_own_text(store, embeddings):
+    documents = add_tasks(store, range(1, 51))
+
+    for document in documents[::10]:
+        results = store.similarity_search_by_vector(embeddings.embed_query(document.page_content), k=3)
+        assert found_ids(results)[0] == document.metadata["task_id"]
+        assert results[0].page_content == document.page_content
+    assert store.count() == 50
+
+
+def test_upsert_updates_in_place(store, embeddings):
+    add_tasks(store, range(1, 11))
+    store.add_documents([Document(page_content="Renamed task", metadata={"task_id": 3, "status": "Done"})], ids=["3"])
+
+    assert store.count() == 10
+    assert store.stats()["tombstones"] == 0
+    assert store.get(ids=["3"])["metadatas"] == [{"task_id": 3, "status": "Done"}]
+    assert found_ids(store.similarity_search_by_vector(embeddings.embed_query("Renamed task"), k=1)) == [3]
+
+
+def test_delete_hides_documents(store, embeddings):
+    documents = add_tasks(store, range(1, 21))
+    store.delete(ids=["5", "6", "missing"])
+
+    assert store.count() == 18
+    assert vector_index.count_documents(store) == 18
+    assert store.get(ids=["5", "7"])["ids"] == ["7"]
+    results = store.similarity_search_by_vector(embeddings.embed_query(documents[4].page_content), k=20)
+    assert 5 not in found_ids(results) and 6 not in found_ids(results)
+    assert len(results) == 18
+
+
+def test_filters(store, embeddings):
+    add_tasks(store, range(1, 11), status="To Do", priority="High")
+    add_tasks(store, range(11, 21), status="Done", priority="Low")
+    query = embeddings.embed_query("quarterly report")
+
+    def search(where):
+        return set(found_ids(store.similarity_search_by_vector(query, k=50, filter=where)))
+
+    assert search({"status": "Done"}) == set(range(11, 21))
+    assert search({"status": {"$ne": "Done"}}) == set(range(1, 11))
+    assert search({"task_id": {"$in": [2, 12, 99]}}) == {2, 12}
+    assert search({"task_id": {"$nin": list(range(1, 19))}}) == {19, 20}
+    assert search({"$and": [{"status": "To Do"}, {"task_id": {"$gte": 8}}]}) == {8, 9, 10}
+    assert search({"$or": [{"priority": "High"}, {"task_id": {"$lt": 13}}]}) == set(range(1, 13))
+    assert search({"task_id": {"$gt": 100}}) == set()
+    assert store.get(where={"status": "Done"}, limit=3)["ids"] == ["11", "12", "13"]
+
+
+def test_compaction_reclaims_tombstones(monkeypatch, store, embeddings):
+    monkeypatch.setattr(vector_index, "COMPACT_MIN_TOMBSTONES", 10)
+    documents = add_tasks(store, range(1, 41))
+    store.delete(ids=[str(task_id) for task_id in range(1, 21)])
+
+    stats = store.stats()
+    assert stats["compactions"] == 1
+    assert stats["epoch"] == 1
+    assert stats["live"] == 20 and stats["tombstones"] == 0
+    # Renumbered rows still answer with the right documents and metadata.
+    for document in documents[20::5]:
+        results = store.similarity_search_by_vector(embeddings.embed_query(document.page_content), k=1)
+        assert found_ids(results) == [document.metadata["task_id"]]
+    assert set(found_ids(store.similarity_search_by_vector(embeddings.embed_query("x"), k=5,
+                                                           filter={"task_id": {"$lte": 22}}))) == {21, 22}
+
+
+def test_second_instance_sees_writes(store, embeddings):
+    reader = NumpyVectorStore(store._persist_directory, embeddings)
+    add_tasks(store, range(1, 11))
+    assert reader.count() == 10
+
+    store.delete(ids=["1"])
+    add_tasks(store, [11], status="Done")
+    assert reader.count() == 10
+    assert reader.get(ids=["1", "11"])["metadatas"] == [{"task_id": 11, "status": "Done", "priority": "Medium"}]
+
+
+def test_reopen_keeps_contents_and_dtype(tmp_path, embeddings):
+    directory = str(tmp_path / "index")
+    add_tasks(NumpyVectorStore(directory, embeddings, dtype="int8"), range(1, 6))
+
+    reopened = NumpyVectorStore(directory, embeddings, dtype="float16")
+    assert reopened.dtype == "int8"
+    assert reopened.count() == 5
+    assert sorted(reopened.get()["ids"]) == ["1", "2", "3", "4", "5"]
@@ -0,0 +1,622 @@
+# vector_index.py
+# The vector-store backends and the factory that picks one by configuration.
+#
+# "chroma" is the LangChain Chroma store used so far. "numpy" is
+# NumpyVectorStore below: task embeddings live in a memory-mapped float16 (or
+# int8-quantized) matrix next to a small SQLite sidecar holding each row's ID,
+# text and metadata. Both backends expose the calls the rest of the code makes:
+# add_documents, delete, get, similarity_search_by_vector(filter=...) and
+# _collection.upsert(); count_documents() below counts the documents in either.
+#
+# Several collections can live in one persist directory. The meta table of the
+# task database names the active one and the embedding model it was built
+# with; reindex.py builds a new collection and switches that pointer.
+import json
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+from langchain_core.documents import Document
+
+import db
+
+# --- CONFIGURATION ---
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")  # "chroma" or "numpy".
+VECTOR_DTYPE = os.getenv("VECTOR_DTYPE", "float16")  # "float16" or "int8" (numpy backend only).
+DEFAULT_COLLECTION = "langchain"  # Chroma's default, so existing stores open unchanged.
+NUMPY_SUBDIRECTORY = "numpy"  # The numpy backend keeps each collection in <persist_directory>/numpy/<name>/.
+INITIAL_CAPACITY = 1024  # Rows allocated in a new vector file; it doubles when full.
+BLOCK_ROWS = 4096  # Rows decoded and scored per matrix multiplication; small enough to stay in cache.
+GATHER_FRACTION = 0.25  # Filters matching fewer rows than this fraction score only those rows.
+COMPACT_MIN_TOMBSTONES = 1000
+COMPACT_RATIO = 0.25  # Compact once this fraction of the allocated rows are deleted.
+SQLITE_MAX_PARAMS = 900
+
+SQL_CREATE_VECTORS = """
+CREATE TABLE IF NOT EXISTS vectors (
+    slot INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    document TEXT,
+    metadata TEXT NOT NULL,
+    alive INTEGER NOT NULL,
+    generation INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS vectors_generation ON vectors (generation);
+"""
+SQL_ALL_ROWS = "SELECT slot, id, metadata, alive FROM vectors"
+SQL_ROWS_AFTER_GENERATION = "SELECT slot, id, metadata, alive FROM vectors WHERE generation > ?"
+SQL_UPSERT_ROW = (
+    "INSERT INTO vectors (slot, id, document, metadata, alive, generation) VALUES (?, ?, ?, ?, 1, ?) "
+    "ON CONFLICT(id) DO UPDATE SET document = excluded.document, metadata = excluded.metadata, "
+    "alive = 1, generation = excluded.generation"
+)
+SQL_TOMBSTONE_ROW = "UPDATE vectors SET alive = 0, document = NULL, metadata = '{}', generation = ? WHERE id = ?"
+SQL_LIVE_DOCUMENTS = "SELECT id, document, metadata FROM vectors WHERE alive = 1 ORDER BY slot"
+SQL_PURGE_TOMBSTONES = "DELETE FROM vectors WHERE alive = 0"
+SQL_MOVE_SLOT = "UPDATE vectors SET slot = ? WHERE slot = ?"
+SQL_ALL_META = "SELECT key, value FROM meta"
+
+logger = logging.getLogger(__name__)
+
+
+def open_vector_store(persist_directory: str, embeddings=None, collection_name: str = DEFAULT_COLLECTION,
+                      backend: str | None = None):
+    """
+    Opens the vector store in `persist_directory` with the configured backend
+    (VECTOR_BACKEND unless `backend` is given). `embeddings` may be None for
+    callers that only write pre-computed vectors.
+    """
+    backend = backend or VECTOR_BACKEND
+    if backend == "numpy":
+        directory = os.path.join(persist_directory, NUMPY_SUBDIRECTORY, collection_name)
+        return NumpyVectorStore(directory, embedding_function=embeddings)
+    if backend == "chroma":
+        # Imported here: chromadb is slow to import and not needed by the numpy backend.
+        from langchain_community.vectorstores import Chroma
+        return Chroma(collection_name=collection_name, persist_directory=persist_directory,
+                      embedding_function=embeddings)
+    raise ValueError(f"Unknown vector backend '{backend}'; expected 'chroma' or 'numpy'.")
+
+
+def count_documents(vector_store) -> int:
+    """ The number of documents in a vector store of either backend. """
+    if isinstance(vector_store, NumpyVectorStore):
+        return vector_store.count()
+    return vector_store._collection.count()  # Chroma keeps the count on its raw collection.
+
+
+def active_collection(conn: sqlite3.Connection, default_model: str) -> tuple[str, str]:
+    """ The (collection name, embedding model) readers should use; before any re-index, Chroma's default collection. """
+    pointer = db.get_meta(conn, db.META_VECTOR_COLLECTION)
+    if pointer is None:
+        return DEFAULT_COLLECTION, default_model
+    pointer = json.loads(pointer)
+    return pointer["name"], pointer["embedding_model"]
+
+
+def set_active_collection(conn: sqlite3.Connection, name: str, embedding_model: str):
+    db.set_meta(conn, db.META_VECTOR_COLLECTION, json.dumps({"name": name, "embedding_model": embedding_model}))
+
+
+def _format_number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else str(value)
+
+
+class _Column:
+    """
+    One metadata field for every slot, used to evaluate filters without
+    touching the sidecar. Numbers are stored as float64 (NaN when missing),
+    anything else as int32 codes into `vocabulary` (-1 when missing). A
+    numeric field that receives a non-numeric value is converted to text.
+    """
+
+    def __init__(self, capacity: int, numeric: bool):
+        self.numeric = numeric
+        self.vocabulary = {}  # text -> code
+        self.values = np.full(capacity, np.nan) if numeric else np.full(capacity, -1, dtype=np.int32)
+
+    def grow(self, capacity: int):
+        extra = capacity - len(self.values)
+        if extra > 0:
+            fill = np.full(extra, np.nan) if self.numeric else np.full(extra, -1, dtype=np.int32)
+            self.values = np.concatenate([self.values, fill])
+
+    def _code(self, text: str) -> int:
+        code = self.vocabulary.get(text)
+        if code is None:
+            code = self.vocabulary[text] = len(self.vocabulary)
+        return code
+
+    def _to_text(self):
+        codes = np.full(len(self.values), -1, dtype=np.int32)
+        for slot in np.flatnonzero(~np.isnan(self.values)):
+            codes[slot] = self._code(_format_number(self.values[slot]))
+        self.numeric, self.values = False, codes
+
+    def set(self, slot: int, value):
+        if value is None:
+            self.values[slot] = np.nan if self.numeric else -1
+        elif isinstance(value, (int, float)):
+            if self.numeric:
+                self.values[slot] = value
+            else:
+                self.values[slot] = self._code(_format_number(value))
+        else:
+            if self.numeric:
+                self._to_text()
+            self.values[slot] = self._code(value if isinstance(value, str) else json.dumps(value))
+
+    def clear(self, slot: int):
+        self.set(slot, None)
+
+    def mask(self, op: str, operand, n: int) -> np.ndarray:
+        """ Rows 0..n-1 whose value satisfies `op operand`. Missing values never match. """
+        values = self.values[:n]
+        if self.numeric:
+            present = ~np.isnan(values)
+            if op in ("$in", "$nin"):
+                numbers = [value for value in operand if isinstance(value, (int, float))]
+                found = np.isin(values, numbers)
+                return found if op == "$in" else present & ~found
+            if not isinstance(operand, (int, float)):
+                # Chroma never matches a text operand against a numeric field; neither do we.
+                return np.zeros(n, dtype=bool) if op != "$ne" else present
+            with np.errstate(invalid="ignore"):
+                return present & _COMPARE[op](values, operand)
+        # Text: evaluate the operator once per distinct value, then select the matching codes.
+        if op in ("$in", "$nin"):
+            wanted = {_format_number(v) if isinstance(v, (int, float)) else v for v in operand}
+            codes = [code for text, code in self.vocabulary.items() if text in wanted]
+            found = np.isin(values, codes)
+            return found if op == "$in" else (values >= 0) & ~found
+        if isinstance(operand, (int, float)):
+            operand = _format_number(operand)
+        codes = [code for text, code in self.vocabulary.items() if _COMPARE[op](text, operand)]
+        return np.isin(values, codes)
+
+
+_COMPARE = {
+    "$eq": lambda a, b: a == b,
+    "$ne": lambda a, b: a != b,
+    "$gt": lambda a, b: a > b,
+    "$gte": lambda a, b: a >= b,
+    "$lt": lambda a, b: a < b,
+    "$lte": lambda a, b: a <= b,
+}
+
+
+class NumpyVectorStore:
+    """
+    A vector store for corpora that fit in memory, without a database server.
+
+    Vectors are unit-normalised and kept in a memory-mapped file as float16, or
+    as int8 with one float32 scale per row (VECTOR_DTYPE). A query is scored
+    by cosine similarity with blocked matrix multiplications over that file;
+    for unit vectors this ranks like Chroma's L2 distance. Metadata is held in
+    columnar arrays (`_Column`), so `filter` clauses (`$eq`, `$ne`, `$gt`,
+    `$gte`, `$lt`, `$lte`, `$in`, `$nin`, `$and`, `$or`, as in Chroma) become
+    vectorised masks. Very selective filters score only the matching rows.
+
+    IDs, texts and metadata are stored in a SQLite sidecar. Upserts overwrite
+    a row in place. Deletes leave a tombstone that searches skip, and the file
+    is compacted once COMPACT_RATIO of its rows are tombstones. Every write
+    bumps a generation counter in the sidecar, so another process (the bot
+    reading while the memory worker writes) picks up just the changed rows on
+    its next call. A compaction bumps the epoch, which makes readers reload.
+    """
+
+    def __init__(self, directory: str, embedding_function=None, dtype: str = VECTOR_DTYPE):
+        if dtype not in ("float16", "int8"):
+            raise ValueError(f"Unsupported vector dtype '{dtype}'; expected 'float16' or 'int8'.")
+        os.makedirs(directory, exist_ok=True)
+        self._persist_directory = directory
+        self.embedding_function = embedding_function
+        self._pool = db.get_pool(os.path.join(directory, "index.db"))
+        self._lock = threading.RLock()
+        self._stats = {"searches": 0, "upserts": 0, "deletes": 0, "compactions": 0}
+        with self._pool.connection() as conn:
+            conn.executescript(SQL_CREATE_VECTORS)
+            conn.execute(db.SQL_CREATE_META)
+            if db.get_meta(conn, "dtype") is None:
+                db.set_meta(conn, "dtype", dtype)
+            self.dtype = db.get_meta(conn, "dtype")  # An existing store keeps the dtype it was built with.
+            self._reload(conn)
+
+    # --- STATE ---
+    @property
+    def embeddings(self):
+        return self.embedding_function
+
+    @property
+    def _collection(self):
+        """ embed_db calls Chroma's raw collection to upsert pre-computed vectors; this store does that itself. """
+        return self
+
+    def _files(self, epoch: int) -> tuple[str, str]:
+        return (os.path.join(self._persist_directory, f"vectors-{epoch}.bin"),
+                os.path.join(self._persist_directory, f"scales-{epoch}.bin"))
+
+    def _map(self, capacity: int | None = None):
+        """ Maps the current epoch's files, growing them to `capacity` rows first if given. """
+        if self._dimensions is None:
+            self._vectors, self._scales, self._capacity = None, None, 0
+            return
+        row_bytes = self._dimensions * np.dtype(self.dtype).itemsize
+        vectors_path, scales_path = self._files(self._epoch)
+        for path, width in ((vectors_path, row_bytes), (scales_path, 4)):
+            if path == scales_path and self.dtype != "int8":
+                continue
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            if capacity and size < capacity * width:
+                with open(path, "ab") as f:
+                    f.truncate(capacity * width)
+        rows = os.path.getsize(vectors_path) // row_bytes if os.path.exists(vectors_path) else 0
+        if not rows:
+            self._vectors, self._scales, self._capacity = None, None, 0
+            return
+        self._vectors = np.memmap(vectors_path, dtype=self.dtype, mode="r+", shape=(rows, self._dimensions))
+        self._scales = (np.memmap(scales_path, dtype=np.float32, mode="r+", shape=(rows,))
+                        if self.dtype == "int8" else None)
+        self._capacity = rows
+        self._alive = np.concatenate([self._alive, np.zeros(max(0, rows - len(self._alive)), dtype=bool)])
+        for column in self._columns.values():
+            column.grow(rows)
+
+    def _reload(self, conn: sqlite3.Connection):
+        """ Rebuilds the in-memory state from the sidecar (at open and after another process compacted). """
+        meta = dict(conn.execute(SQL_ALL_META).fetchall())
+        self._epoch = int(meta.get("epoch", 0))
+        self._generation = int(meta.get("generation", 0))
+        self._slots = int(meta.get("slots", 0))
+        self._dimensions = int(meta["dimensions"]) if "dimensions" in meta else None
+        self._ids = [None] * self._slots
+        self._slot_of = {}
+        self._alive = np.zeros(0, dtype=bool)
+        self._columns = {}
+        self._map()
+        self._apply_rows(conn.execute(SQL_ALL_ROWS))
+
+    def _refresh(self, conn: sqlite3.Connection):
+        """ Applies rows another process (or connection) wrote since this instance last looked. """
+        if not conn.in_transaction:
+            # One read snapshot, so the rows read match the meta values read.
+            with db.transaction(conn, immediate=False):
+                return self._refresh(conn)
+        meta = dict(conn.execute(SQL_ALL_META).fetchall())
+        if int(meta.get("epoch", 0)) != self._epoch or ("dimensions" in meta) != (self._dimensions is not None):
+            self._reload(conn)
+            return
+        generation = int(meta.get("generation", 0))
+        if generation == self._generation:
+            return
+        self._slots = int(meta.get("slots", 0))
+        if self._slots > self._capacity:
+            self._map()
+        self._apply_rows(conn.execute(SQL_ROWS_AFTER_GENERATION, (self._generation,)))
+        self._generation = generation
+
+    def _apply_rows(self, rows):
+        for slot, doc_id, metadata, alive in rows:
+            if slot >= len(self._ids):
+                self._ids.extend([None] * (slot + 1 - len(self._ids)))
+            self._ids[slot] = doc_id
+            self._slot_of[doc_id] = slot
+            self._set_columns(slot, json.loads(metadata) if alive else None)
+
+    def _set_columns(self, slot: int, metadata: dict | None):
+        self._alive[slot] = metadata is not None
+        for key, column in self._columns.items():
+            if metadata is None or key not in metadata:
+                column.clear(slot)
+        for key, value in (metadata or {}).items():
+            column = self._columns.get(key)
+            if column is None:
+                if value is None:
+                    continue
+                column = self._columns[key] = _Column(self._capacity, isinstance(value, (int, float)))
+            column.set(slot, value)
+
+    def _encode(self, vectors: np.ndarray) -> tuple[np.ndarray, np.ndarray | None]:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+        if self.dtype == "float16":
+            return vectors.astype(np.float16), None
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+    # --- WRITES ---
+    @contextmanager
+    def _writing(self):
+        """ A write transaction on an up-to-date state; if it fails, the state is rebuilt from what was committed. """
+        with self._lock:
+            try:
+                with self._pool.transaction() as conn:
+                    self._refresh(conn)
+                    yield conn
+            except BaseException:
+                with self._pool.connection() as conn:
+                    self._reload(conn)
+                raise
+
+    def upsert(self, ids: list[str], embeddings, documents: list[str] | None = None,
+               metadatas: list[dict] | None = None):
+        """ Inserts or overwrites rows with pre-computed embeddings. """
+        if not ids:
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim != 2 or len(vectors) != len(ids):
+            raise ValueError(f"Expected {len(ids)} embeddings, got an array of shape {vectors.shape}.")
+        documents = documents or [None] * len(ids)
+        metadatas = [metadata or {} for metadata in (metadatas or [None] * len(ids))]
+        # A repeated ID keeps its last occurrence, as in one Chroma upsert.
+        latest = {doc_id: i for i, doc_id in enumerate(ids)}
+        order = list(latest.values())
+        encoded, scales = self._encode(vectors[order])
+
+        with self._writing() as conn:
+            if self._dimensions is None:
+                self._dimensions = vectors.shape[1]
+                db.set_meta(conn, "dimensions", self._dimensions)
+            elif vectors.shape[1] != self._dimensions:
+                raise ValueError(f"Embeddings have {vectors.shape[1]} dimensions; this store holds {self._dimensions}.")
+            slots = []
+            for i in order:
+                slot = self._slot_of.get(ids[i])
+                if slot is None:
+                    slot, self._slots = self._slots, self._slots + 1
+                slots.append(slot)
+            if self._slots > self._capacity:
+                self._map(max(self._slots, 2 * self._capacity, INITIAL_CAPACITY))
+            slot_array = np.asarray(slots)
+            self._vectors[slot_array] = encoded
+            self._vectors.flush()
+            if scales is not None:
+                self._scales[slot_array] = scales
+                self._scales.flush()
+
+            generation = self._generation + 1
+            conn.executemany(SQL_UPSERT_ROW, [
+                (slot, ids[i], documents[i], json.dumps(metadatas[i]), generation) for slot, i in zip(slots, order)
+            ])
+            db.set_meta(conn, "slots", self._slots)
+            db.set_meta(conn, "generation", generation)
+            for slot, i in zip(slots, order):
+                if slot >= len(self._ids):
+                    self._ids.extend([None] * (slot + 1 - len(self._ids)))
+                self._ids[slot] = ids[i]
+                self._slot_of[ids[i]] = slot
+                self._set_columns(slot, metadatas[i])
+            self._generation = generation
+            self._stats["upserts"] += len(order)
+
+    def add_texts(self, texts: list[str], metadatas: list[dict] | None = None,
+                  ids: list[str] | None = None, **kwargs) -> list[str]:
+        if self.embedding_function is None:
+            raise ValueError("This vector store was opened without an embedding function.")
+        texts = list(texts)
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        self.upsert(ids, self.embedding_function.embed_documents(texts), texts, metadatas)
+        return ids
+
+    def add_documents(self, documents: list[Document], ids: list[str] | None = None, **kwargs) -> list[str]:
+        """ Embeds and upserts documents; existing IDs are updated in place. """
+        return self.add_texts([doc.page_content for doc in documents], [doc.metadata for doc in documents], ids)
+
+    def delete(self, ids: list[str] | None = None, **kwargs):
+        """ Tombstones the given IDs; searches skip them until compaction reclaims their rows. """
+        if not ids:
+            return
+        with self._lock:
+            with self._writing() as conn:
+                slots = [self._slot_of[doc_id] for doc_id in dict.fromkeys(ids)
+                         if doc_id in self._slot_of and self._alive[self._slot_of[doc_id]]]
+                if not slots:
+                    return
+                generation = self._generation + 1
+                conn.executemany(SQL_TOMBSTONE_ROW, [(generation, self._ids[slot]) for slot in slots])
+                db.set_meta(conn, "generation", generation)
+                for slot in slots:
+                    self._set_columns(slot, None)
+                self._generation = generation
+                self._stats["deletes"] += len(slots)
+            tombstones = self._slots - int(self._alive[:self._slots].sum())
+            if tombstones >= COMPACT_MIN_TOMBSTONES and tombstones >= COMPACT_RATIO * self._slots:
+                self.compact()
+
+    def compact(self):
+        """
+        Rewrites the live rows into a new, dense vector file and renumbers
+        their slots. Readers in other processes see the new epoch and reload;
+        the old files are removed once the new ones are committed.
+        """
+        with self._lock:
+            with self._writing() as conn:
+                if self._dimensions is None:
+                    return
+                live = np.flatnonzero(self._alive[:self._slots])
+                old_files = self._files(self._epoch)
+                new_epoch = self._epoch + 1
+                vectors_path, scales_path = self._files(new_epoch)
+                capacity = max(INITIAL_CAPACITY, len(live))
+                vectors = np.memmap(vectors_path, dtype=self.dtype, mode="w+", shape=(capacity, self._dimensions))
+                scales = (np.memmap(scales_path, dtype=np.float32, mode="w+", shape=(capacity,))
+                          if self.dtype == "int8" else None)
+                for start in range(0, len(live), BLOCK_ROWS):
+                    block = live[start:start + BLOCK_ROWS]
+                    vectors[start:start + len(block)] = self._vectors[block]
+                    if scales is not None:
+                        scales[start:start + len(block)] = self._scales[block]
+                vectors.flush()
+                if scales is not None:
+                    scales.flush()
+                del vectors, scales
+
+                conn.execute(SQL_PURGE_TOMBSTONES)
+                # Ascending order never moves a row onto a slot that is still taken.
+                conn.executemany(SQL_MOVE_SLOT, [(new, int(old)) for new, old in enumerate(live) if new != old])
+                db.set_meta(conn, "epoch", new_epoch)
+                db.set_meta(conn, "slots", len(live))
+                db.set_meta(conn, "generation", self._generation + 1)
+                self._reload(conn)
+            self._stats["compactions"] += 1
+            logger.info("Compacted %s: %d live rows kept.", self._persist_directory, len(live))
+            for path in old_files:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass  # Missing, or still mapped by a reader on Windows; harmless either way.
+
+    # --- READS ---
+    def count(self) -> int:
+        with self._lock:
+            with self._pool.connection() as conn:
+                self._refresh(conn)
+            return int(self._alive[:self._slots].sum())
+
+    def _mask(self, where: dict, n: int) -> np.ndarray:
+        masks = []
+        for key, condition in where.items():
+            if key in ("$and", "$or"):
+                parts = [self._mask(clause, n) for clause in condition]
+                combine = np.logical_and if key == "$and" else np.logical_or
+                masks.append(combine.reduce(parts) if parts else np.ones(n, dtype=bool))
+                continue
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            column = self._columns.get(key)
+            for op, operand in condition.items():
+                if op not in _COMPARE and op not in ("$in", "$nin"):
+                    raise ValueError(f"Unsupported filter operator '{op}'.")
+                masks.append(column.mask(op, operand, n) if column is not None else np.zeros(n, dtype=bool))
+        return np.logical_and.reduce(masks) if masks else np.ones(n, dtype=bool)
+
+    def _snapshot(self, where: dict | None):
+        """ The arrays a search needs, plus the slots it may return, taken under the lock. """
+        with self._lock:
+            with self._pool.connection() as conn:
+                self._refresh(conn)
+            n = self._slots
+            selected = self._alive[:n] & self._mask(where, n) if where else self._alive[:n].copy()
+            # Slots only change IDs on compaction, which replaces the list, so no copy is needed.
+            return self._vectors, self._scales, self._ids, selected
+
+    def _score(self, vectors, scales, rows, query: np.ndarray) -> np.ndarray:
+        block = vectors[rows].astype(np.float32)
+        scores = block @ query
+        return scores * scales[rows] if scales is not None else scores
+
+    def similarity_search_by_vector_with_score(self, embedding, k: int = 4,
+                                               filter: dict | None = None) -> list[tuple[Document, float]]:
+        """ The k nearest live rows passing `filter`, with their cosine similarity (higher is closer). """
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        query = query / norm if norm else query
+        vectors, scales, ids, selected = self._snapshot(filter)
+        with self._lock:
+            self._stats["searches"] += 1
+        if vectors is None or k <= 0:
+            return []
+        candidates = np.flatnonzero(selected)
+        if not len(candidates):
+            return []
+        best_slots = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        if len(candidates) < GATHER_FRACTION * len(selected):
+            blocks = (candidates[start:start + BLOCK_ROWS] for start in range(0, len(candidates), BLOCK_ROWS))
+        else:
+            blocks = (slice(start, min(start + BLOCK_ROWS, len(selected))) for start in range(0, len(selected), BLOCK_ROWS))
+        for rows in blocks:
+            scores = self._score(vectors, scales, rows, query)
+            slots = rows if isinstance(rows, np.ndarray) else np.arange(rows.start, rows.stop)
+            if isinstance(rows, slice):
+                keep = selected[rows]
+                slots, scores = slots[keep], scores[keep]
+            if len(scores) > k:
+                top = np.argpartition(-scores, k - 1)[:k]
+                slots, scores = slots[top], scores[top]
+            best_slots = np.concatenate([best_slots, slots])
+            best_scores = np.concatenate([best_scores, scores])
+            if len(best_scores) > k:
+                top = np.argpartition(-best_scores, k - 1)[:k]
+                best_slots, best_scores = best_slots[top], best_scores[top]
+        order = np.argsort(-best_scores)
+        ranked = [(ids[best_slots[i]], float(best_scores[i])) for i in order]
+        rows = self._fetch([doc_id for doc_id, _ in ranked])
+        return [(Document(page_content=rows[doc_id][0] or "", metadata=rows[doc_id][1]), score)
+                for doc_id, score in ranked if doc_id in rows]
+
+    def similarity_search_by_vector(self, embedding, k: int = 4, filter: dict | None = None,
+                                    **kwargs) -> list[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, filter)]
+
+    def similarity_search(self, query: str, k: int = 4, filter: dict | None = None, **kwargs) -> list[Document]:
+        return self.similarity_search_by_vector(self.embedding_function.embed_query(query), k, filter)
+
+    def _fetch(self, ids: list[str]) -> dict[str, tuple[str, dict]]:
+        """ Texts and metadata of live rows by ID (a row deleted since the search is left out). """
+        rows = {}
+        with self._pool.connection() as conn:
+            for start in range(0, len(ids), SQLITE_MAX_PARAMS):
+                chunk = ids[start:start + SQLITE_MAX_PARAMS]
+                placeholders = ",".join("?" * len(chunk))
+                sql = f"SELECT id, document, metadata FROM vectors WHERE alive = 1 AND id IN ({placeholders})"
+                for doc_id, document, metadata in conn.execute(sql, chunk):
+                    rows[doc_id] = (document, json.loads(metadata))
+        return rows
+
+    def get(self, ids: list[str] | None = None, where: dict | None = None, limit: int | None = None,
+            offset: int | None = None, include=("metadatas", "documents")) -> dict:
+        """ Live rows by ID and/or filter, shaped like Chroma's get() result. """
+        if ids is None and where is None:
+            with self._pool.connection() as conn:
+                rows = conn.execute(SQL_LIVE_DOCUMENTS).fetchall()
+            selected_ids = [row[0] for row in rows]
+            fetched = {doc_id: (document, json.loads(metadata)) for doc_id, document, metadata in rows}
+        else:
+            vectors, scales, slot_ids, selected = self._snapshot(where)
+            if ids is not None:
+                with self._lock:
+                    slots = [self._slot_of.get(doc_id) for doc_id in ids]
+                selected_ids = [doc_id for doc_id, slot in zip(ids, slots)
+                                if slot is not None and slot < len(selected) and selected[slot]]
+            else:
+                selected_ids = [slot_ids[slot] for slot in np.flatnonzero(selected)]
+            fetched = None
+        selected_ids = selected_ids[offset or 0:][:limit] if limit is not None else selected_ids[offset or 0:]
+        if fetched is None:
+            fetched = self._fetch(selected_ids)
+        selected_ids = [doc_id for doc_id in selected_ids if doc_id in fetched]
+        result = {"ids": selected_ids, "metadatas": None, "documents": None, "embeddings": None}
+        if "metadatas" in include:
+            result["metadatas"] = [fetched[doc_id][1] for doc_id in selected_ids]
+        if "documents" in include:
+            result["documents"] = [fetched[doc_id][0] for doc_id in selected_ids]
+        if "embeddings" in include:
+            with self._lock:
+                slots = np.asarray([self._slot_of[doc_id] for doc_id in selected_ids], dtype=np.int64)
+                vectors = self._vectors[slots].astype(np.float32) if len(slots) else np.empty((0, 0), np.float32)
+                if self._scales is not None and len(slots):
+                    vectors *= self._scales[slots][:, None]
+            result["embeddings"] = vectors.tolist()
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            live = int(self._alive[:self._slots].sum())
+            row_bytes = (self._dimensions or 0) * np.dtype(self.dtype).itemsize + (4 if self.dtype == "int8" else 0)
+            return {
+                "backend": "numpy",
+                "dtype": self.dtype,
+                "dimensions": self._dimensions,
+                "live": live,
+                "tombstones": self._slots - live,
+                "capacity": self._capacity,
+                "file_bytes": self._capacity * row_bytes,
+                "epoch": self._epoch,
+                **self._stats,
+            }